@@ -0,0 +1,249 @@
+"""
+babel-validate: validate a NodeNorm and/or NameRes target against the Google Sheet test cases in one batch.
+
+This runs the same checks as tests/nodenorm/test_nodenorm_from_gsheet.py and
+tests/nameres/test_nameres_from_gsheet.py, but without pytest: the selected
+rows are compiled into query plans (see ``core/query_plan.py``), every
+distinct request is sent once through the cached clients, and each row is
+then evaluated against the cached responses with the pure functions in
+``core/evaluation.py``.  Every evaluated assertion is written as one record to
+a JSON Lines or CSV file, e.g.:
+
+    babel-validate --target dev --service nodenorm --category 'Unit Tests' --output results.jsonl
+
+The exit status is 1 if any row that is expected to pass failed, or any row
+that is expected to fail passed (as with pytest's strict xfail), and 0
+otherwise.
+"""
+
+import argparse
+import configparser
+import csv
+import json
+import logging
+import sys
+import urllib.parse
+from collections import Counter
+from pathlib import Path
+
+from .core.evaluation import evaluate_lookup, evaluate_normalization
+from .core.query_plan import NameResQueryPlan, NodeNormQueryPlan
+from .core.testrow import TestResult, TestRow, TestStatus
+from .services.batching import PartialBatchError
+from .services.http import SessionSettings
+from .services.nameres import CachedNameRes
+from .services.nodenorm import CachedNodeNorm
+from .services.persistent_cache import PersistentCache
+from .sources.google_sheets.google_sheet_test_cases import GoogleSheetTestCases, make_category_filter, parse_csv
+
+logger = logging.getLogger(__name__)
+
+RECORD_FIELDS = ('row', 'category', 'service', 'query', 'params', 'expected_to_pass', 'status', 'message')
+
+
+def load_test_rows(args) -> list[tuple[int, TestRow]]:
+    """
+    Load the selected test rows, from a CSV file if one was specified or from the Google Sheet otherwise.
+
+    :return: A list of (row number in the sheet, TestRow) for every non-empty row in the selected categories.
+    """
+    if args.csv:
+        _, parsed_rows = parse_csv(Path(args.csv).read_text(encoding='utf-8'))
+    else:
+        parsed_rows = GoogleSheetTestCases(args.google_sheet_id).parsed_rows
+
+    category_test = make_category_filter(set(args.category), set(args.category_exclude))
+    # As in GoogleSheetTestCases.test_rows(), the row number is off by two from the position: one for the header
+    # row, and one because Google Sheets counts from one.
+    return [(count + 2, test_row) for count, test_row in enumerate(parsed_rows)
+            if test_row is not None and category_test(test_row.Category)]
+
+
+def validate_nodenorm(test_rows: list[tuple[int, TestRow]], nodenorm: CachedNodeNorm):
+    """ Evaluate every row against NodeNorm, yielding a (row number, TestRow, params, query ID, TestResult) for each
+    identifier that was checked. """
+    plan = NodeNormQueryPlan.from_rows(test_row for _, test_row in test_rows)
+    logger.info("Validating %s with %s", nodenorm, plan)
+    plan.execute(nodenorm)
+
+    for row_count, test_row in test_rows:
+        try:
+            params = test_row.nodenorm_params()
+        except ValueError as e:
+            yield row_count, test_row, {}, '', TestResult(TestStatus.Failed, str(e))
+            continue
+
+        for query_id in sorted(test_row.nodenorm_query_ids()):
+            test_summary = f"Queried {query_id} ({test_row.PreferredLabel}) on {nodenorm.nodenorm_url} with params " \
+                           f"{params} and test_row {test_row}"
+            try:
+                result = nodenorm.normalize_curie(query_id, **params)
+            except PartialBatchError as e:
+                yield row_count, test_row, params, query_id, \
+                    TestResult(TestStatus.Failed, f"{test_summary} but the request failed: {e}")
+                continue
+            yield row_count, test_row, params, query_id, \
+                evaluate_normalization(test_row, query_id, result, test_summary)
+
+
+def validate_nameres(test_rows: list[tuple[int, TestRow]], nameres: CachedNameRes, limit, xfail_if_in_top: int,
+                     max_workers: int | None = None):
+    """ Evaluate every row against NameRes, yielding a (row number, TestRow, params, label, TestResult) for each
+    lookup that was checked. """
+    plan = NameResQueryPlan.from_rows((test_row for _, test_row in test_rows), limit)
+    logger.info("Validating %s with %s", nameres, plan)
+    plan.execute(nameres, max_workers=max_workers)
+
+    nameres_url_lookup = urllib.parse.urljoin(nameres.nameres_url, 'lookup')
+    for row_count, test_row in test_rows:
+        if not test_row.PreferredID:
+            yield row_count, test_row, {}, '', \
+                TestResult(TestStatus.Skipped, f"Test row {test_row} cannot be tested without a preferred ID.")
+            continue
+
+        count_tested_labels = 0
+        for label in sorted(test_row.nameres_query_labels()):
+            for biolink_class in sorted(test_row.nameres_biolink_classes()):
+                params = test_row.nameres_lookup_params(biolink_class, limit)
+                test_summary = f"querying {nameres_url_lookup} with label '{label}' and biolink_type " \
+                               f"{params['biolink_type']}"
+                count_tested_labels += 1
+                try:
+                    results = nameres.lookup(label, **params)
+                except Exception as e:
+                    yield row_count, test_row, params, label, \
+                        TestResult(TestStatus.Failed, f"Could not send request {params} to {nameres_url_lookup}: {e}")
+                    continue
+                yield row_count, test_row, params, label, \
+                    evaluate_lookup(test_row, biolink_class, results, limit, xfail_if_in_top, test_summary)
+
+        if count_tested_labels == 0:
+            yield row_count, test_row, {}, '', \
+                TestResult(TestStatus.Failed, f"No labels were tested for test row: {test_row}")
+
+
+def write_records(records: list[dict], output: str, output_format: str) -> None:
+    """ Write the records to output ('-' for standard output) as JSON Lines ('jsonl') or CSV ('csv'). """
+    f = sys.stdout if output == '-' else open(output, 'w', encoding='utf-8', newline='')
+    try:
+        if output_format == 'csv':
+            writer = csv.DictWriter(f, fieldnames=RECORD_FIELDS)
+            writer.writeheader()
+            for record in records:
+                writer.writerow({**record, 'params': json.dumps(record['params'], sort_keys=True)})
+        else:
+            for record in records:
+                f.write(json.dumps(record) + "\n")
+    finally:
+        if f is not sys.stdout:
+            f.close()
+
+
+def get_target(args) -> configparser.SectionProxy:
+    """ Return the settings for the target: the --target section of --targets-ini, overridden by any URLs. """
+    targets = configparser.ConfigParser()
+    if args.target:
+        if not targets.read(args.targets_ini, encoding='utf8'):
+            raise RuntimeError(f"Could not read targets file {args.targets_ini}")
+        if args.target not in targets:
+            raise RuntimeError(f"Could not find target '{args.target}' in {args.targets_ini}.")
+        target_info = targets[args.target]
+    else:
+        targets.read_dict({'command-line': {'NameResLimit': '20', 'NameResXFailIfInTop': '5'}})
+        target_info = targets['command-line']
+    if args.nodenorm_url:
+        target_info['NodeNormURL'] = args.nodenorm_url
+    if args.nameres_url:
+        target_info['NameResURL'] = args.nameres_url
+    return target_info
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog='babel-validate',
+        description="Validate a NodeNorm and/or NameRes target against the Babel test cases in a single batch.")
+    parser.add_argument('--target', help="The target to validate, from the targets file.")
+    parser.add_argument('--targets-ini', default='tests/targets.ini',
+                        help="The targets file to read --target from (default: %(default)s).")
+    parser.add_argument('--nodenorm-url', help="The NodeNorm URL to validate (overrides the target's NodeNormURL).")
+    parser.add_argument('--nameres-url', help="The NameRes URL to validate (overrides the target's NameResURL).")
+    parser.add_argument('--service', choices=['nodenorm', 'nameres', 'both'], default='both',
+                        help="The service(s) to validate (default: %(default)s).")
+    parser.add_argument('--csv', help="Read test cases from this CSV file instead of the Google Sheet.")
+    parser.add_argument('--google-sheet-id', default="11zebx8Qs1Tc3ShQR9nh4HRW8QSoo8k65w_xIaftN0no",
+                        help="The Google Sheet to read test cases from (default: %(default)s).")
+    parser.add_argument('--category', default=[], action='append', help="The categories of tests to run.")
+    parser.add_argument('--category-exclude', default=[], action='append',
+                        help="The categories of tests to exclude.")
+    parser.add_argument('--output', default='-',
+                        help="The file to write results to, or '-' for standard output (default: %(default)s).")
+    parser.add_argument('--format', choices=['jsonl', 'csv'],
+                        help="The output format (default: csv if --output ends with .csv, otherwise jsonl).")
+    parser.add_argument('--persistent-cache', action='store_true',
+                        help="Store responses in the persistent on-disk cache shared with the pytest suite.")
+    parser.add_argument('--propagate-equivalents', action='store_true',
+                        help="Cache each NodeNorm clique for all of its equivalent identifiers.")
+    parser.add_argument('--log-level', default='WARNING', help="The logging level (default: %(default)s).")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=args.log_level.upper())
+
+    target_info = get_target(args)
+    services = ['nodenorm', 'nameres'] if args.service == 'both' else [args.service]
+    for service, url_key in (('nodenorm', 'NodeNormURL'), ('nameres', 'NameResURL')):
+        if service in services and not target_info.get(url_key):
+            parser.error(f"No {url_key} to validate: specify --target or --{service}-url.")
+
+    test_rows = load_test_rows(args)
+    persistent_cache = PersistentCache() if args.persistent_cache else None
+    settings = SessionSettings.from_target_info(target_info)
+
+    evaluations = []
+    if 'nodenorm' in services:
+        nodenorm = CachedNodeNorm.from_url(target_info['NodeNormURL'], persistent_cache,
+                                           propagate_equivalents=args.propagate_equivalents,
+                                           session_settings=settings)
+        for evaluation in validate_nodenorm(test_rows, nodenorm):
+            evaluations.append(('nodenorm', evaluation, evaluation[1].ExpectPassInNodeNorm))
+    if 'nameres' in services:
+        nameres = CachedNameRes.from_url(target_info['NameResURL'], persistent_cache,
+                                         lookup_timeout_seconds=float(target_info.get('NameResTimeout', 10)),
+                                         session_settings=settings)
+        for evaluation in validate_nameres(test_rows, nameres, target_info['NameResLimit'],
+                                           int(target_info['NameResXFailIfInTop']),
+                                           max_workers=int(target_info.get('HTTPPoolSize', 10))):
+            evaluations.append(('nameres', evaluation, evaluation[1].ExpectPassInNameRes))
+
+    records = []
+    row_outcomes = {}
+    for service, (row_count, test_row, params, query, result), expected_to_pass in evaluations:
+        records.append({
+            'row': row_count,
+            'category': test_row.Category,
+            'service': service,
+            'query': query,
+            'params': params,
+            'expected_to_pass': expected_to_pass,
+            'status': result.status.value,
+            'message': result.message,
+        })
+        # As with pytest, the outcome of a row is that of its first assertion that didn't pass.
+        outcome = row_outcomes.get((service, row_count), (expected_to_pass, TestStatus.Passed))
+        if outcome[1] == TestStatus.Passed:
+            row_outcomes[(service, row_count)] = (expected_to_pass, result.status)
+
+    output_format = args.format or ('csv' if args.output.endswith('.csv') else 'jsonl')
+    write_records(records, args.output, output_format)
+
+    outcomes = Counter(row_outcomes.values())
+    unexpected_failures = outcomes[(True, TestStatus.Failed)]
+    unexpected_passes = outcomes[(False, TestStatus.Passed)]
+    expected_failures = outcomes.total() - outcomes[(True, TestStatus.Passed)] - unexpected_failures - unexpected_passes
+    print(f"{outcomes[(True, TestStatus.Passed)]} rows passed, {unexpected_failures} rows failed, "
+          f"{expected_failures} rows failed as expected, {unexpected_passes} rows unexpectedly passed.",
+          file=sys.stderr)
+
+    return 1 if unexpected_failures or unexpected_passes else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
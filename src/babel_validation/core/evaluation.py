@@ -0,0 +1,129 @@
+"""
+Pure evaluation functions for the expectations in a TestRow.
+
+Each function takes a TestRow and a service response (already fetched, e.g.
+from a cached client) and returns a TestResult, without doing any I/O.  The
+Google Sheet pytest modules and the ``babel-validate`` command line tool both
+use these functions, so they apply exactly the same checks.
+
+A TestResult is Passed, Failed, or Skipped; Skipped is used for results that
+pytest reports as expected failures (xfail), such as a NameRes lookup that
+returns the expected CURIE close to (but not at) the top of the results.
+"""
+
+from .testrow import TestResult, TestRow, TestStatus
+
+
+def evaluate_normalization(test_row: TestRow, query_id: str, result: dict | None, test_summary: str) -> TestResult:
+    """
+    Evaluate the NodeNorm result for one of a row's identifiers.
+
+    :param test_row: The row being tested.
+    :param query_id: The identifier that was normalized.
+    :param result: The NodeNorm result for query_id (None if it could not be normalized).
+    :param test_summary: A description of the request, used as the start of every message.
+    """
+    preferred_label = test_row.PreferredLabel
+    expected_id = test_row.PreferredID
+
+    if not result:
+        if 'negative' in test_row.Flags:
+            return TestResult(TestStatus.Passed, f"{test_summary} not found in NodeNorm as expected.")
+        return TestResult(TestStatus.Failed,
+                          f"{test_summary} but NodeNorm could not normalize {query_id} and returned null")
+
+    if 'id' not in result:
+        return TestResult(TestStatus.Failed, f"{test_summary} but no 'id' in result: {result}")
+
+    # Test preferred identifier
+    if result['id']['identifier'] != expected_id:
+        return TestResult(TestStatus.Failed,
+                          f"{test_summary} but normalized to {result['id']['identifier']} ({result['id']['label']}), "
+                          f"not expected identifier {expected_id}.")
+
+    # Test preferred label
+    if preferred_label and result['id']['label'].lower() != preferred_label.lower():
+        return TestResult(TestStatus.Failed, f"{test_summary} but preferred label is {result['id']['label']}, not "
+                                             f"expected label {preferred_label}.")
+
+    # Test Biolink types
+    biolink_types = set(result['type'])
+    for biolink_type in sorted(test_row.BiolinkClasses):
+        if not biolink_type:
+            continue
+        elif biolink_type.startswith('!'):
+            biolink_type = biolink_type[1:]
+            if biolink_type in biolink_types:
+                return TestResult(TestStatus.Failed, f"{test_summary} excluded biolink type {biolink_type} found in "
+                                                     f"types: {result['type']}")
+        elif biolink_type not in biolink_types:
+            return TestResult(TestStatus.Failed, f"{test_summary} biolink type {biolink_type} not found in types: "
+                                                 f"{result['type']}")
+
+    return TestResult(TestStatus.Passed, f"{test_summary} normalized to {expected_id} as expected.")
+
+
+def evaluate_lookup(test_row: TestRow, biolink_class: str, results: list[dict], limit, xfail_if_in_top: int,
+                    test_summary: str) -> TestResult:
+    """
+    Evaluate the NameRes lookup results for one of a row's labels with one of its Biolink classes.
+
+    :param test_row: The row being tested.
+    :param biolink_class: The Biolink class from test_row.BiolinkClasses that the label was looked up with. An
+        excluded class (starting with '!') is checked against the types of the top result.
+    :param results: The NameRes lookup results.
+    :param limit: The number of results that were requested.
+    :param xfail_if_in_top: If the expected CURIE is not the top result but is at this index or better, the
+        result is Skipped (an expected failure) rather than Failed.
+    :param test_summary: A description of the request, used as the start of every message.
+    """
+    expected_id = test_row.PreferredID
+    source_info = f"{test_row.Source} ({test_row.SourceURL})"
+    biolink_class_exclude = biolink_class[1:] if biolink_class.startswith('!') else ''
+
+    # All curies
+    all_curies = [result['curie'] for result in results]
+
+    # Check for negative results
+    if 'negative' in test_row.Flags:
+        if not results:
+            return TestResult(TestStatus.Passed, f"Negative test {test_summary} successful: no results found.")
+        if expected_id in all_curies:
+            expected_index = all_curies.index(expected_id)
+            return TestResult(TestStatus.Failed, f"Negative test {test_summary} found expected CURIE {expected_id} "
+                                                 f"in top {limit} results: {results[expected_index]}")
+        return TestResult(TestStatus.Passed, f"Negative test {test_summary} did not find expected ID {expected_id} "
+                                             f"in top {limit} results.")
+
+    # There are three possible responses:
+    if not results:
+        # 1. We got back no results.
+        return TestResult(TestStatus.Failed, f"No results for {test_summary} from {source_info}")
+    elif expected_id == '':
+        return TestResult(TestStatus.Failed, f"No expected CURIE for {test_summary} from {source_info}: best result "
+                                             f"is {results[0]}")
+    elif results[0]['curie'] == expected_id:
+        # 2. The expected CURIE is the top result.
+        top_result = results[0]
+
+        # Test the preferred label if there is one.
+        if test_row.PreferredLabel and top_result['label'].lower() != test_row.PreferredLabel.lower():
+            return TestResult(TestStatus.Failed, f"{test_summary} returned preferred label {top_result['label']} "
+                                                 f"instead of {test_row.PreferredLabel}.")
+
+        # Additionally, test the biolink_class_exclude field if there is one.
+        if biolink_class_exclude and biolink_class_exclude in top_result['types']:
+            return TestResult(TestStatus.Failed, f"Biolink types for {top_result['curie']} are {top_result['types']}, "
+                                                 f"which includes {biolink_class_exclude} which should be excluded.")
+
+        return TestResult(TestStatus.Passed, f"{test_summary} returned expected ID {expected_id} as top result")
+    elif expected_id in all_curies:
+        # 3. The expected CURIE is in the results, but not at the top.
+        expected_index = all_curies.index(expected_id)
+        message = f"{test_summary} returns {results[0]['curie']} ('{results[0]['label']}') as the top result, but " \
+                  f"{expected_id} is at {expected_index} index."
+        if expected_index <= xfail_if_in_top:
+            return TestResult(TestStatus.Skipped, message)
+        return TestResult(TestStatus.Failed, message)
+    else:
+        return TestResult(TestStatus.Failed, f"{test_summary} but expected result {expected_id} not found: {results}")
@@ -0,0 +1,149 @@
+"""
+Query plans: the deduplicated service requests needed by a set of TestRows.
+
+Many rows share the same Query ID, Preferred ID or label, so checking each
+row independently repeats the same requests many times.  A query plan
+compiles the selected rows into the set of distinct requests, and records
+for each request the rows (and the assertion within each row) that depend on
+it.  Executing a plan sends each distinct request once, through a cached
+client, so that the rows' tests are then answered from the client's cache.
+
+``NodeNormQueryPlan.from_rows()`` plans the ``get_normalized_nodes`` requests
+made by the Google Sheet NodeNorm tests, and ``NameResQueryPlan.from_rows()``
+plans the ``lookup`` requests made by the Google Sheet NameRes tests.
+"""
+
+from collections import defaultdict
+from collections.abc import Iterable
+from dataclasses import dataclass
+
+from .testrow import TestRow
+from ..services.batching import PartialBatchError
+from ..services.nameres import NameResService
+from ..services.nodenorm import NodeNormService
+
+
+@dataclass(frozen=True, slots=True)
+class PlannedRequest:
+    """A single service request: an identifier or label, with its params as ``frozenset(params.items())``."""
+    query: str
+    params: frozenset
+
+    def __str__(self):
+        return f"{self.query} {dict(sorted(self.params))}"
+
+
+@dataclass(frozen=True, slots=True)
+class Dependent:
+    """A row that depends on a planned request, and which of its assertions does (e.g. 'QueryID')."""
+    row: TestRow
+    assertion: str
+
+
+class QueryPlan:
+    """
+    The distinct requests needed by a set of rows, with the rows and assertions that depend on each one.
+    """
+
+    def __init__(self):
+        self.dependents: dict[PlannedRequest, list[Dependent]] = defaultdict(list)
+        self.rows_planned = 0
+
+    def add(self, query: str, params: dict, row: TestRow, assertion: str) -> None:
+        """Record that *assertion* in *row* needs the request for *query* with *params*."""
+        self.dependents[PlannedRequest(query, frozenset(params.items()))].append(Dependent(row, assertion))
+
+    @property
+    def total_requests(self) -> int:
+        """The number of requests the rows would make without deduplication."""
+        return sum(len(dependents) for dependents in self.dependents.values())
+
+    @property
+    def unique_requests(self) -> int:
+        """The number of distinct requests in this plan."""
+        return len(self.dependents)
+
+    @property
+    def dedup_ratio(self) -> float:
+        """The number of requests the rows would make for each distinct request (1.0 means no duplication)."""
+        return self.total_requests / self.unique_requests if self.dependents else 1.0
+
+    def __str__(self):
+        return (f"{type(self).__name__}({self.rows_planned} rows, {self.total_requests} requests, "
+                f"{self.unique_requests} distinct, dedup ratio {self.dedup_ratio:.2f})")
+
+
+class NodeNormQueryPlan(QueryPlan):
+    @staticmethod
+    def from_rows(rows: Iterable[TestRow]) -> 'NodeNormQueryPlan':
+        """
+        Plan the NodeNorm requests for every identifier of every row, with the row's conflation params.
+
+        Rows with unknown conflations are left out, since their tests fail without making any requests.
+        """
+        plan = NodeNormQueryPlan()
+        for row in rows:
+            try:
+                params = row.nodenorm_params()
+            except ValueError:
+                continue
+            plan.rows_planned += 1
+            for assertion, identifiers in (('QueryID', [row.QueryID]), ('PreferredID', [row.PreferredID]),
+                                           ('AdditionalIDs', row.AdditionalIDs)):
+                for identifier in identifiers:
+                    if identifier:
+                        plan.add(identifier, params, row, assertion)
+        return plan
+
+    def execute(self, nodenorm: NodeNormService) -> dict[PlannedRequest, dict | None | Exception]:
+        """
+        Normalize every planned identifier with one normalize_curies() call per combination of params.
+
+        :return: The result of every planned request, or the exception that stopped it.
+        """
+        curies_by_params = defaultdict(set)
+        for request in self.dependents:
+            curies_by_params[request.params].add(request.query)
+
+        results = {}
+        for params_key, curies in curies_by_params.items():
+            try:
+                params_results = nodenorm.normalize_curies(sorted(curies), **dict(params_key))
+                failures = {}
+            except PartialBatchError as e:
+                params_results = e.results
+                failures = {curie: exception for chunk, exception in e.failures.items() for curie in chunk}
+            for curie in curies:
+                request = PlannedRequest(curie, params_key)
+                results[request] = failures[curie] if curie in failures else params_results.get(curie)
+        return results
+
+
+class NameResQueryPlan(QueryPlan):
+    @staticmethod
+    def from_rows(rows: Iterable[TestRow], limit) -> 'NameResQueryPlan':
+        """
+        Plan the NameRes lookups for every label of every row, with each of the row's Biolink classes.
+
+        Rows without a PreferredID are left out, since their tests are xfailed without making any requests.
+        """
+        plan = NameResQueryPlan()
+        for row in rows:
+            if not row.PreferredID:
+                continue
+            plan.rows_planned += 1
+            for label in row.nameres_query_labels():
+                for biolink_class in row.nameres_biolink_classes():
+                    plan.add(label, row.nameres_lookup_params(biolink_class, limit), row,
+                             f"label '{label}' with biolink_type '{biolink_class}'")
+        return plan
+
+    def execute(self, nameres: NameResService, max_workers: int | None = None) -> dict[PlannedRequest, list | Exception]:
+        """
+        Look up every planned request once, concurrently.
+
+        :return: The result of every planned request, or the exception that stopped it.
+        """
+        results = nameres.lookup_many([(request.query, dict(request.params)) for request in self.dependents],
+                                      max_workers=max_workers)
+        return {PlannedRequest(query, params_key): result for (query, params_key), result in results.items()}
@@ -1,25 +1,35 @@
+import sys
 from dataclasses import dataclass
 from enum import Enum
 
 
-@dataclass(frozen=True)
+def _split_interned(value: str) -> frozenset[str]:
+    """ Split a '|'-separated cell into a frozenset of interned strings. """
+    return frozenset(map(sys.intern, value.split('|')))
+
+
+@dataclass(frozen=True, slots=True)
 class TestRow:
     """
     A TestRow models a single row from a GoogleSheet.
+
+    TestRows are immutable and hashable: multi-valued cells are stored as tuples or frozensets, and the strings
+    that repeat across many rows (categories, flags, conflations, Biolink classes, prefixes and sources) are
+    interned.
     """
     Category: str
     ExpectPassInNodeNorm: bool
     ExpectPassInNameRes: bool
-    Flags: set[str]
+    Flags: frozenset[str]
     QueryLabel: str
     PreferredLabel: str
-    AdditionalLabels: list[str]
+    AdditionalLabels: tuple[str, ...]
     QueryID: str
     PreferredID: str
-    AdditionalIDs: list[str]
-    Conflations: set[str]
-    BiolinkClasses: set[str]
-    Prefixes: set[str]
+    AdditionalIDs: tuple[str, ...]
+    Conflations: frozenset[str]
+    BiolinkClasses: frozenset[str]
+    Prefixes: frozenset[str]
     Source: str
     SourceURL: str
     Notes: str
@@ -32,26 +42,80 @@ class TestRow:
         return f"TestRow of category {self.Category} for preferred {self.PreferredID} ({self.PreferredLabel}) with " + \
             f"query {self.QueryID} ({self.QueryLabel}) from source {self.Source} ({self.SourceURL})"
 
+    def nodenorm_query_ids(self) -> set[str]:
+        """ The identifiers to normalize for this row: the query ID, the preferred ID and any additional IDs. """
+        query_ids = {self.QueryID, self.PreferredID}
+        query_ids.update(self.AdditionalIDs)
+        return {query_id for query_id in query_ids if query_id}
+
+    def nodenorm_params(self) -> dict[str, str]:
+        """
+        The NodeNorm get_normalized_nodes parameters needed for this row's Conflations.
+
+        :raises ValueError: If Conflations includes a conflation we don't know about.
+        """
+        params = {'conflate': 'false'}
+        leftover_conflations = set(self.Conflations) - {''}
+        if 'gene_protein' in leftover_conflations:
+            params['conflate'] = 'true'
+            leftover_conflations.remove('gene_protein')
+        if 'drug_chemical' in leftover_conflations:
+            params['drug_chemical_conflate'] = 'true'
+            leftover_conflations.remove('drug_chemical')
+        if leftover_conflations:
+            raise ValueError(f"Unknown conflations in {self}: {leftover_conflations}")
+        return params
+
+    def nameres_query_labels(self) -> set[str]:
+        """ The labels to look up for this row: the query label, the preferred label and any additional labels. """
+        query_labels = {self.QueryLabel, self.PreferredLabel}
+        query_labels.update(self.AdditionalLabels)
+        return {label.strip() for label in query_labels if label.strip()}
+
+    def nameres_biolink_classes(self) -> frozenset[str]:
+        """ The Biolink classes to look up this row's labels with, including '' so we also test without a class. """
+        return self.BiolinkClasses | {''}
+
+    def nameres_lookup_params(self, biolink_class: str, limit) -> dict[str, str]:
+        """
+        The NameRes lookup parameters for looking up one of this row's labels with a particular Biolink class.
+
+        :param biolink_class: One of this row's BiolinkClasses. An excluded class (starting with '!') is looked up
+            without a Biolink type, as the exclusion is checked against the results.
+        :param limit: The maximum number of results to request.
+        """
+        params = {
+            'autocomplete': 'true' if 'autocomplete' in self.Flags else 'false',
+            'biolink_type': '' if biolink_class.startswith('!') else biolink_class,
+            'limit': limit,
+        }
+        if self.Prefixes:
+            only_prefixes = sorted(prefix for prefix in self.Prefixes if not prefix.startswith('^'))
+            exclude_prefixes = sorted(prefix[1:] for prefix in self.Prefixes if prefix.startswith('^'))
+            params['only_prefixes'] = "|".join(only_prefixes)
+            params['exclude_prefixes'] = "|".join(exclude_prefixes)
+        return params
 
     @staticmethod
     def from_data_row(row):
+        get = row.get
         return TestRow(
-            Category=row.get('Category', ''),
-            ExpectPassInNodeNorm=row.get('Passes in NodeNorm', '').strip().lower() == 'y',
-            ExpectPassInNameRes=row.get('Passes in NameRes', '').strip().lower() == 'y',
-            Flags=set(row.get('Flags', '').split('|')),
-            QueryLabel=row.get('Query Label', ''),
-            QueryID=row.get('Query ID', ''),
-            PreferredID=row.get('Preferred ID', ''),
-            AdditionalIDs=row.get('Additional IDs', '').split('|'),
-            PreferredLabel=row.get('Preferred Label', ''),
-            AdditionalLabels=row.get('Additional Labels', '').split('|'),
-            Conflations=set(row.get('Conflations', '').split('|')),
-            BiolinkClasses=set(row.get('Biolink Classes', '').split('|')),
-            Prefixes=set(row.get('Prefixes', '').split('|')),
-            Source=row.get('Source', ''),
-            SourceURL=row.get('Source URL', ''),
-            Notes=row.get('Notes', '')
+            Category=sys.intern(get('Category', '')),
+            ExpectPassInNodeNorm=get('Passes in NodeNorm', '').strip().lower() == 'y',
+            ExpectPassInNameRes=get('Passes in NameRes', '').strip().lower() == 'y',
+            Flags=_split_interned(get('Flags', '')),
+            QueryLabel=get('Query Label', ''),
+            QueryID=get('Query ID', ''),
+            PreferredID=get('Preferred ID', ''),
+            AdditionalIDs=tuple(get('Additional IDs', '').split('|')),
+            PreferredLabel=get('Preferred Label', ''),
+            AdditionalLabels=tuple(get('Additional Labels', '').split('|')),
+            Conflations=_split_interned(get('Conflations', '')),
+            BiolinkClasses=_split_interned(get('Biolink Classes', '')),
+            Prefixes=_split_interned(get('Prefixes', '')),
+            Source=sys.intern(get('Source', '')),
+            SourceURL=get('Source URL', ''),
+            Notes=get('Notes', '')
         )
 
 class TestStatus(Enum):
@@ -0,0 +1,106 @@
+from collections import defaultdict
+from collections.abc import Callable, Iterable
+
+from .testrow import TestRow
+
+
+def curie_prefix(curie: str) -> str:
+    """ Return the prefix of a CURIE (e.g. 'CHEBI' for 'CHEBI:15365'), or '' if it doesn't have one. """
+    prefix, sep, _ = curie.partition(':')
+    return prefix if sep else ''
+
+
+class TestRowIndex:
+    """
+    In-memory indexes over a list of TestRows, so that rows can be selected without rescanning them.
+
+    Rows are identified by their position in the list passed to the constructor; positions whose TestRow is None
+    (i.e. empty rows) are not indexed. The indexed fields are:
+
+    - category: The Category.
+    - preferred_id: The PreferredID.
+    - query_id: The QueryID.
+    - preferred_prefix: The prefix of the PreferredID.
+    - prefix: The prefixes of the QueryID, the PreferredID and every AdditionalID.
+    - biolink_class: Each of the BiolinkClasses (including excluded classes, which start with '!').
+    - conflation: Each of the Conflations.
+    - source: The Source.
+    - flag: Each of the Flags.
+    """
+
+    # Mark as not a test despite starting with Test*.
+    __test__ = False
+
+    FIELDS = ('category', 'preferred_id', 'query_id', 'preferred_prefix', 'prefix', 'biolink_class', 'conflation',
+              'source', 'flag')
+
+    def __init__(self, test_rows: list[TestRow | None]):
+        self.test_rows = test_rows
+        self.indexes = {field: defaultdict(set) for field in self.FIELDS}
+        for position, test_row in enumerate(test_rows):
+            if test_row is None:
+                continue
+            for field, values in self._values(test_row).items():
+                index = self.indexes[field]
+                for value in values:
+                    index[value].add(position)
+
+    @staticmethod
+    def _values(test_row: TestRow) -> dict[str, Iterable[str]]:
+        """ The values of each indexed field for a single TestRow. """
+        identifiers = [test_row.QueryID, test_row.PreferredID, *test_row.AdditionalIDs]
+        return {
+            'category': [test_row.Category],
+            'preferred_id': [test_row.PreferredID] if test_row.PreferredID else [],
+            'query_id': [test_row.QueryID] if test_row.QueryID else [],
+            'preferred_prefix': [curie_prefix(test_row.PreferredID)] if test_row.PreferredID else [],
+            'prefix': {curie_prefix(identifier) for identifier in identifiers if identifier},
+            'biolink_class': [c for c in test_row.BiolinkClasses if c],
+            'conflation': [c for c in test_row.Conflations if c],
+            'source': [test_row.Source],
+            'flag': [f for f in test_row.Flags if f],
+        }
+
+    def values(self, field: str) -> dict[str, int]:
+        """ Return every value of an indexed field with the number of rows that have it. """
+        return {value: len(positions) for value, positions in self._index(field).items()}
+
+    def _index(self, field: str) -> dict[str, set[int]]:
+        if field not in self.indexes:
+            raise ValueError(f"Unknown field '{field}', expected one of: {', '.join(self.FIELDS)}")
+        return self.indexes[field]
+
+    def positions_where(self, field: str, predicate: Callable[[str], bool]) -> set[int]:
+        """ Return the positions of the rows with a value of field that predicate returns True for. """
+        positions = set()
+        for value, value_positions in self._index(field).items():
+            if predicate(value):
+                positions |= value_positions
+        return positions
+
+    def query(self, **criteria: str | Iterable[str]) -> list[int]:
+        """
+        Return the positions of the rows that match every criterion, in order.
+
+        Each keyword is an indexed field, and its value is either a single value or a collection of values (any
+        of which may match). For example, every row whose PreferredID is a CHEBI identifier and that uses the
+        drug_chemical conflation:
+
+            index.query(preferred_prefix='CHEBI', conflation='drug_chemical')
+
+        With no criteria, every indexed row is returned.
+        """
+        positions = None
+        for field, wanted in criteria.items():
+            index = self._index(field)
+            wanted_values = [wanted] if isinstance(wanted, str) else wanted
+            field_positions = set()
+            for value in wanted_values:
+                field_positions |= index.get(value, set())
+            positions = field_positions if positions is None else positions & field_positions
+            if not positions:
+                return []
+
+        if positions is None:
+            return [position for position, test_row in enumerate(self.test_rows) if test_row is not None]
+        return sorted(positions)
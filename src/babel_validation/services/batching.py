@@ -0,0 +1,44 @@
+"""
+Helpers for splitting bulk service requests into chunks.
+
+The bulk clients split their uncached inputs into chunks of at most
+``max_batch_size`` items and dispatch them concurrently on a bounded thread
+pool.  Chunks that succeed are merged into the cache as soon as they finish,
+so a failing chunk never throws away work that has already been done; the
+failures are reported together at the end as a ``PartialBatchError``.
+"""
+
+from collections.abc import Iterable, Iterator
+
+
+def chunked(items: Iterable, size: int) -> Iterator[list]:
+    """Yield successive lists of at most *size* items from *items*."""
+    if size < 1:
+        raise ValueError(f"Chunk size must be at least 1, not {size}")
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+class PartialBatchError(RuntimeError):
+    """Raised when some chunks of a bulk request failed but others succeeded.
+
+    :ivar results: The ``{input: result}`` mapping for every input that was resolved (from the cache or from a
+        successful chunk).  These results have already been cached.
+    :ivar failures: A ``{tuple of inputs: exception}`` mapping for every chunk that failed.
+    """
+
+    def __init__(self, message: str, results: dict, failures: dict[tuple, Exception]):
+        super().__init__(message)
+        self.results = results
+        self.failures = failures
+
+    @property
+    def failed_inputs(self) -> set:
+        """Every input that belonged to a failed chunk."""
+        return {item for chunk in self.failures for item in chunk}
@@ -0,0 +1,346 @@
+"""
+In-memory response cache shared by the cached service clients.
+
+A ``ResponseCache`` behaves like a dict keyed by ``(identifier, params_key)``,
+where ``params_key`` is ``frozenset(params.items())``.  It can optionally be
+backed by a ``PersistentNamespace`` (see ``persistent_cache.py``): misses in
+memory fall through to the persistent store, and every write goes to both.
+Iteration and ``len()`` only cover the in-memory entries.
+
+Eviction
+--------
+By default the in-memory cache is unbounded: entries are never evicted
+automatically.  Pass an ``EvictionPolicy`` to bound it.  A policy has
+separate ``CacheBudget``s for positive (non-null) and null responses, since
+they differ by orders of magnitude in size, and each budget can cap the number
+of entries (evicting the least recently used first), the approximate number
+of bytes (measured as the size of the response serialized as JSON), and the
+age of entries.  Evicted entries remain in the persistent store, if any.
+
+Invalidation
+------------
+Each segment keeps a secondary index from identifier to the param variants
+cached for it, so ``invalidate()`` and ``invalidate_many()`` cost time
+proportional to the number of variants removed rather than to the size of the
+cache.  ``invalidate_where()`` applies a predicate to each distinct
+identifier (e.g. to drop every CURIE with a given prefix).
+
+Shared values
+-------------
+Many keys can have identical responses: NodeNorm returns the same clique for
+every CURIE in it.  Pass a ``share_key`` function to store such responses
+once.  ``share_key(key, value)`` returns a hashable key identifying the
+shared value (e.g. the clique's preferred identifier plus the params), or
+``None`` if the value should not be shared.  When a value is stored and an
+equal value is already cached under the same share key, the cache keeps a
+reference to the existing value instead.  Shared values are reference
+counted, and are dropped once no entry refers to them.  Byte budgets still
+count a shared value once per entry.
+
+Thread safety and request coalescing
+------------------------------------
+A ``ResponseCache`` may be shared by many threads.  Its lock only guards the
+in-memory bookkeeping and is never held while a request is in flight.
+
+To avoid two threads fetching the same entry, a client first ``claim()``s the
+keys it is missing.  Keys that no other thread is fetching are returned as
+owned, and the client must eventually either ``put_many()`` them (which wakes
+up any waiters) or ``release()`` them with the exception that stopped it.
+Keys already being fetched by another thread are returned as futures that
+resolve to that thread's result.  Coroutines (see ``nodenorm_async.py`` and
+``nameres_async.py``) follow the same protocol, and wait for keys that others
+are fetching with ``await_claimed()``.
+"""
+
+import asyncio
+import json
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Callable, Hashable, Iterable, Iterator, MutableMapping
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+
+from .persistent_cache import MISSING, PersistentNamespace
+
+
+@dataclass(frozen=True)
+class CacheBudget:
+    """Limits on one segment of a ``ResponseCache``; ``None`` means unlimited."""
+    max_entries: int | None = None
+    max_bytes: int | None = None
+    ttl_seconds: float | None = None
+
+
+@dataclass(frozen=True)
+class EvictionPolicy:
+    """Separate budgets for positive (non-null) and null responses."""
+    positive: CacheBudget = field(default_factory=CacheBudget)
+    null: CacheBudget = field(default_factory=CacheBudget)
+
+
+def approximate_size(value) -> int:
+    """Approximate the memory used by a cached response by the length of its compact JSON serialization."""
+    return len(json.dumps(value, separators=(',', ':')))
+
+
+class _SharedValues:
+    """A reference-counted table of values shared between cache entries: ``{share_key: [value, refcount]}``."""
+
+    def __init__(self, share_key: Callable[[tuple[str, frozenset], object], Hashable | None]):
+        self.share_key = share_key
+        self.values = {}
+
+    def acquire(self, key, value):
+        """Return the shared value equal to *value* if there is one (otherwise *value*), taking a reference to it."""
+        share_key = self.share_key(key, value)
+        if share_key is None:
+            return value
+        item = self.values.get(share_key)
+        if item is None:
+            self.values[share_key] = [value, 1]
+            return value
+        if item[0] is value or item[0] == value:
+            item[1] += 1
+            return item[0]
+        # A different value under the same share key (e.g. the service was updated): don't share it.
+        return value
+
+    def release(self, key, value) -> None:
+        share_key = self.share_key(key, value)
+        if share_key is None:
+            return
+        item = self.values.get(share_key)
+        if item is not None and item[0] is value:
+            item[1] -= 1
+            if item[1] == 0:
+                del self.values[share_key]
+
+
+class _CacheSegment:
+    """An LRU-ordered map of ``key -> (value, stored_at, size)`` that enforces a single ``CacheBudget``.
+
+    ``params_by_identifier`` indexes the keys by identifier: ``{identifier: {params_key, ...}}``.
+    """
+
+    def __init__(self, budget: CacheBudget, shared: _SharedValues | None = None):
+        self.budget = budget
+        self.shared = shared
+        self.entries = OrderedDict()
+        self.params_by_identifier = {}
+        self.total_bytes = 0
+        self.evictions = 0
+        self._tracks_recency = budget.max_entries is not None or budget.max_bytes is not None
+
+    def _expired(self, stored_at: float, now: float) -> bool:
+        return self.budget.ttl_seconds is not None and now - stored_at >= self.budget.ttl_seconds
+
+    def get(self, key, now: float):
+        item = self.entries.get(key)
+        if item is None:
+            return MISSING
+        value, stored_at, _ = item
+        if self._expired(stored_at, now):
+            self.pop(key)
+            self.evictions += 1
+            return MISSING
+        if self._tracks_recency:
+            self.entries.move_to_end(key)
+        return value
+
+    def put(self, key, value, now: float) -> None:
+        self.pop(key)
+        if self.shared is not None:
+            value = self.shared.acquire(key, value)
+        size = approximate_size(value) if self.budget.max_bytes is not None else 0
+        self.entries[key] = (value, now, size)
+        self.total_bytes += size
+        identifier, params_key = key
+        self.params_by_identifier.setdefault(identifier, set()).add(params_key)
+
+    def pop(self, key) -> bool:
+        item = self.entries.pop(key, None)
+        if item is None:
+            return False
+        self.total_bytes -= item[2]
+        if self.shared is not None:
+            self.shared.release(key, item[0])
+        identifier, params_key = key
+        variants = self.params_by_identifier[identifier]
+        variants.discard(params_key)
+        if not variants:
+            del self.params_by_identifier[identifier]
+        return True
+
+    def pop_identifier(self, identifier: str) -> None:
+        """Remove every param variant of *identifier*."""
+        for params_key in list(self.params_by_identifier.get(identifier, ())):
+            self.pop((identifier, params_key))
+
+    def evict(self, now: float) -> None:
+        """Evict least recently used entries until this segment is within its budget."""
+        budget = self.budget
+        while self.entries:
+            oldest_key, (_, stored_at, _) = next(iter(self.entries.items()))
+            over_budget = (
+                (budget.max_entries is not None and len(self.entries) > budget.max_entries) or
+                (budget.max_bytes is not None and self.total_bytes > budget.max_bytes) or
+                self._expired(stored_at, now)
+            )
+            if not over_budget:
+                break
+            self.pop(oldest_key)
+            self.evictions += 1
+
+
+async def await_claimed(future: Future):
+    """Wait for a key that another caller claimed (a future returned by ``ResponseCache.claim()``) from a coroutine.
+
+    Cancelling the waiting coroutine doesn't cancel *future*, which other callers may also be waiting on.
+    """
+    return await asyncio.shield(asyncio.wrap_future(future))
+
+
+class ResponseCache(MutableMapping):
+    def __init__(self, backing: PersistentNamespace | None = None, policy: EvictionPolicy | None = None,
+                 share_key: Callable[[tuple[str, frozenset], object], Hashable | None] | None = None):
+        self.backing = backing
+        self.policy = policy if policy is not None else EvictionPolicy()
+        # Null responses are never shared, so only positive entries need the shared-value table.
+        self.shared = _SharedValues(share_key) if share_key is not None else None
+        self.positive = _CacheSegment(self.policy.positive, self.shared)
+        self.null = _CacheSegment(self.policy.null)
+        self._in_flight = {}
+        self._lock = threading.RLock()
+
+    def __str__(self):
+        return f"ResponseCache({len(self)} entries, backing={self.backing})"
+
+    def _get_local(self, key, now: float):
+        value = self.positive.get(key, now)
+        if value is MISSING:
+            value = self.null.get(key, now)
+        return value
+
+    def _put_local(self, entries: dict, now: float) -> None:
+        for key, value in entries.items():
+            segment, other = (self.null, self.positive) if value is None else (self.positive, self.null)
+            other.pop(key)
+            segment.put(key, value, now)
+        self.positive.evict(now)
+        self.null.evict(now)
+
+    def __getitem__(self, key: tuple[str, frozenset]):
+        with self._lock:
+            value = self._get_local(key, time.monotonic())
+        if value is not MISSING:
+            return value
+        if self.backing is not None:
+            value = self.backing.get(*key)
+            if value is not MISSING:
+                with self._lock:
+                    self._put_local({key: value}, time.monotonic())
+                return value
+        raise KeyError(key)
+
+    def __contains__(self, key) -> bool:
+        try:
+            self[key]
+        except KeyError:
+            return False
+        return True
+
+    def __setitem__(self, key: tuple[str, frozenset], value) -> None:
+        self.put_many({key: value})
+
+    def __delitem__(self, key: tuple[str, frozenset]) -> None:
+        with self._lock:
+            found = self.positive.pop(key) or self.null.pop(key)
+        if self.backing is not None:
+            self.backing.delete(*key)
+        elif not found:
+            raise KeyError(key)
+
+    def __iter__(self) -> Iterator[tuple[str, frozenset]]:
+        with self._lock:
+            return iter(list(self.positive.entries) + list(self.null.entries))
+
+    def __len__(self) -> int:
+        return len(self.positive.entries) + len(self.null.entries)
+
+    @property
+    def evictions(self) -> int:
+        """The number of entries evicted from memory so far."""
+        return self.positive.evictions + self.null.evictions
+
+    def put_many(self, entries: dict[tuple[str, frozenset], object], persist: bool = True) -> None:
+        """Store many entries at once; persistent writes are batched into a single transaction.
+
+        Any thread waiting on one of these keys (see ``claim()``) is woken up with its value.  Pass
+        ``persist=False`` to only store the entries in memory.
+        """
+        if persist and self.backing is not None:
+            self.backing.put_many(entries)
+        with self._lock:
+            self._put_local(entries, time.monotonic())
+            futures = [(self._in_flight.pop(key), value) for key, value in entries.items() if key in self._in_flight]
+        for future, value in futures:
+            future.set_result(value)
+
+    def claim(self, keys: Iterable[tuple[str, frozenset]]) -> tuple[set, dict[tuple[str, frozenset], Future]]:
+        """Claim the right to fetch *keys* that aren't cached yet.
+
+        :return: A tuple of the set of keys this caller now owns and must fetch (and then either ``put_many()``
+            or ``release()``), and a ``{key: Future}`` mapping for keys that another caller is already fetching.
+            Keys that were cached in the meantime are in neither.
+        """
+        owned = set()
+        waiting = {}
+        with self._lock:
+            now = time.monotonic()
+            for key in keys:
+                if self._get_local(key, now) is not MISSING:
+                    continue
+                if key in self._in_flight:
+                    waiting[key] = self._in_flight[key]
+                else:
+                    self._in_flight[key] = Future()
+                    owned.add(key)
+        return owned, waiting
+
+    def release(self, keys: Iterable[tuple[str, frozenset]], exception: BaseException) -> None:
+        """Give up on fetching *keys*, failing anyone waiting on them with *exception*."""
+        with self._lock:
+            futures = [self._in_flight.pop(key) for key in keys if key in self._in_flight]
+        for future in futures:
+            future.set_exception(exception)
+
+    def invalidate(self, identifier: str) -> None:
+        """Remove every entry for *identifier*, across every param variant."""
+        self.invalidate_many([identifier])
+
+    def invalidate_many(self, identifiers: Iterable[str]) -> None:
+        """Remove every entry for each of *identifiers*, across every param variant.
+
+        Persistent deletes are batched into a single transaction.
+        """
+        identifiers = set(identifiers)
+        with self._lock:
+            for identifier in identifiers:
+                self.positive.pop_identifier(identifier)
+                self.null.pop_identifier(identifier)
+        if self.backing is not None:
+            self.backing.delete_many(identifiers)
+
+    def invalidate_where(self, predicate: Callable[[str], bool]) -> set[str]:
+        """Remove every entry whose identifier satisfies *predicate*, e.g. ``lambda curie: curie.startswith('CHEBI:')``.
+
+        :return: The set of identifiers that were invalidated.
+        """
+        with self._lock:
+            identifiers = set(self.positive.params_by_identifier) | set(self.null.params_by_identifier)
+        if self.backing is not None:
+            identifiers.update(self.backing.identifiers())
+        matching = {identifier for identifier in identifiers if predicate(identifier)}
+        self.invalidate_many(matching)
+        return matching
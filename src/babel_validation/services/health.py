@@ -0,0 +1,134 @@
+"""
+Per-target health tracking, so that requests to a target that is down fail fast.
+
+When a target is down or overloaded, every request to it waits out its full
+timeout and retries, and a test run against it can stall for hours.
+``get_health()`` returns one ``TargetHealth`` per base URL, shared by every
+pooled session for that URL (see ``http.py``), and so by the cached clients
+and the pytest fixtures that use those sessions.
+
+A ``TargetHealth`` is a circuit breaker:
+
+- While the circuit is closed, requests are sent as usual.  Every connection
+  error, timeout, broken response or gateway error (after retries) is recorded
+  as a failure, and every other response resets the count.
+- After ``failure_threshold`` consecutive failures the circuit opens: requests
+  to the target raise ``CircuitOpenError`` immediately, without being sent.
+- Once ``probe_interval_seconds`` have passed, a single request is let through
+  as a probe.  If it succeeds the circuit closes again; if it fails the circuit
+  stays open for another interval.
+
+``CircuitOpenError`` is a ``requests.ConnectionError``, so code that already
+handles connection errors (e.g. the partial batch handling in the cached
+clients) handles an open circuit in the same way.
+"""
+
+import logging
+import threading
+import time
+from dataclasses import dataclass
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+health_by_url = {}
+_health_lock = threading.Lock()
+
+
+class CircuitOpenError(requests.ConnectionError):
+    """Raised instead of sending a request to a target whose circuit is open."""
+
+
+@dataclass(frozen=True)
+class HealthSettings:
+    """When to open the circuit for a target, and how often to probe it once it is open."""
+    failure_threshold: int = 5
+    probe_interval_seconds: float = 30.0
+
+
+class TargetHealth:
+    def __init__(self, base_url: str, settings: HealthSettings | None = None):
+        self.base_url = base_url
+        self.settings = settings if settings is not None else HealthSettings()
+        self.consecutive_failures = 0
+        self.last_failure = None
+        self.opened_at = None
+        self.probing = False
+        self._lock = threading.Lock()
+
+    def __str__(self):
+        return f"TargetHealth({self.base_url})"
+
+    @property
+    def is_open(self) -> bool:
+        """True if requests to this target are currently being rejected."""
+        return self.opened_at is not None
+
+    @property
+    def is_rejecting(self) -> bool:
+        """True if the circuit is open and a request sent now would be rejected rather than sent as a probe."""
+        with self._lock:
+            return self.opened_at is not None and (
+                self.probing or time.monotonic() - self.opened_at < self.settings.probe_interval_seconds)
+
+    @property
+    def reason(self) -> str:
+        """Why the circuit is open (or '' if it is closed)."""
+        if not self.is_open:
+            return ''
+        return (f"{self.base_url} is unhealthy: {self.consecutive_failures} consecutive requests failed, most "
+                f"recently with {self.last_failure!r}")
+
+    def before_request(self) -> None:
+        """
+        Check that a request may be sent to this target.
+
+        :raises CircuitOpenError: If the circuit is open, unless it is time to let a probe request through.
+        """
+        with self._lock:
+            if self.opened_at is None:
+                return
+            if not self.probing and time.monotonic() - self.opened_at >= self.settings.probe_interval_seconds:
+                self.probing = True
+                logger.info("Probing %s after %.0fs", self, time.monotonic() - self.opened_at)
+                return
+            raise CircuitOpenError(self.reason)
+
+    def record_success(self) -> None:
+        """Record that a request to this target succeeded, closing the circuit if it was open."""
+        with self._lock:
+            if self.opened_at is not None:
+                logger.warning("Closing the circuit for %s: the target is responding again", self)
+            self.consecutive_failures = 0
+            self.opened_at = None
+            self.probing = False
+
+    def cancel_probe(self) -> None:
+        """Let another request through as a probe, when the current probe failed without reaching the target."""
+        with self._lock:
+            self.probing = False
+
+    def record_failure(self, failure) -> None:
+        """Record that a request to this target failed, opening the circuit after too many failures in a row."""
+        with self._lock:
+            self.consecutive_failures += 1
+            self.last_failure = failure
+            if self.probing or (self.opened_at is None
+                                and self.consecutive_failures >= self.settings.failure_threshold):
+                if self.opened_at is None:
+                    logger.warning("Opening the circuit for %s after %d consecutive failures (most recently %r)",
+                                   self, self.consecutive_failures, failure)
+                self.opened_at = time.monotonic()
+                self.probing = False
+
+
+def get_health(base_url: str, settings: HealthSettings | None = None) -> TargetHealth:
+    """Return the shared health tracker for *base_url*, creating it on first use.
+
+    *settings* is only used when the tracker is first created.
+    """
+    with _health_lock:
+        if base_url not in health_by_url:
+            health_by_url[base_url] = TargetHealth(base_url, settings)
+        return health_by_url[base_url]
@@ -0,0 +1,394 @@
+"""
+Pooled HTTP sessions shared by the service clients and test modules.
+
+Connection reuse
+----------------
+A bare ``requests.get()`` opens (and then discards) a new connection, so every
+call pays for a fresh TCP and TLS handshake.  ``get_session()`` instead returns
+one ``requests.Session`` per base URL, with a connection pool that keeps
+connections alive between requests.  The cached clients and the pytest
+fixtures in ``tests/conftest.py`` both go through ``get_session()``, so a test
+run shares a single pool per target.  The settings of a session are fixed by
+the first ``get_session()`` call for its base URL, so callers should pass the
+target's ``SessionSettings`` (e.g. to ``CachedNodeNorm.from_url()``); a later
+call with different settings logs a warning and gets the existing session.
+
+Retry policy
+------------
+Connection errors, read errors and transient gateway statuses (502, 503, 504
+by default, or ``HTTPRetryStatuses``) are retried with exponential backoff
+(``HTTPBackoffFactor``), plus a random jitter of up to ``HTTPBackoffJitter``
+seconds so that concurrent workers don't retry in lockstep.  The NodeNorm and
+NameRes POST endpoints used here are read-only lookups, so POSTs are retried
+as well.  Once retries are exhausted the last response is returned as-is, so
+callers can still inspect ``response.ok`` or call ``raise_for_status()``.
+
+Hedged requests
+---------------
+If ``HTTPHedgePercentile`` is set for a target (e.g. 95), a request that is
+still waiting for a response after that percentile of the latencies observed
+so far (once there are at least ``HTTPHedgeMinSamples`` of them) is sent a
+second time, and whichever response arrives first is used.  This trades a few
+duplicate requests for a shorter tail when a target has the occasional stuck
+request.  The delay is measured from when the request is actually sent, after
+any wait for the rate limits, and a request is only hedged if the session has
+a free worker (one per pooled connection) and the rate limits let the hedge
+through at once, so that hedging doesn't add load to a saturated target.
+
+Every session counts its requests, retries and hedged requests in a
+``RequestStats`` (``session.stats``), which the pytest terminal summary
+reports for each target (see ``metrics.py``).
+
+Timeouts and health tracking
+----------------------------
+Every request gets a default timeout (``HTTPTimeout`` in ``targets.ini``), so
+that a request to a target that never answers can't hang a test run.  Each
+session is also linked to the ``TargetHealth`` for its base URL (see
+``health.py``): once ``CircuitFailureThreshold`` requests in a row have
+failed, further requests raise ``CircuitOpenError`` without being sent, until
+a probe request (sent every ``CircuitProbeInterval`` seconds) succeeds.
+
+Rate limits
+-----------
+If ``RateLimitPerSecond`` (with an optional ``RateLimitBurst``) or
+``MaxConcurrentRequests`` is set for a target, every request first waits for
+the ``RateGovernor`` for its base URL (see ``rate_limit.py``), which enforces
+those limits across every process on this machine, e.g. all pytest-xdist
+workers.
+"""
+
+import contextlib
+import logging
+import threading
+import time
+from collections import deque
+from collections.abc import Callable
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from .health import HealthSettings, TargetHealth, get_health
+from .rate_limit import RateGovernor, RateLimitSettings, get_governor
+
+logger = logging.getLogger(__name__)
+
+sessions_by_url = {}
+_settings_by_url = {}
+_sessions_lock = threading.Lock()
+
+
+@dataclass(frozen=True)
+class SessionSettings:
+    """Connection pool and retry settings for a pooled session."""
+    pool_size: int = 10
+    max_retries: int = 3
+    backoff_factor: float = 0.5
+    backoff_jitter: float = 0.5
+    retry_statuses: tuple[int, ...] = (502, 503, 504)
+    timeout_seconds: float = 30.0
+    hedge_percentile: float | None = None
+    hedge_min_samples: int = 20
+    health: HealthSettings = HealthSettings()
+    rate_limit: RateLimitSettings = RateLimitSettings()
+
+    @staticmethod
+    def from_target_info(target_info) -> 'SessionSettings':
+        """Read the optional ``HTTPPoolSize``, ``HTTPMaxRetries``, ``HTTPBackoffFactor``, ``HTTPBackoffJitter``,
+        ``HTTPRetryStatuses``, ``HTTPTimeout``, ``HTTPHedgePercentile``, ``HTTPHedgeMinSamples``,
+        ``CircuitFailureThreshold``, ``CircuitProbeInterval``, ``RateLimitPerSecond``, ``RateLimitBurst`` and
+        ``MaxConcurrentRequests`` settings from a section of ``targets.ini``, falling back to the defaults for any
+        that are missing."""
+        defaults = SessionSettings()
+
+        def optional(key, convert):
+            value = target_info.get(key, '')
+            return convert(value) if value else None
+
+        return SessionSettings(
+            pool_size=int(target_info.get('HTTPPoolSize', defaults.pool_size)),
+            max_retries=int(target_info.get('HTTPMaxRetries', defaults.max_retries)),
+            backoff_factor=float(target_info.get('HTTPBackoffFactor', defaults.backoff_factor)),
+            backoff_jitter=float(target_info.get('HTTPBackoffJitter', defaults.backoff_jitter)),
+            retry_statuses=optional('HTTPRetryStatuses',
+                                    lambda value: tuple(int(status) for status in value.split(',')))
+            or defaults.retry_statuses,
+            timeout_seconds=float(target_info.get('HTTPTimeout', defaults.timeout_seconds)),
+            hedge_percentile=optional('HTTPHedgePercentile', float),
+            hedge_min_samples=int(target_info.get('HTTPHedgeMinSamples', defaults.hedge_min_samples)),
+            health=HealthSettings(
+                failure_threshold=int(target_info.get('CircuitFailureThreshold',
+                                                      defaults.health.failure_threshold)),
+                probe_interval_seconds=float(target_info.get('CircuitProbeInterval',
+                                                             defaults.health.probe_interval_seconds)),
+            ),
+            rate_limit=RateLimitSettings(
+                requests_per_second=optional('RateLimitPerSecond', float),
+                burst=optional('RateLimitBurst', int),
+                max_concurrent=optional('MaxConcurrentRequests', int),
+            ),
+        )
+
+
+class RequestStats:
+    """How many requests a pooled session has sent, how often they were retried or hedged, and their most recent
+    latencies."""
+
+    def __init__(self, max_samples: int = 1000):
+        self.requests = 0
+        self.retries = 0
+        self.hedged = 0
+        self.hedges_won = 0
+        self.latencies = deque(maxlen=max_samples)
+        self._lock = threading.Lock()
+
+    def __str__(self):
+        return (f"{self.requests} requests, {self.retries} retries, {self.hedged} hedged "
+                f"({self.hedges_won} answered first by the hedge)")
+
+    def as_dict(self) -> dict[str, int]:
+        with self._lock:
+            return {'requests': self.requests, 'retries': self.retries, 'hedged': self.hedged,
+                    'hedges_won': self.hedges_won}
+
+    def record_request(self, latency_seconds: float) -> None:
+        with self._lock:
+            self.requests += 1
+            self.latencies.append(latency_seconds)
+
+    def record_retry(self) -> None:
+        with self._lock:
+            self.retries += 1
+
+    def record_hedge(self, won: bool = False) -> None:
+        """Record that a request was hedged (or, if *won*, that the hedge answered first)."""
+        with self._lock:
+            if won:
+                self.hedges_won += 1
+            else:
+                self.hedged += 1
+
+    def percentile(self, percentile: float, min_samples: int = 1) -> float | None:
+        """The given percentile of the recent latencies in seconds, or None if there are fewer than *min_samples*."""
+        with self._lock:
+            latencies = sorted(self.latencies)
+        if not latencies or len(latencies) < min_samples:
+            return None
+        return latencies[min(len(latencies) - 1, int(len(latencies) * percentile / 100))]
+
+
+class InstrumentedRetry(Retry):
+    """A urllib3 ``Retry`` that counts every retry it allows in a ``RequestStats``."""
+
+    def __init__(self, *args, stats: RequestStats | None = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stats = stats
+
+    def new(self, **kw):
+        # urllib3 makes a new Retry for every attempt, which must keep counting into the same stats.
+        retry = super().new(**kw)
+        retry.stats = self.stats
+        return retry
+
+    def increment(self, *args, **kwargs):
+        # increment() raises MaxRetryError once retries are exhausted, so only a return means a retry will be sent.
+        retry = super().increment(*args, **kwargs)
+        if self.stats is not None:
+            self.stats.record_retry()
+        return retry
+
+
+class PooledSession(requests.Session):
+    """A ``requests.Session`` that applies a default timeout, waits for a ``RateGovernor`` before every request,
+    reports every request to a ``TargetHealth``, and hedges requests that take longer than *hedge_percentile* of
+    the recent latencies in *stats*."""
+
+    def __init__(self, timeout_seconds: float, health: TargetHealth | None = None,
+                 failure_statuses: tuple[int, ...] = (), governor: RateGovernor | None = None,
+                 stats: RequestStats | None = None, hedge_percentile: float | None = None,
+                 hedge_min_samples: int = 20, pool_size: int = 10):
+        super().__init__()
+        self.timeout_seconds = timeout_seconds
+        self.health = health
+        self.failure_statuses = failure_statuses
+        self.governor = governor
+        self.stats = stats if stats is not None else RequestStats()
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_samples = hedge_min_samples
+        self.pool_size = pool_size
+        self._hedge_executor = None
+        self._hedge_executor_lock = threading.Lock()
+        self._hedge_workers_busy = 0
+
+    def request(self, method, url, *args, **kwargs):
+        kwargs.setdefault('timeout', self.timeout_seconds)
+        if self.health is not None:
+            self.health.before_request()
+
+        hedge_after = None
+        if self.hedge_percentile is not None:
+            hedge_after = self.stats.percentile(self.hedge_percentile, self.hedge_min_samples)
+
+        try:
+            if hedge_after is None:
+                response = self._send(method, url, *args, **kwargs)
+            else:
+                response = self._send_hedged(hedge_after, method, url, *args, **kwargs)
+        except requests.RequestException as e:
+            # Includes connection errors, timeouts and responses that broke off part-way.
+            if self.health is not None:
+                self.health.record_failure(e)
+            raise
+        except BaseException:
+            # Anything else didn't tell us whether the target is healthy, but mustn't leave a probe outstanding.
+            if self.health is not None:
+                self.health.cancel_probe()
+            raise
+
+        if self.health is not None:
+            if response.status_code in self.failure_statuses:
+                self.health.record_failure(f"HTTP {response.status_code} from {method} {url}")
+            else:
+                self.health.record_success()
+        return response
+
+    def _send(self, method, url, *args, on_start: Callable[[], None] | None = None, blocking: bool = True,
+              **kwargs):
+        """Send a single request (including its retries) once the governor allows it, and record its latency.
+
+        *on_start* is called once the governor has let the request through. If *blocking* is False and the governor
+        would make the request wait, it isn't sent and None is returned.
+        """
+        with self.governor.request(blocking) if self.governor is not None else contextlib.nullcontext(True) \
+                as allowed:
+            if not allowed:
+                return None
+            if on_start is not None:
+                on_start()
+            time_started = time.monotonic()
+            response = super().request(method, url, *args, **kwargs)
+            self.stats.record_request(time.monotonic() - time_started)
+            return response
+
+    def _submit(self, *args, **kwargs) -> Future:
+        """Run _send() on the hedge executor, which has one worker per pooled connection."""
+        with self._hedge_executor_lock:
+            if self._hedge_executor is None:
+                self._hedge_executor = ThreadPoolExecutor(max_workers=self.pool_size,
+                                                          thread_name_prefix='hedged-request')
+            self._hedge_workers_busy += 1
+            future = self._hedge_executor.submit(self._send, *args, **kwargs)
+        future.add_done_callback(self._release_hedge_worker)
+        return future
+
+    def _release_hedge_worker(self, _future: Future) -> None:
+        with self._hedge_executor_lock:
+            self._hedge_workers_busy -= 1
+
+    def _send_hedged(self, hedge_after: float, method, url, *args, **kwargs):
+        """Send a request, and send it again if it hasn't been answered *hedge_after* seconds after it was sent,
+        returning whichever response arrives first (or raising the first exception if both fail).
+
+        The hedge is only sent if a worker is free to send it at once and the governor doesn't make it wait, so that
+        hedging doesn't add load to a target (or a rate limit) that is already saturated.
+        """
+        sent = threading.Event()
+        first = self._submit(method, url, *args, on_start=sent.set, **kwargs)
+        first.add_done_callback(lambda _future: sent.set())
+
+        # The deadline starts once the request is sent, not while it waits for a worker or for the governor.
+        sent.wait()
+        done, pending = wait({first}, timeout=hedge_after)
+        hedge = None
+        if not done:
+            with self._hedge_executor_lock:
+                worker_free = self._hedge_workers_busy < self.pool_size
+            if worker_free:
+                def on_hedge_start():
+                    logger.debug("Hedging %s %s after %.2fs", method, url, hedge_after)
+                    self.stats.record_hedge()
+
+                hedge = self._submit(method, url, *args, on_start=on_hedge_start, blocking=False, **kwargs)
+                pending.add(hedge)
+
+        error = None
+        while True:
+            for future in done:
+                try:
+                    response = future.result()
+                except Exception as e:
+                    error = error or e
+                    continue
+                if response is None:
+                    # The hedge wasn't sent because the governor would have made it wait.
+                    continue
+                if future is hedge:
+                    self.stats.record_hedge(won=True)
+                return response
+            if not pending:
+                raise error
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+
+    def close(self):
+        if self._hedge_executor is not None:
+            # Don't wait for the slower of any hedged pair of requests.
+            self._hedge_executor.shutdown(wait=False)
+            self._hedge_executor = None
+        super().close()
+
+
+def create_session(settings: SessionSettings | None = None, health: TargetHealth | None = None,
+                   governor: RateGovernor | None = None) -> requests.Session:
+    """Create a new ``requests.Session`` with a keep-alive connection pool, retry policy and default timeout,
+    reporting to *health* and waiting for *governor* if they are given."""
+    if settings is None:
+        settings = SessionSettings()
+
+    stats = RequestStats()
+    retry = InstrumentedRetry(
+        total=settings.max_retries,
+        backoff_factor=settings.backoff_factor,
+        backoff_jitter=settings.backoff_jitter,
+        status_forcelist=settings.retry_statuses,
+        allowed_methods=frozenset({'GET', 'HEAD', 'POST'}),
+        raise_on_status=False,
+        stats=stats,
+    )
+    adapter = HTTPAdapter(pool_connections=settings.pool_size, pool_maxsize=settings.pool_size, max_retries=retry)
+
+    session = PooledSession(settings.timeout_seconds, health, settings.retry_statuses, governor, stats,
+                            settings.hedge_percentile, settings.hedge_min_samples, settings.pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def get_session(base_url: str, settings: SessionSettings | None = None) -> requests.Session:
+    """Return the shared pooled session for *base_url*, creating it on first use.
+
+    *settings* (the defaults if None) is only used when the session is first created; a warning is logged if the
+    existing session was created with different settings. The session reports to the shared ``TargetHealth`` for
+    *base_url*, and waits for its ``RateGovernor`` if *settings* sets any rate limits.
+    """
+    with _sessions_lock:
+        if base_url not in sessions_by_url:
+            if settings is None:
+                settings = SessionSettings()
+            sessions_by_url[base_url] = create_session(settings, get_health(base_url, settings.health),
+                                                       get_governor(base_url, settings.rate_limit))
+            _settings_by_url[base_url] = settings
+        elif settings is not None and settings != _settings_by_url[base_url]:
+            logger.warning("Ignoring the settings %s for %s, whose session was already created with %s",
+                           settings, base_url, _settings_by_url[base_url])
+        return sessions_by_url[base_url]
+
+
+def close_sessions() -> None:
+    """Close every shared session and release its pooled connections."""
+    with _sessions_lock:
+        for session in sessions_by_url.values():
+            session.close()
+        sessions_by_url.clear()
+        _settings_by_url.clear()
@@ -0,0 +1,219 @@
+"""
+Counters and histograms of how the cached clients use their caches and endpoints.
+
+Every ``CachedNodeNorm`` and ``CachedNameRes`` has a ``ClientMetrics``
+(``client.metrics``) with one ``EndpointMetrics`` per endpoint
+(``get_normalized_nodes``, ``bulk-lookup`` and ``lookup``), which counts:
+
+- cache hits and misses, and for NodeNorm the hits on entries that were
+  propagated from an equivalent identifier (``inferred_hits``);
+- the HTTP requests sent (and how many of them failed), and the approximate
+  bytes sent (URL and body) and received (body);
+- histograms of the request latencies and of the number of CURIEs or queries
+  in each request.
+
+Histograms have fixed buckets, so that the metrics of several processes (e.g.
+pytest-xdist workers) can be added together with ``merge_reports()``;
+percentiles are estimated as the upper bound of the bucket they fall in.
+
+``metrics_report()`` collects the metrics of some clients, and the
+``RequestStats`` of the pooled sessions (see ``http.py``), into a plain dict
+that can be written out as JSON, and ``format_report()`` formats one as a
+compact summary with one line per client endpoint and session.
+"""
+
+import bisect
+import threading
+from collections.abc import Iterable
+
+import requests
+
+# Upper bounds of the histogram buckets; every histogram also has a bucket for larger values.
+LATENCY_BUCKETS_SECONDS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+BATCH_SIZE_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+
+
+class Histogram:
+    def __init__(self, buckets: tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = None
+
+    def record(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.total += value
+        self.max = value if self.max is None else max(self.max, value)
+
+    def percentile(self, percentile: float) -> float | None:
+        """Estimate a percentile as the upper bound of its bucket (or the largest value, if that is smaller)."""
+        if not self.count:
+            return None
+        rank = self.count * percentile / 100
+        seen = 0
+        for bucket, count in enumerate(self.counts):
+            seen += count
+            if count and seen >= rank:
+                return min(self.buckets[bucket], self.max) if bucket < len(self.buckets) else self.max
+        return self.max
+
+    def as_dict(self) -> dict:
+        return {
+            'count': self.count,
+            'sum': self.total,
+            'max': self.max,
+            'p50': self.percentile(50),
+            'p95': self.percentile(95),
+            'p99': self.percentile(99),
+            'buckets': list(self.buckets),
+            'counts': list(self.counts),
+        }
+
+    def merge(self, histogram: dict) -> None:
+        """Add the counts of another histogram with the same buckets (as returned by as_dict())."""
+        if tuple(histogram['buckets']) != self.buckets:
+            raise ValueError(f"Cannot merge a histogram with buckets {histogram['buckets']} into one with "
+                             f"{self.buckets}")
+        self.counts = [count + other for count, other in zip(self.counts, histogram['counts'])]
+        self.count += histogram['count']
+        self.total += histogram['sum']
+        if histogram['max'] is not None:
+            self.max = histogram['max'] if self.max is None else max(self.max, histogram['max'])
+
+
+COUNTERS = ('hits', 'misses', 'inferred_hits', 'requests', 'failed_requests', 'bytes_sent', 'bytes_received')
+
+
+class EndpointMetrics:
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.inferred_hits = 0
+        self.requests = 0
+        self.failed_requests = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.latency_seconds = Histogram(LATENCY_BUCKETS_SECONDS)
+        self.batch_size = Histogram(BATCH_SIZE_BUCKETS)
+
+    def as_dict(self) -> dict:
+        metrics = {counter: getattr(self, counter) for counter in COUNTERS}
+        metrics['latency_seconds'] = self.latency_seconds.as_dict()
+        metrics['batch_size'] = self.batch_size.as_dict()
+        return metrics
+
+    def merge(self, metrics: dict) -> None:
+        """Add the counts of another EndpointMetrics (as returned by as_dict())."""
+        for counter in COUNTERS:
+            setattr(self, counter, getattr(self, counter) + metrics[counter])
+        self.latency_seconds.merge(metrics['latency_seconds'])
+        self.batch_size.merge(metrics['batch_size'])
+
+
+class ClientMetrics:
+    """The EndpointMetrics of every endpoint used by one client. May be shared between threads."""
+
+    def __init__(self):
+        self.endpoints = {}
+        self._lock = threading.Lock()
+
+    def _endpoint(self, endpoint: str) -> EndpointMetrics:
+        # Must be called with the lock held.
+        if endpoint not in self.endpoints:
+            self.endpoints[endpoint] = EndpointMetrics()
+        return self.endpoints[endpoint]
+
+    def record_lookup(self, endpoint: str, hits: int, misses: int, inferred_hits: int = 0) -> None:
+        """Record the cache hits (of which *inferred_hits* were propagated entries) and misses of one call."""
+        with self._lock:
+            metrics = self._endpoint(endpoint)
+            metrics.hits += hits
+            metrics.misses += misses
+            metrics.inferred_hits += inferred_hits
+
+    def record_request(self, endpoint: str, batch_size: int, latency_seconds: float,
+                       response: requests.Response | None) -> None:
+        """Record a request of *batch_size* CURIEs or queries, and its *response* (None if no response was
+        received). Responses with an error status count as failed requests."""
+        with self._lock:
+            metrics = self._endpoint(endpoint)
+            metrics.requests += 1
+            metrics.latency_seconds.record(latency_seconds)
+            metrics.batch_size.record(batch_size)
+            if response is None or not response.ok:
+                metrics.failed_requests += 1
+            if response is not None:
+                metrics.bytes_sent += len(response.request.url or '') + len(response.request.body or b'')
+                metrics.bytes_received += len(response.content)
+
+    def as_dict(self) -> dict[str, dict]:
+        """Return a ``{endpoint: metrics}`` mapping of plain dicts, e.g. to write out as JSON."""
+        with self._lock:
+            return {endpoint: metrics.as_dict() for endpoint, metrics in self.endpoints.items()}
+
+
+def metrics_report(clients: Iterable, sessions_by_url: dict | None = None) -> dict:
+    """
+    Collect the metrics of *clients* (anything with a ``metrics`` attribute) that have been used, and the request
+    statistics of the pooled sessions in *sessions_by_url* that have sent any requests.
+
+    :return: A ``{'clients': {str(client): {endpoint: metrics}}, 'sessions': {base_url: stats}}`` dict.
+    """
+    return {
+        'clients': {str(client): client.metrics.as_dict() for client in clients if client.metrics.endpoints},
+        'sessions': {url: session.stats.as_dict() for url, session in (sessions_by_url or {}).items()
+                     if session.stats.requests},
+    }
+
+
+def merge_reports(reports: Iterable[dict]) -> dict:
+    """Add together several reports from metrics_report(), e.g. one from each pytest-xdist worker."""
+    clients = {}
+    sessions = {}
+    for report in reports:
+        for client, endpoints in report['clients'].items():
+            for endpoint, metrics in endpoints.items():
+                clients.setdefault(client, {}).setdefault(endpoint, EndpointMetrics()).merge(metrics)
+        for url, stats in report['sessions'].items():
+            totals = sessions.setdefault(url, dict.fromkeys(stats, 0))
+            for counter, value in stats.items():
+                totals[counter] += value
+    return {
+        'clients': {client: {endpoint: metrics.as_dict() for endpoint, metrics in endpoints.items()}
+                    for client, endpoints in clients.items()},
+        'sessions': sessions,
+    }
+
+
+def _format_bytes(count: int) -> str:
+    for unit in ('B', 'KB', 'MB'):
+        if count < 1024:
+            return f"{count:.0f} {unit}" if unit == 'B' else f"{count:.1f} {unit}"
+        count /= 1024
+    return f"{count:.1f} GB"
+
+
+def format_report(report: dict) -> list[str]:
+    """Format a report from metrics_report() as one line per client endpoint and session."""
+    lines = []
+    for client, endpoints in report['clients'].items():
+        for endpoint, metrics in endpoints.items():
+            line = f"{client} {endpoint}: {metrics['hits']} hits"
+            if metrics['inferred_hits']:
+                line += f" ({metrics['inferred_hits']} inferred)"
+            line += f", {metrics['misses']} misses, {metrics['requests']} requests"
+            if metrics['failed_requests']:
+                line += f" ({metrics['failed_requests']} failed)"
+            latency = metrics['latency_seconds']
+            batch_size = metrics['batch_size']
+            if metrics['requests']:
+                line += (f", {_format_bytes(metrics['bytes_sent'])} sent, {_format_bytes(metrics['bytes_received'])} "
+                         f"received, latency p50 {latency['p50']:.3f}s p95 {latency['p95']:.3f}s "
+                         f"max {latency['max']:.3f}s, batch size p50 {batch_size['p50']:g} max {batch_size['max']:g}")
+            lines.append(line)
+    for url, stats in report['sessions'].items():
+        lines.append(f"{url}: {stats['requests']} requests, {stats['retries']} retries, {stats['hedged']} hedged "
+                     f"({stats['hedges_won']} answered first by the hedge)")
+    return lines
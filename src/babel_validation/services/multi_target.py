@@ -0,0 +1,222 @@
+"""
+Send the same requests to several targets at once, and report where their responses diverge.
+
+Running the suite with ``--target all`` sends each request to each target in a
+separate test, one after the other.  ``MultiTargetNodeNorm`` and
+``MultiTargetNameRes`` wrap one cached client per target (keyed by the target
+name from ``targets.ini``) and send an identical batch to every target
+concurrently, returning the responses of each target side by side.  Since the
+per-target clients are the usual cached clients, the responses are also
+available to any later tests against those targets without further requests.
+
+``diff_results()`` compares the responses of every target with those of a
+baseline target using ``deepdiff``, after reducing them to the fields that
+matter for validation (``nodenorm_comparable()`` and ``nameres_comparable()``),
+and ``format_divergence_report()`` turns the result into a compact report
+with one line per diverging CURIE or query and target, e.g.:
+
+    MONDO:0005015: prod differs from dev: Value of root['label'] changed from "diabetes" to "diabetes mellitus".
+
+``summarize_divergences()`` reduces that to one line per target, which keeps
+the report readable when a whole target is down.
+"""
+
+import logging
+from collections.abc import Callable, Hashable, Iterable
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+
+import deepdiff
+
+from .batching import PartialBatchError
+from .nameres import NameResService
+from .nodenorm import NodeNormService
+
+logger = logging.getLogger(__name__)
+
+
+def fan_out(clients: dict[str, object], call: Callable[[object], dict]) -> dict[str, dict]:
+    """
+    Call *call* with the client of every target concurrently.
+
+    :return: A ``{target: result}`` mapping, where result is the exception raised if the call failed for that target.
+    """
+    results = {}
+    if not clients:
+        return results
+    with ThreadPoolExecutor(max_workers=len(clients)) as executor:
+        futures = {target: executor.submit(call, client) for target, client in clients.items()}
+        for target, future in futures.items():
+            try:
+                results[target] = future.result()
+            except Exception as e:
+                logger.warning("Request to target %s (%s) failed: %s", target, clients[target], e)
+                results[target] = e
+    return results
+
+
+class MultiTargetNodeNorm:
+    def __init__(self, clients: dict[str, NodeNormService]):
+        self.clients = clients
+
+    def __str__(self):
+        return f"MultiTargetNodeNorm({', '.join(self.clients)})"
+
+    def normalize_curies(self, curies: list[str], **params) -> dict[str, dict[str, dict | None | Exception]]:
+        """
+        Normalize *curies* on every target concurrently.
+
+        :return: A ``{target: {curie: result}}`` mapping. If a request to a target failed, the result for each CURIE
+            it covered is the exception raised.
+        """
+        def normalize(nodenorm: NodeNormService) -> dict[str, dict | None | Exception]:
+            try:
+                return nodenorm.normalize_curies(curies, **params)
+            except PartialBatchError as e:
+                results = dict(e.results)
+                for chunk, exception in e.failures.items():
+                    results.update({curie: exception for curie in chunk})
+                return results
+
+        return _per_key(fan_out(self.clients, normalize), curies)
+
+    def execute_plan(self, plan) -> dict[str, dict]:
+        """
+        Execute a NodeNormQueryPlan (see ``core/query_plan.py``) on every target concurrently.
+
+        :return: A ``{target: {planned_request: result}}`` mapping, as returned by plan.execute() for each target.
+        """
+        return _per_key(fan_out(self.clients, plan.execute), plan.dependents)
+
+
+class MultiTargetNameRes:
+    def __init__(self, clients: dict[str, NameResService]):
+        self.clients = clients
+
+    def __str__(self):
+        return f"MultiTargetNameRes({', '.join(self.clients)})"
+
+    def lookup_many(self, lookups: Iterable[tuple[str, dict]],
+                    max_workers: int | None = None) -> dict[str, dict[tuple[str, frozenset], list[dict] | Exception]]:
+        """
+        Look up every distinct ``(query, params)`` pair in *lookups* on every target concurrently.
+
+        :return: A ``{target: {(query, params_key): result}}`` mapping, as returned by each target's lookup_many().
+        """
+        lookups = list(lookups)
+        results = fan_out(self.clients, lambda nameres: nameres.lookup_many(lookups, max_workers=max_workers))
+        return _per_key(results, [(query, frozenset(params.items())) for query, params in lookups])
+
+    def execute_plan(self, plan, max_workers: int | None = None) -> dict[str, dict]:
+        """
+        Execute a NameResQueryPlan (see ``core/query_plan.py``) on every target concurrently.
+
+        :return: A ``{target: {planned_request: result}}`` mapping, as returned by plan.execute() for each target.
+        """
+        return _per_key(fan_out(self.clients, lambda nameres: plan.execute(nameres, max_workers=max_workers)),
+                        plan.dependents)
+
+
+def _per_key(results_by_target: dict[str, dict | Exception], keys: Iterable[Hashable]) -> dict[str, dict]:
+    """ Replace the result of any target whose request failed outright with that exception for every key. """
+    return {
+        target: {key: results for key in keys} if isinstance(results, Exception) else results
+        for target, results in results_by_target.items()
+    }
+
+
+def nodenorm_comparable(result: dict | None) -> dict | None:
+    """ Reduce a NodeNorm result to its preferred identifier and label, types and equivalent identifiers. """
+    if not result:
+        return None
+    return {
+        'identifier': result.get('id', {}).get('identifier'),
+        'label': result.get('id', {}).get('label'),
+        'type': result.get('type', []),
+        'equivalent_identifiers': sorted(e.get('identifier') for e in result.get('equivalent_identifiers', [])),
+    }
+
+
+def nameres_comparable(results: list[dict]) -> list[dict]:
+    """ Reduce NameRes lookup results to the CURIE and label of each result, in order. """
+    return [{'curie': result.get('curie'), 'label': result.get('label')} for result in results]
+
+
+@dataclass(frozen=True)
+class Divergence:
+    """ A CURIE or query whose response from a target differs from the baseline target. """
+    key: Hashable
+    baseline: str
+    target: str
+    description: str
+
+
+def diff_results(results_by_target: dict[str, dict], baseline: str | None = None,
+                 comparable: Callable[[object], object] = lambda result: result,
+                 ignore_order: bool = False) -> list[Divergence]:
+    """
+    Compare the response of every target for every key with the response of the baseline target.
+
+    :param results_by_target: A ``{target: {key: result}}`` mapping, as returned by MultiTargetNodeNorm or
+        MultiTargetNameRes.
+    :param baseline: The target to compare the others with (defaults to the first target).
+    :param comparable: Reduces each result to the parts that should be compared, e.g. nodenorm_comparable().
+    :param ignore_order: Whether the order of lists in the comparable results should be ignored.
+    :return: One Divergence for every key and target whose response differs from the baseline, including requests
+        that failed on only one of the two targets.
+    """
+    if not results_by_target:
+        return []
+    if baseline is None:
+        baseline = next(iter(results_by_target))
+    baseline_results = results_by_target[baseline]
+
+    keys = set()
+    for results in results_by_target.values():
+        keys.update(results)
+
+    divergences = []
+    for key in sorted(keys, key=str):
+        baseline_result = baseline_results.get(key)
+        for target, results in results_by_target.items():
+            if target == baseline:
+                continue
+            result = results.get(key)
+            if isinstance(baseline_result, Exception) or isinstance(result, Exception):
+                if isinstance(baseline_result, Exception) and isinstance(result, Exception):
+                    continue
+                failed, error = (baseline, baseline_result) if isinstance(baseline_result, Exception) \
+                    else (target, result)
+                divergences.append(Divergence(key, baseline, target, f"request to {failed} failed: {error}"))
+                continue
+
+            diff = deepdiff.DeepDiff(comparable(baseline_result), comparable(result), ignore_order=ignore_order)
+            if diff:
+                divergences.append(Divergence(key, baseline, target, diff.pretty().replace("\n", " ")))
+    return divergences
+
+
+def _format_key(key: Hashable) -> str:
+    """ Format a CURIE, or a NameRes (query, params_key) pair as the query followed by its params. """
+    if isinstance(key, tuple) and len(key) == 2 and isinstance(key[1], frozenset):
+        return f"'{key[0]}' {dict(sorted(key[1]))}"
+    return str(key)
+
+
+def format_divergence_report(divergences: list[Divergence]) -> str:
+    """ Format divergences as one line per diverging key and target. """
+    return "\n".join(f"{_format_key(divergence.key)}: {divergence.target} differs from {divergence.baseline}: "
+                     f"{divergence.description}" for divergence in divergences)
+
+
+def summarize_divergences(divergences: list[Divergence]) -> list[str]:
+    """ Summarize divergences as one line per target, counting its diverging keys and the requests that failed. """
+    counts = {}
+    for divergence in divergences:
+        count = counts.setdefault((divergence.target, divergence.baseline), [0, 0])
+        count[0] += 1
+        if divergence.description.startswith('request to '):
+            count[1] += 1
+    return [f"{target} differs from {baseline} for {total} response{'' if total == 1 else 's'}"
+            + (f" ({failed} of them because a request failed)" if failed else "")
+            for (target, baseline), (total, failed) in counts.items()]
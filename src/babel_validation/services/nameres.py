@@ -3,32 +3,75 @@ Cached client for the NameRes ``bulk-lookup`` and ``lookup`` APIs.
 
 Caching model
 -------------
-Each response is stored under the key ``(query, frozenset(params.items()))``.
-Entries are never evicted automatically; call ``invalidate_query()`` to force
-a fresh lookup for a specific query string.
+Each response is stored under the key ``(query, frozenset(params.items()))``,
+with separate caches for the ``bulk-lookup`` and ``lookup`` endpoints since
+their responses have different shapes.  By default entries are never evicted
+automatically; call ``invalidate_query()`` to force a fresh lookup for a
+specific query string (or ``invalidate_queries()`` and
+``invalidate_queries_where()`` for many at once), or pass an ``EvictionPolicy`` to bound each cache by
+entry count, approximate size or age (see ``cache.py``).
+
+Pass a ``PersistentCache`` to also keep responses on disk between runs.  The
+client reads the target's ``/status`` once when it is created, and the stored
+responses are discarded automatically whenever the reported Babel version
+changes.
 
 Cache-warming pattern
 ---------------------
 When you need to look up many query strings for the same logical task, call
-``bulk_lookup()`` once with the full list.  That issues a single HTTP POST to
-the ``bulk-lookup`` endpoint and populates the cache.  Subsequent
+``bulk_lookup()`` once with the full list.  That POSTs the queries to the
+``bulk-lookup`` endpoint and populates the cache.  Subsequent
 ``bulk_lookup()`` calls for any subset of those queries are served from cache.
 
+Batching and failure isolation
+------------------------------
+Uncached queries are split into chunks of at most ``max_batch_size`` and the
+chunks are POSTed concurrently on a thread pool of ``max_workers`` threads.
+A chunk that fails is split in half and each half retried, recursively, until
+the failure is narrowed down to individual queries.  Those queries are
+recorded in ``failed_queries`` rather than cached, and reported in a
+``PartialBatchError`` once every other chunk has been cached.
+
 Endpoint differences
 --------------------
 ``bulk_lookup()`` targets ``/bulk-lookup`` and sends the query list as a JSON
 body.  ``lookup()`` targets the separate ``/lookup`` endpoint and sends its
 parameters as a URL query string.  These are distinct API endpoints with
 different response shapes; ``lookup()`` does NOT delegate to ``bulk_lookup()``.
+To warm the ``lookup()`` cache for many queries at once, call
+``lookup_many()``, which runs the distinct lookups concurrently.
+
+Metrics
+-------
+``metrics`` counts the cache hits and misses of every call, and the requests
+sent to each endpoint with their sizes and latencies (see ``metrics.py``).
+
+Thread safety
+-------------
+A ``CachedNameRes`` may be shared between threads.  When several threads
+miss on the same ``(query, params)`` at the same time, only one of them
+requests it from NameRes; the others wait for that request to finish and
+share its result (see ``ResponseCache.claim()``).
 """
 
 import logging
+import threading
 import time
+from collections.abc import Callable, Iterable
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from typing import Protocol
 
 import requests
 
+from .batching import PartialBatchError, chunked
+from .cache import EvictionPolicy, ResponseCache
+from .health import CircuitOpenError
+from .http import SessionSettings, get_session
+from .metrics import ClientMetrics
+from .persistent_cache import MISSING, PersistentCache, status_version
+
 cached_nameres_by_url = {}
+_cached_nameres_lock = threading.Lock()
 
 
 class NameResService(Protocol):
@@ -41,42 +84,96 @@ class NameResService(Protocol):
 
     def bulk_lookup(self, queries: list[str], **params) -> dict[str, dict]: ...
     def lookup(self, query: str, **params) -> list[dict]: ...
+    def lookup_many(self, lookups: Iterable[tuple[str, dict]],
+                    max_workers: int | None = None) -> dict[tuple[str, frozenset], list[dict] | Exception]: ...
     def invalidate_query(self, query: str) -> None: ...
+    def invalidate_queries(self, queries: list[str]) -> None: ...
+    def invalidate_queries_where(self, predicate: Callable[[str], bool]) -> set[str]: ...
 
 
 class CachedNameRes:
-    def __init__(self, nameres_url: str):
+    def __init__(self, nameres_url: str, persistent_cache: PersistentCache | None = None,
+                 session: requests.Session | None = None, max_batch_size: int = 100, max_workers: int = 4,
+                 eviction_policy: EvictionPolicy | None = None, lookup_timeout_seconds: float = 30,
+                 session_settings: SessionSettings | None = None):
         self.nameres_url = nameres_url
+        self.max_batch_size = max_batch_size
+        # How long lookup() waits for a response before failing; bulk lookups always wait up to 30 seconds.
+        self.lookup_timeout_seconds = lookup_timeout_seconds
+        self.max_workers = max_workers
         self.logger = logging.getLogger(str(self))
-        self.cache = {}
+        self.metrics = ClientMetrics()
+        # Queries that still failed after bisection, keyed by (query, params_key).
+        self.failed_queries = {}
+        self._failed_queries_lock = threading.Lock()
+        self.session = session if session is not None else get_session(nameres_url, session_settings)
+        self.cache = ResponseCache(policy=eviction_policy)
+        self.lookup_cache = ResponseCache(policy=eviction_policy)
+
+        if persistent_cache is not None:
+            version = self.service_version()
+            if version is None:
+                self.logger.warning("Could not determine the version of %s, so its responses will not be stored "
+                                    "in %s", self, persistent_cache)
+            else:
+                persistent_cache.check_version(self.nameres_url, version)
+                self.cache.backing = persistent_cache.namespace(self.nameres_url, "bulk-lookup")
+                self.lookup_cache.backing = persistent_cache.namespace(self.nameres_url, "lookup")
 
     def __str__(self):
         return f"CachedNameRes({self.nameres_url})"
 
     @staticmethod
-    def from_url(nameres_url: str) -> 'CachedNameRes':
+    def from_url(nameres_url: str, persistent_cache: PersistentCache | None = None,
+                 lookup_timeout_seconds: float = 30,
+                 session_settings: SessionSettings | None = None) -> 'CachedNameRes':
         """Return the singleton ``CachedNameRes`` for *nameres_url*.
 
         The singleton ensures that cache entries accumulated during one part of
         a test run are reused by later parts that share the same URL.  Prefer
         this over direct construction unless you explicitly want a fresh cache.
+
+        *persistent_cache* and *lookup_timeout_seconds* are only used when the singleton is first created.
+        *session_settings* are the settings of the pooled session for *nameres_url* (see ``get_session()``), which
+        warns if that session was already created with different ones.
         """
-        if nameres_url not in cached_nameres_by_url:
-            cached_nameres_by_url[nameres_url] = CachedNameRes(nameres_url)
-        return cached_nameres_by_url[nameres_url]
+        if session_settings is not None:
+            get_session(nameres_url, session_settings)
+        with _cached_nameres_lock:
+            if nameres_url not in cached_nameres_by_url:
+                cached_nameres_by_url[nameres_url] = CachedNameRes(
+                    nameres_url, persistent_cache, lookup_timeout_seconds=lookup_timeout_seconds,
+                    session_settings=session_settings)
+            return cached_nameres_by_url[nameres_url]
+
+    def service_version(self) -> str | None:
+        """Return a string identifying the Babel version served by this NameRes, or ``None`` if unknown."""
+        try:
+            response = self.session.get(self.nameres_url + "status", timeout=30)
+            response.raise_for_status()
+            return status_version(response.json())
+        except (requests.RequestException, ValueError) as e:
+            self.logger.warning("Could not retrieve status from %s: %s", self, e)
+            return None
 
     def bulk_lookup(self, queries: list[str], **params) -> dict[str, dict]:
         """Look up *queries* in bulk, returning a ``{query: result}`` mapping.
 
         Already-cached queries are served from the cache; the remainder are
-        fetched from NameRes in a single HTTP POST to ``bulk-lookup``.
-        The response is merged with the cached results before returning.
+        fetched from NameRes in HTTP POSTs to ``bulk-lookup`` of at most
+        ``max_batch_size`` queries each, running concurrently.  The responses
+        are merged with the cached results before returning.
 
         *queries* must be a non-empty list — the NameRes API rejects empty
         requests, so this method raises ``ValueError`` immediately.
 
         Use this as the cache-warming call; subsequent ``bulk_lookup()`` calls
         for any subset of these queries will be free.
+
+        If any query still fails after its chunk has been bisected down to
+        that single query, raises ``PartialBatchError`` once every other chunk
+        has finished; its ``results`` hold (and the cache retains) every query
+        that was looked up successfully.
         """
         if not queries:
             raise ValueError(f"queries must not be empty when calling bulk_lookup({queries}, {params}) on {self}")
@@ -86,31 +183,110 @@ class CachedNameRes:
         time_started = time.time_ns()
         params_key = frozenset(params.items())
         queries_set = set(queries)
-        cached_queries = {q for q in queries_set if (q, params_key) in self.cache}
-        queries_to_be_queried = queries_set - cached_queries
+        cached_results = {}
+        for query in queries_set:
+            value = self.cache.get((query, params_key), MISSING)
+            if value is not MISSING:
+                cached_results[query] = value
+        owned_keys, in_flight = self.cache.claim((q, params_key) for q in queries_set - cached_results.keys())
+        queries_to_be_queried = {query for query, _ in owned_keys}
+        self.metrics.record_lookup("bulk-lookup", len(cached_results), len(queries_set) - len(cached_results))
 
         result = {}
+        failures = {}
         if queries_to_be_queried:
-            api_params = dict(params)
-            api_params['strings'] = list(queries_to_be_queried)
-
-            self.logger.debug("Called NameRes %s with params %s", self, api_params)
-            response = requests.post(self.nameres_url + "bulk-lookup", json=api_params, timeout=30)
-            response.raise_for_status()
-            result = response.json()
-
-            for query in queries_to_be_queried:
-                self.cache[(query, params_key)] = result.get(query, None)
-
-        for query in cached_queries:
-            result[query] = self.cache[(query, params_key)]
+            pending_keys = set(owned_keys)
+            try:
+                chunks = list(chunked(sorted(queries_to_be_queried), self.max_batch_size))
+                with ThreadPoolExecutor(max_workers=min(self.max_workers, len(chunks))) as executor:
+                    futures = [executor.submit(self._lookup_chunk, chunk, params) for chunk in chunks]
+                    for future in as_completed(futures):
+                        chunk_result, chunk_failures = future.result()
+                        self.cache.put_many({(query, params_key): value for query, value in chunk_result.items()})
+                        result.update(chunk_result)
+                        pending_keys -= {(query, params_key) for query in chunk_result}
+                        with self._failed_queries_lock:
+                            for query, e in chunk_failures.items():
+                                failures[(query,)] = e
+                                self.failed_queries[(query, params_key)] = e
+                        failed_keys = {(query, params_key) for query in chunk_failures}
+                        for key in failed_keys:
+                            self.cache.release([key], chunk_failures[key[0]])
+                        pending_keys -= failed_keys
+            finally:
+                # Don't leave other threads waiting on queries we will never look up.
+                if pending_keys:
+                    self.cache.release(pending_keys, RuntimeError(f"Lookup was interrupted on {self}"))
+            with self._failed_queries_lock:
+                for query in result:
+                    self.failed_queries.pop((query, params_key), None)
+
+        # Wait for queries that other threads were already looking up.
+        for (query, _), future in in_flight.items():
+            try:
+                result[query] = future.result()
+            except Exception as e:
+                failures[(query,)] = e
+
+        result.update(cached_results)
 
         time_taken_sec = (time.time_ns() - time_started) / 1E9
         self.logger.info("Looked up %d queries (with %d cached) with params %s on %s in %.3fs",
-                         len(queries_to_be_queried), len(cached_queries), params, self, time_taken_sec)
+                         len(queries_to_be_queried), len(cached_results), params, self, time_taken_sec)
+
+        if failures:
+            raise PartialBatchError(
+                f"{len(failures)} of {len(queries_to_be_queried) + len(in_flight)} queries failed when looking them "
+                f"up with params {params} on {self}", result, failures)
 
         return result
 
+    def _lookup_chunk(self, queries: list[str], params: dict) -> tuple[dict[str, dict], dict[str, Exception]]:
+        """Look up a single chunk of *queries*, bisecting it on failure.
+
+        :return: A tuple of the ``{query: result}`` mapping for every query that was looked up successfully and a
+            ``{query: exception}`` mapping for every query that failed on its own.
+        """
+        try:
+            return self._post_bulk_lookup(queries, params), {}
+        except CircuitOpenError as e:
+            # Don't bisect: every smaller chunk would be rejected in the same way.
+            return {}, {query: e for query in queries}
+        except (requests.RequestException, ValueError) as e:
+            if len(queries) == 1:
+                self.logger.warning("Could not look up query %r with params %s on %s: %s", queries[0], params, self, e)
+                return {}, {queries[0]: e}
+            self.logger.info("Could not look up a chunk of %d queries with params %s on %s, splitting it in half: %s",
+                             len(queries), params, self, e)
+
+        middle = len(queries) // 2
+        first_result, first_failures = self._lookup_chunk(queries[:middle], params)
+        second_result, second_failures = self._lookup_chunk(queries[middle:], params)
+        return first_result | second_result, first_failures | second_failures
+
+    def _post_bulk_lookup(self, queries: list[str], params: dict) -> dict[str, dict]:
+        """POST *queries* to ``bulk-lookup``, returning a result for every query."""
+        api_params = dict(params)
+        api_params['strings'] = queries
+
+        self.logger.debug("Called NameRes %s with %d queries and params %s", self, len(queries), params)
+        response = self._post("bulk-lookup", len(queries), json=api_params)
+        response.raise_for_status()
+        response_json = response.json()
+        if not isinstance(response_json, dict):
+            raise ValueError(f"Expected a JSON object from {self}, got {type(response_json).__name__}")
+        return {query: response_json.get(query, None) for query in queries}
+
+    def _post(self, endpoint: str, batch_size: int, timeout: float = 30, **kwargs) -> requests.Response:
+        """POST to *endpoint*, recording the request and its *batch_size* queries in ``metrics``."""
+        time_started = time.monotonic()
+        response = None
+        try:
+            response = self.session.post(self.nameres_url + endpoint, timeout=timeout, **kwargs)
+            return response
+        finally:
+            self.metrics.record_request(endpoint, batch_size, time.monotonic() - time_started, response)
+
     def lookup(self, query: str, **params) -> list[dict]:
         """Look up a single *query* string via the NameRes ``/lookup`` endpoint.
 
@@ -123,26 +299,87 @@ class CachedNameRes:
         single lookups, call this method (or ``bulk_lookup()``) upfront.
         """
         cache_key = (query, frozenset(params.items()))
-        if cache_key in self.cache:
-            return self.cache[cache_key]
+        value = self.lookup_cache.get(cache_key, MISSING)
+        if value is not MISSING:
+            self.metrics.record_lookup("lookup", 1, 0)
+            return value
+
+        self.metrics.record_lookup("lookup", 0, 1)
+        owned_keys, in_flight = self.lookup_cache.claim([cache_key])
+        if cache_key in in_flight:
+            return in_flight[cache_key].result()
+        if not owned_keys:
+            # Another thread cached it between our check and our claim.
+            return self.lookup_cache[cache_key]
 
         api_params = dict(params)
         api_params['string'] = query
         self.logger.debug("Querying NameRes with params %s", api_params)
 
-        response = requests.post(self.nameres_url + "lookup", params=api_params, timeout=30)
-        response.raise_for_status()
-        result = response.json()
+        try:
+            response = self._post("lookup", 1, timeout=self.lookup_timeout_seconds, params=api_params)
+            response.raise_for_status()
+            result = response.json()
+        except BaseException as e:
+            self.lookup_cache.release(owned_keys, e)
+            raise
 
-        self.cache[cache_key] = result
+        self.lookup_cache[cache_key] = result
         return result
 
+    def lookup_many(self, lookups: Iterable[tuple[str, dict]],
+                    max_workers: int | None = None) -> dict[tuple[str, frozenset], list[dict] | Exception]:
+        """Call ``lookup()`` once for each distinct ``(query, params)`` pair in *lookups*, concurrently.
+
+        :param max_workers: The number of lookups to run at once (defaults to ``max_workers``).
+        :return: A ``{(query, params_key): result}`` mapping, where result is the exception raised if that
+            lookup failed.  Failed lookups are not cached, so a later ``lookup()`` will retry them.
+        """
+        unique_lookups = {(query, frozenset(params.items())): params for query, params in lookups}
+        results = {}
+        if not unique_lookups:
+            return results
+
+        time_started = time.time_ns()
+        with ThreadPoolExecutor(max_workers=min(max_workers or self.max_workers, len(unique_lookups))) as executor:
+            futures = {executor.submit(self.lookup, query, **params): (query, params_key)
+                       for (query, params_key), params in unique_lookups.items()}
+            for future in as_completed(futures):
+                try:
+                    results[futures[future]] = future.result()
+                except (requests.RequestException, ValueError) as e:
+                    results[futures[future]] = e
+
+        time_taken_sec = (time.time_ns() - time_started) / 1E9
+        failed = sum(1 for result in results.values() if isinstance(result, Exception))
+        self.logger.info("Looked up %d distinct queries (%d failed) on %s in %.3fs",
+                         len(unique_lookups), failed, self, time_taken_sec)
+        return results
+
     def invalidate_query(self, query: str) -> None:
         """Remove all cached results for *query* (across every param variant).
 
         The next call to ``lookup()`` or ``bulk_lookup()`` for this query will
         issue a fresh HTTP request.
         """
-        keys_to_delete = [k for k in self.cache if k[0] == query]
-        for k in keys_to_delete:
-            del self.cache[k]
+        self.invalidate_queries([query])
+
+    def invalidate_queries(self, queries: list[str]) -> None:
+        """Remove all cached results (and recorded failures) for each of *queries*."""
+        queries = set(queries)
+        self.cache.invalidate_many(queries)
+        self.lookup_cache.invalidate_many(queries)
+        with self._failed_queries_lock:
+            for key in [k for k in self.failed_queries if k[0] in queries]:
+                del self.failed_queries[key]
+
+    def invalidate_queries_where(self, predicate: Callable[[str], bool]) -> set[str]:
+        """Remove all cached results (and recorded failures) for every query that satisfies *predicate*.
+
+        :return: The set of queries that were invalidated.
+        """
+        queries = self.cache.invalidate_where(predicate) | self.lookup_cache.invalidate_where(predicate)
+        with self._failed_queries_lock:
+            failed = {k[0] for k in self.failed_queries if predicate(k[0])}
+        self.invalidate_queries(failed)
+        return queries | failed
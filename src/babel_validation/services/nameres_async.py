@@ -0,0 +1,284 @@
+"""
+Asyncio-native cached client for the NameRes ``bulk-lookup`` and ``lookup`` APIs.
+
+``AsyncCachedNameRes`` mirrors ``CachedNameRes`` (see ``nameres.py``) with
+``async`` methods, so that a validation run can keep hundreds of requests in
+flight against a target from a single event loop.  It uses the same
+``ResponseCache`` objects and the same batching semantics: uncached queries
+are split into chunks of ``max_batch_size``, failing chunks are bisected down
+to the individual failing queries, and those are recorded in
+``failed_queries`` and reported in a ``PartialBatchError``.  At most
+``max_concurrency`` requests are in flight at once.  Requests are reported to
+the same ``TargetHealth`` as the synchronous client (see ``health.py``), so
+lookups fail immediately with ``CircuitOpenError`` while the target is down.
+
+To share cache entries with the synchronous client for the same URL, create
+the async client with ``AsyncCachedNameRes.from_sync(CachedNameRes.from_url(url))``.
+Both clients then claim the queries they look up in the shared caches (see
+``cache.py``), so a query missed by both is only looked up once.
+
+This module needs ``aiohttp``, which is an optional dependency: install it
+with ``pip install babel-validation[async]``.
+"""
+
+import asyncio
+import logging
+import time
+from collections.abc import Callable
+from typing import Protocol
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+from .batching import PartialBatchError, chunked
+from .cache import ResponseCache, await_claimed
+from .health import CircuitOpenError, get_health
+from .nameres import CachedNameRes
+from .persistent_cache import MISSING
+
+
+class AsyncNameResService(Protocol):
+    """Asynchronous counterpart of ``NameResService``."""
+
+    async def bulk_lookup(self, queries: list[str], **params) -> dict[str, dict]: ...
+    async def lookup(self, query: str, **params) -> list[dict]: ...
+    async def invalidate_query(self, query: str) -> None: ...
+    async def invalidate_queries(self, queries: list[str]) -> None: ...
+    async def invalidate_queries_where(self, predicate: Callable[[str], bool]) -> set[str]: ...
+
+
+def _query_params(params: dict) -> dict[str, str | int | float]:
+    """aiohttp only accepts strings and numbers as URL query values, so spell booleans the way NameRes expects."""
+    return {k: ('true' if v else 'false') if isinstance(v, bool) else v for k, v in params.items()}
+
+
+class AsyncCachedNameRes:
+    def __init__(self, nameres_url: str, cache: ResponseCache | None = None, lookup_cache: ResponseCache | None = None,
+                 max_batch_size: int = 100, max_concurrency: int = 16):
+        if aiohttp is None:
+            raise ImportError("AsyncCachedNameRes requires aiohttp: install babel-validation[async]")
+        self.nameres_url = nameres_url
+        self.max_batch_size = max_batch_size
+        self.max_concurrency = max_concurrency
+        self.logger = logging.getLogger(str(self))
+        self.failed_queries = {}
+        self.cache = cache if cache is not None else ResponseCache()
+        self.lookup_cache = lookup_cache if lookup_cache is not None else ResponseCache()
+        self.health = get_health(nameres_url)
+        self.session = None
+        self.semaphore = None
+
+    def __str__(self):
+        return f"AsyncCachedNameRes({self.nameres_url})"
+
+    @staticmethod
+    def from_sync(cached_nameres: CachedNameRes, **kwargs) -> 'AsyncCachedNameRes':
+        """Create an async client that shares its caches with *cached_nameres*."""
+        return AsyncCachedNameRes(cached_nameres.nameres_url, cache=cached_nameres.cache,
+                                  lookup_cache=cached_nameres.lookup_cache,
+                                  max_batch_size=cached_nameres.max_batch_size, **kwargs)
+
+    async def __aenter__(self) -> 'AsyncCachedNameRes':
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.close()
+
+    async def close(self) -> None:
+        """Close the underlying ``aiohttp`` session, if one was opened."""
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    def _get_session(self) -> 'aiohttp.ClientSession':
+        # aiohttp sessions and semaphores are bound to the running event loop, so create them lazily.
+        if self.session is None:
+            self.session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.max_concurrency),
+                timeout=aiohttp.ClientTimeout(total=30),
+            )
+            self.semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self.session
+
+    async def bulk_lookup(self, queries: list[str], **params) -> dict[str, dict]:
+        """Look up *queries* in bulk, returning a ``{query: result}`` mapping.
+
+        Behaves like ``CachedNameRes.bulk_lookup()``: uncached queries are
+        fetched in concurrent chunks, failing chunks are bisected, and
+        ``PartialBatchError`` is raised if any single query still fails.
+        """
+        if not queries:
+            raise ValueError(f"queries must not be empty when calling bulk_lookup({queries}, {params}) on {self}")
+        if not isinstance(queries, list):
+            raise ValueError(f"queries must be a list when calling bulk_lookup({queries}, {params}) on {self}")
+
+        time_started = time.time_ns()
+        params_key = frozenset(params.items())
+        queries_set = set(queries)
+        cached_results = {}
+        for query in queries_set:
+            value = self.cache.get((query, params_key), MISSING)
+            if value is not MISSING:
+                cached_results[query] = value
+        owned_keys, in_flight = self.cache.claim((q, params_key) for q in queries_set - cached_results.keys())
+        queries_to_be_queried = {query for query, _ in owned_keys}
+
+        result = {}
+        failures = {}
+        if queries_to_be_queried:
+            pending_keys = set(owned_keys)
+            try:
+                chunks = list(chunked(sorted(queries_to_be_queried), self.max_batch_size))
+                for next_chunk in asyncio.as_completed([self._lookup_chunk(chunk, params) for chunk in chunks]):
+                    chunk_result, chunk_failures = await next_chunk
+                    self.cache.put_many({(query, params_key): value for query, value in chunk_result.items()})
+                    result.update(chunk_result)
+                    pending_keys -= {(query, params_key) for query in chunk_result}
+                    for query, e in chunk_failures.items():
+                        failures[(query,)] = e
+                        self.failed_queries[(query, params_key)] = e
+                        self.cache.release([(query, params_key)], e)
+                        pending_keys.discard((query, params_key))
+            finally:
+                # Don't leave other callers waiting on queries we will never look up.
+                if pending_keys:
+                    self.cache.release(pending_keys, RuntimeError(f"Lookup was interrupted on {self}"))
+            for query in result:
+                self.failed_queries.pop((query, params_key), None)
+
+        # Wait for queries that other callers were already looking up.
+        for (query, _), future in in_flight.items():
+            try:
+                result[query] = await await_claimed(future)
+            except Exception as e:
+                failures[(query,)] = e
+
+        result.update(cached_results)
+
+        time_taken_sec = (time.time_ns() - time_started) / 1E9
+        self.logger.info("Looked up %d queries (with %d cached) with params %s on %s in %.3fs",
+                         len(queries_to_be_queried), len(cached_results), params, self, time_taken_sec)
+
+        if failures:
+            raise PartialBatchError(
+                f"{len(failures)} of {len(queries_to_be_queried) + len(in_flight)} queries failed when looking them "
+                f"up with params {params} on {self}", result, failures)
+
+        return result
+
+    async def _lookup_chunk(self, queries: list[str], params: dict) -> tuple[dict[str, dict], dict[str, Exception]]:
+        """Look up a single chunk of *queries*, bisecting it on failure (see ``CachedNameRes._lookup_chunk()``)."""
+        api_params = dict(params)
+        api_params['strings'] = queries
+
+        session = self._get_session()
+        try:
+            async with self.semaphore:
+                self.logger.debug("Called NameRes %s with %d queries and params %s", self, len(queries), params)
+                response_json = await self._post(session, self.nameres_url + "bulk-lookup", json=api_params)
+            if not isinstance(response_json, dict):
+                raise ValueError(f"Expected a JSON object from {self}, got {type(response_json).__name__}")
+            return {query: response_json.get(query, None) for query in queries}, {}
+        except CircuitOpenError as e:
+            # Don't bisect: every smaller chunk would be rejected in the same way.
+            return {}, {query: e for query in queries}
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+            if len(queries) == 1:
+                self.logger.warning("Could not look up query %r with params %s on %s: %s", queries[0], params, self, e)
+                return {}, {queries[0]: e}
+            self.logger.info("Could not look up a chunk of %d queries with params %s on %s, splitting it in half: %s",
+                             len(queries), params, self, e)
+
+        middle = len(queries) // 2
+        (first_result, first_failures), (second_result, second_failures) = await asyncio.gather(
+            self._lookup_chunk(queries[:middle], params),
+            self._lookup_chunk(queries[middle:], params),
+        )
+        return first_result | second_result, first_failures | second_failures
+
+    async def _post(self, session: 'aiohttp.ClientSession', url: str, **kwargs):
+        """POST to *url* and return the JSON response, reporting the outcome to this target's TargetHealth."""
+        self.health.before_request()
+        try:
+            async with session.post(url, **kwargs) as response:
+                response.raise_for_status()
+                result = await response.json()
+        except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+            self.health.record_failure(e)
+            raise
+        except aiohttp.ClientResponseError as e:
+            # A 5xx status means the target is failing; any other error status means that it is up.
+            if e.status >= 500:
+                self.health.record_failure(e)
+            else:
+                self.health.record_success()
+            raise
+        except aiohttp.ClientError as e:
+            self.health.record_failure(e)
+            raise
+        except ValueError:
+            self.health.record_success()
+            raise
+        except BaseException:
+            self.health.cancel_probe()
+            raise
+        self.health.record_success()
+        return result
+
+    async def lookup(self, query: str, **params) -> list[dict]:
+        """Look up a single *query* string via the NameRes ``/lookup`` endpoint.
+
+        Like ``CachedNameRes.lookup()``, this does NOT delegate to
+        ``bulk_lookup()``; results are cached per ``(query, params)``.
+        """
+        cache_key = (query, frozenset(params.items()))
+        value = self.lookup_cache.get(cache_key, MISSING)
+        if value is not MISSING:
+            return value
+
+        owned_keys, in_flight = self.lookup_cache.claim([cache_key])
+        if cache_key in in_flight:
+            return await await_claimed(in_flight[cache_key])
+        if not owned_keys:
+            # Another caller cached it between our check and our claim.
+            return self.lookup_cache[cache_key]
+
+        api_params = _query_params(params)
+        api_params['string'] = query
+
+        try:
+            session = self._get_session()
+            async with self.semaphore:
+                self.logger.debug("Querying NameRes with params %s", api_params)
+                result = await self._post(session, self.nameres_url + "lookup", params=api_params)
+        except Exception as e:
+            self.lookup_cache.release(owned_keys, e)
+            raise
+        except BaseException:
+            # Don't hand a cancellation on to other callers waiting for this query.
+            self.lookup_cache.release(owned_keys, RuntimeError(f"Lookup was interrupted on {self}"))
+            raise
+
+        self.lookup_cache[cache_key] = result
+        return result
+
+    async def invalidate_query(self, query: str) -> None:
+        """Remove all cached results for *query* (across every param variant)."""
+        await self.invalidate_queries([query])
+
+    async def invalidate_queries(self, queries: list[str]) -> None:
+        """Remove all cached results (and recorded failures) for each of *queries*."""
+        queries = set(queries)
+        self.cache.invalidate_many(queries)
+        self.lookup_cache.invalidate_many(queries)
+        for key in [k for k in self.failed_queries if k[0] in queries]:
+            del self.failed_queries[key]
+
+    async def invalidate_queries_where(self, predicate: Callable[[str], bool]) -> set[str]:
+        """Remove all cached results (and recorded failures) for every query that satisfies *predicate*."""
+        queries = self.cache.invalidate_where(predicate) | self.lookup_cache.invalidate_where(predicate)
+        failed = {k[0] for k in self.failed_queries if predicate(k[0])}
+        await self.invalidate_queries(failed)
+        return queries | failed
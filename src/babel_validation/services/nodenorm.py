@@ -4,25 +4,133 @@ Cached client for the NodeNorm ``get_normalized_nodes`` API.
 Caching model
 -------------
 Each response is stored under the key ``(curie, frozenset(params.items()))``.
-Entries are never evicted automatically; call ``invalidate_curie()`` to force
-a fresh lookup for a specific identifier.
+By default entries are never evicted automatically; call ``invalidate_curie()``
+to force a fresh lookup for a specific identifier (or ``invalidate_curies()``
+and ``invalidate_curies_where()`` for many at once), or pass an
+``EvictionPolicy`` to bound the cache by entry count, approximate size or age
+(see ``cache.py``).
+
+Every CURIE in a clique gets the same response, so the in-memory cache
+stores each clique once, keyed by its preferred identifier and the params
+(see ``clique_share_key()``), and every CURIE in it refers to that one
+object.  Biolink types and taxa are interned (see ``intern_vocabulary()``),
+so that the handful of distinct type lists are shared across cliques too.
+Callers get the same results as before, but should treat them as read-only.
+
+Equivalent-identifier propagation
+---------------------------------
+A NodeNorm response for one CURIE also answers every identifier in its
+``equivalent_identifiers``, under the same params.  With
+``propagate_equivalents=True``, each fetched clique is also cached for every
+equivalent identifier that isn't already cached, so rows that list several
+identifiers from one clique need a single round trip.  These inferred entries
+are recorded in ``inferred_keys`` (see ``is_inferred()``), are only kept in
+memory, and are replaced once a CURIE is actually fetched.  Propagation is
+off by default, so that strict validation runs check every identifier against
+NodeNorm itself.
+
+Pass a ``PersistentCache`` to also keep responses on disk between runs.  The
+client reads the target's ``/status`` once when it is created, and the stored
+responses are discarded automatically whenever the reported Babel version
+changes.
 
 Cache-warming pattern
 ---------------------
 When you need to normalize many CURIEs for the same logical task (e.g. all
 CURIEs referenced in a GitHub issue), call ``normalize_curies()`` once with
-the full list.  That issues a single HTTP request and populates the cache.
-Subsequent ``normalize_curie()`` calls for any of those identifiers return
-immediately from cache — no additional HTTP traffic.
+the full list.  That populates the cache; subsequent ``normalize_curie()``
+calls for any of those identifiers return immediately from cache — no
+additional HTTP traffic.
+
+Batching
+--------
+Uncached CURIEs are split into chunks of at most ``max_batch_size`` and
+the chunks are POSTed concurrently on a thread pool of ``max_workers``
+threads, so a single call can normalize hundreds of thousands of CURIEs.
+Each chunk is cached as soon as it completes.  If any chunk fails, a
+``PartialBatchError`` is raised once the others have finished, carrying both
+the successful results and the failed chunks.
+
+Metrics
+-------
+``metrics`` counts the cache hits (including hits on inferred entries) and
+misses of every call, and the requests sent to ``get_normalized_nodes`` with
+their sizes and latencies (see ``metrics.py``).
+
+Thread safety
+-------------
+A ``CachedNodeNorm`` may be shared between threads.  When several threads
+miss on the same ``(curie, params)`` at the same time, only one of them
+requests it from NodeNorm; the others wait for that request to finish and
+share its result (see ``ResponseCache.claim()``).
 """
 
 import logging
+import sys
+import threading
 import time
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from typing import Protocol
 
 import requests
 
+from .batching import PartialBatchError, chunked
+from .cache import EvictionPolicy, ResponseCache
+from .http import SessionSettings, get_session
+from .metrics import ClientMetrics
+from .persistent_cache import MISSING, PersistentCache, status_version
+
 cached_node_norms_by_url = {}
+_cached_node_norms_lock = threading.Lock()
+
+
+def clique_share_key(key: tuple[str, frozenset], result: dict | None) -> tuple[str, frozenset] | None:
+    """Identify a NodeNorm result by its clique's preferred identifier and the params it was normalized with."""
+    if not result:
+        return None
+    try:
+        return result['id']['identifier'], key[1]
+    except (KeyError, TypeError):
+        return None
+
+
+_interned_type_lists = {}
+_interned_type_lists_lock = threading.Lock()
+
+
+def intern_vocabulary(result: dict | None) -> dict | None:
+    """Intern the strings a NodeNorm result shares with many others, modifying it in place.
+
+    Biolink types and taxa come from a small vocabulary: each string is interned,
+    and equal ``type`` lists are replaced by a single shared list.
+    """
+    if not result:
+        return result
+    types = result.get('type')
+    if isinstance(types, list):
+        type_key = tuple(sys.intern(t) for t in types)
+        with _interned_type_lists_lock:
+            result['type'] = _interned_type_lists.setdefault(type_key, list(type_key))
+    for identifier in result.get('equivalent_identifiers') or ():
+        taxa = identifier.get('taxa')
+        if taxa:
+            identifier['taxa'] = [sys.intern(taxon) for taxon in taxa]
+    return result
+
+
+def equivalent_results(chunk_result: dict[str, dict | None],
+                       params_key: frozenset) -> dict[tuple[str, frozenset], dict]:
+    """Map the cache key of every equivalent identifier of each result in *chunk_result* to that result."""
+    inferred = {}
+    for result in chunk_result.values():
+        if not result:
+            continue
+        for equivalent_identifier in result.get('equivalent_identifiers') or ():
+            identifier = equivalent_identifier.get('identifier')
+            if identifier:
+                inferred[(identifier, params_key)] = result
+    return inferred
 
 
 class NodeNormService(Protocol):
@@ -36,35 +144,79 @@ class NodeNormService(Protocol):
     def normalize_curies(self, curies: list[str], **params) -> dict[str, dict | None]: ...
     def normalize_curie(self, curie: str, **params) -> dict | None: ...
     def invalidate_curie(self, curie: str) -> None: ...
+    def invalidate_curies(self, curies: list[str]) -> None: ...
+    def invalidate_curies_where(self, predicate: Callable[[str], bool]) -> set[str]: ...
 
 
 class CachedNodeNorm:
-    def __init__(self, nodenorm_url: str):
+    def __init__(self, nodenorm_url: str, persistent_cache: PersistentCache | None = None,
+                 session: requests.Session | None = None, max_batch_size: int = 1000, max_workers: int = 4,
+                 eviction_policy: EvictionPolicy | None = None, propagate_equivalents: bool = False,
+                 session_settings: SessionSettings | None = None):
         self.nodenorm_url = nodenorm_url
+        self.max_batch_size = max_batch_size
+        self.max_workers = max_workers
+        self.propagate_equivalents = propagate_equivalents
+        self.inferred_keys = set()
+        self._inferred_keys_lock = threading.Lock()
         self.logger = logging.getLogger(str(self))
-        self.cache = {}
+        self.metrics = ClientMetrics()
+        self.session = session if session is not None else get_session(nodenorm_url, session_settings)
+        self.cache = ResponseCache(policy=eviction_policy, share_key=clique_share_key)
+
+        if persistent_cache is not None:
+            version = self.service_version()
+            if version is None:
+                self.logger.warning("Could not determine the version of %s, so its responses will not be stored "
+                                    "in %s", self, persistent_cache)
+            else:
+                persistent_cache.check_version(self.nodenorm_url, version)
+                self.cache.backing = persistent_cache.namespace(self.nodenorm_url, "get_normalized_nodes")
 
     def __str__(self):
         return f"CachedNodeNorm({self.nodenorm_url})"
 
     @staticmethod
-    def from_url(nodenorm_url: str) -> 'CachedNodeNorm':
+    def from_url(nodenorm_url: str, persistent_cache: PersistentCache | None = None,
+                 propagate_equivalents: bool = False,
+                 session_settings: SessionSettings | None = None) -> 'CachedNodeNorm':
         """Return the singleton ``CachedNodeNorm`` for *nodenorm_url*.
 
         The singleton ensures that cache entries accumulated during one part of
         a test run are reused by later parts that share the same URL.  Prefer
         this over direct construction unless you explicitly want a fresh cache.
+
+        *persistent_cache* and *propagate_equivalents* are only used when the
+        singleton is first created.  *session_settings* are the settings of the
+        pooled session for *nodenorm_url* (see ``get_session()``), which warns
+        if that session was already created with different ones.
         """
-        if nodenorm_url not in cached_node_norms_by_url:
-            cached_node_norms_by_url[nodenorm_url] = CachedNodeNorm(nodenorm_url)
-        return cached_node_norms_by_url[nodenorm_url]
+        if session_settings is not None:
+            get_session(nodenorm_url, session_settings)
+        with _cached_node_norms_lock:
+            if nodenorm_url not in cached_node_norms_by_url:
+                cached_node_norms_by_url[nodenorm_url] = CachedNodeNorm(
+                    nodenorm_url, persistent_cache, propagate_equivalents=propagate_equivalents,
+                    session_settings=session_settings)
+            return cached_node_norms_by_url[nodenorm_url]
+
+    def service_version(self) -> str | None:
+        """Return a string identifying the Babel version served by this NodeNorm, or ``None`` if unknown."""
+        try:
+            response = self.session.get(self.nodenorm_url + "status", timeout=30)
+            response.raise_for_status()
+            return status_version(response.json())
+        except (requests.RequestException, ValueError) as e:
+            self.logger.warning("Could not retrieve status from %s: %s", self, e)
+            return None
 
     def normalize_curies(self, curies: list[str], **params) -> dict[str, dict | None]:
         """Normalize *curies* in bulk, returning a ``{curie: result}`` mapping.
 
         Already-cached CURIEs are served from the cache; the remainder are
-        fetched from NodeNorm in a single HTTP POST to ``get_normalized_nodes``.
-        The response is merged with the cached results before returning.
+        fetched from NodeNorm in HTTP POSTs to ``get_normalized_nodes`` of at
+        most ``max_batch_size`` CURIEs each, running concurrently.  The
+        responses are merged with the cached results before returning.
 
         *curies* must be a non-empty list — the NodeNorm API rejects empty
         requests, so this method raises ``ValueError`` immediately.
@@ -72,6 +224,10 @@ class CachedNodeNorm:
         Values in the returned dict are ``None`` for CURIEs NodeNorm could not
         resolve.  Use this as the cache-warming call; subsequent
         ``normalize_curie()`` calls for these identifiers will be free.
+
+        If any chunk fails, raises ``PartialBatchError`` after every other
+        chunk has finished; its ``results`` hold (and the cache retains)
+        everything that was normalized successfully.
         """
         if not curies:
             raise ValueError(f"curies must not be empty when calling normalize_curies({curies}, {params}) on {self}")
@@ -81,32 +237,110 @@ class CachedNodeNorm:
         time_started = time.time_ns()
         params_key = frozenset(params.items())
         curies_set = set(curies)
-        cached_curies = {c for c in curies_set if (c, params_key) in self.cache}
-        curies_to_be_queried = curies_set - cached_curies
+        cached_results = {}
+        for curie in curies_set:
+            value = self.cache.get((curie, params_key), MISSING)
+            if value is not MISSING:
+                cached_results[curie] = value
+        owned_keys, in_flight = self.cache.claim((c, params_key) for c in curies_set - cached_results.keys())
+        curies_to_be_queried = {curie for curie, _ in owned_keys}
+        self.metrics.record_lookup("get_normalized_nodes", len(cached_results), len(curies_set) - len(cached_results),
+                                   self._count_inferred(cached_results.keys(), params_key))
 
-        # Make query.
+        # Make queries, one per chunk.
         result = {}
+        failures = {}
         if curies_to_be_queried:
-            api_params = dict(params)
-            api_params['curies'] = list(curies_to_be_queried)
+            pending_keys = set(owned_keys)
+            try:
+                chunks = list(chunked(sorted(curies_to_be_queried), self.max_batch_size))
+                with ThreadPoolExecutor(max_workers=min(self.max_workers, len(chunks))) as executor:
+                    futures = {executor.submit(self._normalize_chunk, chunk, params): chunk for chunk in chunks}
+                    for future in as_completed(futures):
+                        chunk = futures[future]
+                        chunk_keys = {(curie, params_key) for curie in chunk}
+                        try:
+                            chunk_result = future.result()
+                        except (requests.RequestException, ValueError) as e:
+                            self.logger.warning("Could not normalize a chunk of %d CURIEs with params %s on %s: %s",
+                                                len(chunk), params, self, e)
+                            failures[tuple(chunk)] = e
+                            self.cache.release(chunk_keys, e)
+                            pending_keys -= chunk_keys
+                            continue
+                        self.cache.put_many({(curie, params_key): chunk_result[curie] for curie in chunk})
+                        pending_keys -= chunk_keys
+                        with self._inferred_keys_lock:
+                            self.inferred_keys.difference_update(chunk_keys)
+                        if self.propagate_equivalents:
+                            self._propagate_equivalents(chunk_result, params_key)
+                        result.update(chunk_result)
+            finally:
+                # Don't leave other threads waiting on CURIEs we will never fetch.
+                if pending_keys:
+                    self.cache.release(pending_keys, RuntimeError(f"Normalization was interrupted on {self}"))
 
-            self.logger.debug("Called NodeNorm %s with params %s", self, api_params)
-            response = requests.post(self.nodenorm_url + "get_normalized_nodes", json=api_params, timeout=30)
-            response.raise_for_status()
-            result = response.json()
-
-            for curie in curies_to_be_queried:
-                self.cache[(curie, params_key)] = result.get(curie, None)
+        # Wait for CURIEs that other threads were already fetching.
+        for (curie, _), future in in_flight.items():
+            try:
+                result[curie] = future.result()
+            except Exception as e:
+                failures[(curie,)] = e
 
-        for curie in cached_curies:
-            result[curie] = self.cache[(curie, params_key)]
+        result.update(cached_results)
 
         time_taken_sec = (time.time_ns() - time_started) / 1E9
-        self.logger.info("Normalizing %d CURIEs %s (with %d CURIEs cached) with params %s on %s in %.3fs",
-                         len(curies_to_be_queried), curies_to_be_queried, len(cached_curies), params, self, time_taken_sec)
+        self.logger.info("Normalizing %d CURIEs (with %d CURIEs cached) with params %s on %s in %.3fs",
+                         len(curies_to_be_queried), len(cached_results), params, self, time_taken_sec)
+
+        if failures:
+            raise PartialBatchError(
+                f"{len(failures)} chunks failed when normalizing {len(curies_to_be_queried) + len(in_flight)} "
+                f"CURIEs with params {params} on {self}", result, failures)
 
         return result
 
+    def _normalize_chunk(self, curies: list[str], params: dict) -> dict[str, dict | None]:
+        """POST a single chunk of *curies* to ``get_normalized_nodes``, returning a result for every CURIE."""
+        api_params = dict(params)
+        api_params['curies'] = curies
+
+        self.logger.debug("Called NodeNorm %s with %d CURIEs and params %s", self, len(curies), params)
+        time_started = time.monotonic()
+        response = None
+        try:
+            response = self.session.post(self.nodenorm_url + "get_normalized_nodes", json=api_params, timeout=30)
+        finally:
+            self.metrics.record_request("get_normalized_nodes", len(curies), time.monotonic() - time_started, response)
+        response.raise_for_status()
+        response_json = response.json()
+        if not isinstance(response_json, dict):
+            raise ValueError(f"Expected a JSON object from {self}, got {type(response_json).__name__}")
+        return {curie: intern_vocabulary(response_json.get(curie, None)) for curie in curies}
+
+    def _propagate_equivalents(self, chunk_result: dict[str, dict | None], params_key: frozenset) -> None:
+        """Cache each result in *chunk_result* for every one of its equivalent identifiers that isn't cached yet."""
+        inferred = equivalent_results(chunk_result, params_key)
+        # Claiming skips keys that are already cached or that another thread is fetching.
+        owned_keys, _ = self.cache.claim(inferred.keys())
+        if not owned_keys:
+            return
+        with self._inferred_keys_lock:
+            self.inferred_keys.update(owned_keys)
+        self.cache.put_many({key: inferred[key] for key in owned_keys}, persist=False)
+
+    def _count_inferred(self, curies, params_key: frozenset) -> int:
+        """Count how many of *curies* are cached with *params_key* only because they were propagated."""
+        with self._inferred_keys_lock:
+            if not self.inferred_keys:
+                return 0
+            return sum(1 for curie in curies if (curie, params_key) in self.inferred_keys)
+
+    def is_inferred(self, curie: str, **params) -> bool:
+        """Return True if the cached result for *curie* was propagated from an equivalent identifier, not fetched."""
+        with self._inferred_keys_lock:
+            return (curie, frozenset(params.items())) in self.inferred_keys
+
     def normalize_curie(self, curie: str, **params) -> dict | None:
         """Normalize a single *curie*, returning the NodeNorm result or ``None``.
 
@@ -119,9 +353,11 @@ class CachedNodeNorm:
         that silently omits a requested CURIE returns ``None`` instead of
         raising ``KeyError``.
         """
-        cache_key = (curie, frozenset(params.items()))
-        if cache_key in self.cache:
-            return self.cache[cache_key]
+        params_key = frozenset(params.items())
+        value = self.cache.get((curie, params_key), MISSING)
+        if value is not MISSING:
+            self.metrics.record_lookup("get_normalized_nodes", 1, 0, self._count_inferred([curie], params_key))
+            return value
         return self.normalize_curies([curie], **params).get(curie)
 
     def invalidate_curie(self, curie: str) -> None:
@@ -130,6 +366,24 @@ class CachedNodeNorm:
         The next call to ``normalize_curie()`` or ``normalize_curies()`` for
         this identifier will issue a fresh HTTP request.
         """
-        keys_to_delete = [k for k in self.cache if k[0] == curie]
-        for k in keys_to_delete:
-            del self.cache[k]
+        self.invalidate_curies([curie])
+
+    def invalidate_curies(self, curies: list[str]) -> None:
+        """Remove all cached results for each of *curies* (across every param variant)."""
+        curies = set(curies)
+        self.cache.invalidate_many(curies)
+        with self._inferred_keys_lock:
+            self.inferred_keys -= {key for key in self.inferred_keys if key[0] in curies}
+
+    def invalidate_curies_where(self, predicate: Callable[[str], bool]) -> set[str]:
+        """Remove all cached results for every CURIE that satisfies *predicate*.
+
+        For example, ``invalidate_curies_where(lambda curie: curie.startswith('CHEBI:'))``
+        drops every cached CHEBI CURIE after a CHEBI hotfix.
+
+        :return: The set of CURIEs that were invalidated.
+        """
+        curies = self.cache.invalidate_where(predicate)
+        with self._inferred_keys_lock:
+            self.inferred_keys -= {key for key in self.inferred_keys if key[0] in curies}
+        return curies
@@ -0,0 +1,253 @@
+"""
+Asyncio-native cached client for the NodeNorm ``get_normalized_nodes`` API.
+
+``AsyncCachedNodeNorm`` mirrors ``CachedNodeNorm`` (see ``nodenorm.py``) with
+``async`` methods, so that a validation run can keep hundreds of requests in
+flight against a target from a single event loop.  It uses the same
+``ResponseCache`` and the same batching semantics: uncached CURIEs are split
+into chunks of ``max_batch_size``, each chunk is cached as soon as it
+completes, and failed chunks are reported in a ``PartialBatchError``.  At most
+``max_concurrency`` requests are in flight at once.  Requests are reported to
+the same ``TargetHealth`` as the synchronous client (see ``health.py``), so
+chunks fail immediately with ``CircuitOpenError`` while the target is down.
+
+To share cache entries with the synchronous client for the same URL, create
+the async client with ``AsyncCachedNodeNorm.from_sync(CachedNodeNorm.from_url(url))``.
+Both clients then claim the CURIEs they fetch in the shared cache (see
+``cache.py``), so a CURIE missed by both is only fetched once, and they share
+the record of entries propagated from equivalent identifiers (``inferred_keys``).
+
+This module needs ``aiohttp``, which is an optional dependency: install it
+with ``pip install babel-validation[async]``.
+"""
+
+import asyncio
+import logging
+import threading
+import time
+from collections.abc import Callable
+from typing import Protocol
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+from .batching import PartialBatchError, chunked
+from .cache import ResponseCache, await_claimed
+from .health import CircuitOpenError, get_health
+from .nodenorm import CachedNodeNorm, clique_share_key, equivalent_results, intern_vocabulary
+from .persistent_cache import MISSING
+
+
+class AsyncNodeNormService(Protocol):
+    """Asynchronous counterpart of ``NodeNormService``."""
+
+    async def normalize_curies(self, curies: list[str], **params) -> dict[str, dict | None]: ...
+    async def normalize_curie(self, curie: str, **params) -> dict | None: ...
+    async def invalidate_curie(self, curie: str) -> None: ...
+    async def invalidate_curies(self, curies: list[str]) -> None: ...
+    async def invalidate_curies_where(self, predicate: Callable[[str], bool]) -> set[str]: ...
+
+
+class AsyncCachedNodeNorm:
+    def __init__(self, nodenorm_url: str, cache: ResponseCache | None = None, max_batch_size: int = 1000,
+                 max_concurrency: int = 16, propagate_equivalents: bool = False):
+        if aiohttp is None:
+            raise ImportError("AsyncCachedNodeNorm requires aiohttp: install babel-validation[async]")
+        self.nodenorm_url = nodenorm_url
+        self.max_batch_size = max_batch_size
+        self.max_concurrency = max_concurrency
+        self.propagate_equivalents = propagate_equivalents
+        self.inferred_keys = set()
+        self._inferred_keys_lock = threading.Lock()
+        self.logger = logging.getLogger(str(self))
+        self.cache = cache if cache is not None else ResponseCache(share_key=clique_share_key)
+        self.health = get_health(nodenorm_url)
+        self.session = None
+        self.semaphore = None
+
+    def __str__(self):
+        return f"AsyncCachedNodeNorm({self.nodenorm_url})"
+
+    @staticmethod
+    def from_sync(cached_node_norm: CachedNodeNorm, **kwargs) -> 'AsyncCachedNodeNorm':
+        """Create an async client that shares its cache (and its ``inferred_keys``) with *cached_node_norm*."""
+        kwargs.setdefault('propagate_equivalents', cached_node_norm.propagate_equivalents)
+        client = AsyncCachedNodeNorm(cached_node_norm.nodenorm_url, cache=cached_node_norm.cache,
+                                     max_batch_size=cached_node_norm.max_batch_size, **kwargs)
+        client.inferred_keys = cached_node_norm.inferred_keys
+        client._inferred_keys_lock = cached_node_norm._inferred_keys_lock
+        return client
+
+    async def __aenter__(self) -> 'AsyncCachedNodeNorm':
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.close()
+
+    async def close(self) -> None:
+        """Close the underlying ``aiohttp`` session, if one was opened."""
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    def _get_session(self) -> 'aiohttp.ClientSession':
+        # aiohttp sessions and semaphores are bound to the running event loop, so create them lazily.
+        if self.session is None:
+            self.session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.max_concurrency),
+                timeout=aiohttp.ClientTimeout(total=30),
+            )
+            self.semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self.session
+
+    async def normalize_curies(self, curies: list[str], **params) -> dict[str, dict | None]:
+        """Normalize *curies* in bulk, returning a ``{curie: result}`` mapping.
+
+        Behaves like ``CachedNodeNorm.normalize_curies()``: uncached CURIEs
+        are fetched in concurrent chunks, and ``PartialBatchError`` is raised
+        if any chunk fails.
+        """
+        if not curies:
+            raise ValueError(f"curies must not be empty when calling normalize_curies({curies}, {params}) on {self}")
+        if not isinstance(curies, list):
+            raise ValueError(f"curies must be a list when calling normalize_curies({curies}, {params}) on {self}")
+
+        time_started = time.time_ns()
+        params_key = frozenset(params.items())
+        curies_set = set(curies)
+        cached_results = {}
+        for curie in curies_set:
+            value = self.cache.get((curie, params_key), MISSING)
+            if value is not MISSING:
+                cached_results[curie] = value
+        owned_keys, in_flight = self.cache.claim((c, params_key) for c in curies_set - cached_results.keys())
+        curies_to_be_queried = {curie for curie, _ in owned_keys}
+
+        result = {}
+        failures = {}
+        if curies_to_be_queried:
+            pending_keys = set(owned_keys)
+            try:
+                chunks = list(chunked(sorted(curies_to_be_queried), self.max_batch_size))
+                for next_chunk in asyncio.as_completed([self._normalize_chunk(chunk, params) for chunk in chunks]):
+                    chunk, chunk_result = await next_chunk
+                    chunk_keys = {(curie, params_key) for curie in chunk}
+                    if isinstance(chunk_result, Exception):
+                        self.logger.warning("Could not normalize a chunk of %d CURIEs with params %s on %s: %s",
+                                            len(chunk), params, self, chunk_result)
+                        failures[tuple(chunk)] = chunk_result
+                        self.cache.release(chunk_keys, chunk_result)
+                        pending_keys -= chunk_keys
+                        continue
+                    self.cache.put_many({(curie, params_key): chunk_result[curie] for curie in chunk})
+                    pending_keys -= chunk_keys
+                    with self._inferred_keys_lock:
+                        self.inferred_keys.difference_update(chunk_keys)
+                    if self.propagate_equivalents:
+                        self._propagate_equivalents(chunk_result, params_key)
+                    result.update(chunk_result)
+            finally:
+                # Don't leave other callers waiting on CURIEs we will never fetch.
+                if pending_keys:
+                    self.cache.release(pending_keys, RuntimeError(f"Normalization was interrupted on {self}"))
+
+        # Wait for CURIEs that other callers were already fetching.
+        for (curie, _), future in in_flight.items():
+            try:
+                result[curie] = await await_claimed(future)
+            except Exception as e:
+                failures[(curie,)] = e
+
+        result.update(cached_results)
+
+        time_taken_sec = (time.time_ns() - time_started) / 1E9
+        self.logger.info("Normalizing %d CURIEs (with %d CURIEs cached) with params %s on %s in %.3fs",
+                         len(curies_to_be_queried), len(cached_results), params, self, time_taken_sec)
+
+        if failures:
+            raise PartialBatchError(
+                f"{len(failures)} chunks failed when normalizing {len(curies_to_be_queried) + len(in_flight)} "
+                f"CURIEs with params {params} on {self}", result, failures)
+
+        return result
+
+    async def _normalize_chunk(self, curies: list[str], params: dict) -> tuple[list[str], dict | Exception]:
+        """POST a single chunk of *curies*, returning the chunk with either its results or the exception raised."""
+        api_params = dict(params)
+        api_params['curies'] = curies
+
+        session = self._get_session()
+        async with self.semaphore:
+            self.logger.debug("Called NodeNorm %s with %d CURIEs and params %s", self, len(curies), params)
+            try:
+                self.health.before_request()
+            except CircuitOpenError as e:
+                return curies, e
+            try:
+                async with session.post(self.nodenorm_url + "get_normalized_nodes", json=api_params) as response:
+                    response.raise_for_status()
+                    response_json = await response.json()
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                self.health.record_failure(e)
+                return curies, e
+            except aiohttp.ClientResponseError as e:
+                # A 5xx status means the target is failing; any other error status means that it is up.
+                if e.status >= 500:
+                    self.health.record_failure(e)
+                else:
+                    self.health.record_success()
+                return curies, e
+            except aiohttp.ClientError as e:
+                self.health.record_failure(e)
+                return curies, e
+            except ValueError as e:
+                self.health.record_success()
+                return curies, e
+            except BaseException:
+                self.health.cancel_probe()
+                raise
+        self.health.record_success()
+        return curies, {curie: intern_vocabulary(response_json.get(curie, None)) for curie in curies}
+
+    def _propagate_equivalents(self, chunk_result: dict[str, dict | None], params_key: frozenset) -> None:
+        """Cache each result in *chunk_result* for every one of its equivalent identifiers that isn't cached yet."""
+        inferred = equivalent_results(chunk_result, params_key)
+        # Claiming skips keys that are already cached or that another caller is fetching.
+        owned_keys, _ = self.cache.claim(inferred.keys())
+        if not owned_keys:
+            return
+        with self._inferred_keys_lock:
+            self.inferred_keys.update(owned_keys)
+        self.cache.put_many({key: inferred[key] for key in owned_keys}, persist=False)
+
+    def is_inferred(self, curie: str, **params) -> bool:
+        """Return True if the cached result for *curie* was propagated from an equivalent identifier, not fetched."""
+        with self._inferred_keys_lock:
+            return (curie, frozenset(params.items())) in self.inferred_keys
+
+    async def normalize_curie(self, curie: str, **params) -> dict | None:
+        """Normalize a single *curie*, returning the NodeNorm result or ``None``."""
+        value = self.cache.get((curie, frozenset(params.items())), MISSING)
+        if value is not MISSING:
+            return value
+        return (await self.normalize_curies([curie], **params)).get(curie)
+
+    async def invalidate_curie(self, curie: str) -> None:
+        """Remove all cached results for *curie* (across every param variant)."""
+        await self.invalidate_curies([curie])
+
+    async def invalidate_curies(self, curies: list[str]) -> None:
+        """Remove all cached results for each of *curies* (across every param variant)."""
+        curies = set(curies)
+        self.cache.invalidate_many(curies)
+        with self._inferred_keys_lock:
+            self.inferred_keys -= {key for key in self.inferred_keys if key[0] in curies}
+
+    async def invalidate_curies_where(self, predicate: Callable[[str], bool]) -> set[str]:
+        """Remove all cached results for every CURIE that satisfies *predicate*, returning those CURIEs."""
+        curies = self.cache.invalidate_where(predicate)
+        with self._inferred_keys_lock:
+            self.inferred_keys -= {key for key in self.inferred_keys if key[0] in curies}
+        return curies
@@ -0,0 +1,237 @@
+"""
+Persistent, version-aware response store shared by the cached service clients.
+
+Storage model
+-------------
+Responses are stored in a single SQLite database under the system temp
+directory (the same place ``GoogleSheetTestCases`` keeps its CSV cache), keyed
+by ``(target URL, endpoint, identifier, params)``.  The database outlives the
+interpreter, so re-running a failed subset against the same deployment reads
+its responses from disk instead of re-issuing every HTTP request.  SQLite
+handles locking between processes, so pytest-xdist workers can share one file.
+
+Invalidation
+------------
+Every target records the service version it reported the last time a client
+attached to it (see ``check_version()``).  When a target reports a different
+version, every response stored for that target is discarded.  Entries older
+than ``ttl_seconds`` are ignored on read and purged lazily.
+
+Sharing within a run
+--------------------
+With ``--shared-cache``, the pytest controller creates a run-scoped database
+(with no TTL) and passes its path to every pytest-xdist worker, so that a
+response fetched by one worker is read from the database by the others
+instead of being fetched again.  ``lock()`` returns a lock shared by every
+process using the same database, which the warm-up fixtures hold so that only
+one worker warms up each target while the others wait and then read its
+responses.
+"""
+
+import hashlib
+import json
+import sqlite3
+import tempfile
+import threading
+import time
+from collections.abc import Iterable
+from pathlib import Path
+
+from filelock import FileLock
+
+# Sentinel returned by lookups that found nothing, since ``None`` is a valid
+# cached response (e.g. a CURIE that NodeNorm could not normalize).
+MISSING = object()
+
+
+# Fields of a NodeNorm or NameRes ``/status`` response that identify the data
+# being served. Volatile fields (uptime, document counts) are deliberately omitted.
+VERSION_STATUS_FIELDS = ('babel_version', 'babel_version_url', 'biolink_model', 'version', 'nameres_version')
+
+
+def serialize_params(params_key: frozenset) -> str:
+    """Serialize a ``frozenset(params.items())`` cache key into a stable string."""
+    return json.dumps(sorted(params_key, key=lambda kv: kv[0]), default=str)
+
+
+def status_version(status: dict) -> str | None:
+    """Summarize a ``/status`` response as a version string, or ``None`` if it reports no version at all."""
+    version = {field: status[field] for field in VERSION_STATUS_FIELDS if status.get(field)}
+    if not version:
+        return None
+    return json.dumps(version, sort_keys=True, default=str)
+
+
+class PersistentCache:
+    """A SQLite-backed response store that survives across interpreter runs."""
+
+    def __init__(self, path: str | Path | None = None, ttl_seconds: float | None = 7 * 24 * 3600):
+        """Open (creating if necessary) the persistent cache database.
+
+        :param path: The SQLite database file. Defaults to a file in the system temp directory.
+        :param ttl_seconds: How long a stored response stays valid, or ``None`` to keep responses
+            until the target reports a new version.
+        """
+        if path is None:
+            path = Path(tempfile.gettempdir()) / "babel_validation_responses.sqlite3"
+        self.path = Path(path)
+        self.ttl_seconds = ttl_seconds
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, timeout=60, check_same_thread=False, isolation_level=None)
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                " target TEXT NOT NULL, endpoint TEXT NOT NULL, identifier TEXT NOT NULL, params TEXT NOT NULL,"
+                " stored_at REAL NOT NULL, value TEXT NOT NULL,"
+                " PRIMARY KEY (target, endpoint, identifier, params))"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS versions (target TEXT PRIMARY KEY, version TEXT NOT NULL)"
+            )
+
+    def __str__(self):
+        return f"PersistentCache({self.path}, ttl_seconds={self.ttl_seconds})"
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    def lock(self, name: str) -> FileLock:
+        """Return a lock called *name* that is shared by every process using this database."""
+        name_hash = hashlib.sha256(name.encode('utf-8')).hexdigest()[:16]
+        return FileLock(f"{self.path}.{name_hash}.lock")
+
+    def check_version(self, target: str, version: str) -> bool:
+        """Record *version* for *target*, discarding its stored responses if the version changed.
+
+        :return: True if the stored responses for *target* are still valid, False if they were discarded.
+        """
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute("SELECT version FROM versions WHERE target = ?", (target,)).fetchone()
+                still_valid = row is not None and row[0] == version
+                if not still_valid:
+                    self._conn.execute("DELETE FROM responses WHERE target = ?", (target,))
+                    self._conn.execute("INSERT OR REPLACE INTO versions (target, version) VALUES (?, ?)",
+                                       (target, version))
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return still_valid
+
+    def namespace(self, target: str, endpoint: str) -> 'PersistentNamespace':
+        """Return a view of this cache restricted to a single target and endpoint."""
+        return PersistentNamespace(self, target, endpoint)
+
+    def _is_fresh(self, stored_at: float) -> bool:
+        return self.ttl_seconds is None or time.time() - stored_at < self.ttl_seconds
+
+    def get(self, target: str, endpoint: str, identifier: str, params: str):
+        """Return the stored response, or ``MISSING`` if there is none (or it has expired)."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT stored_at, value FROM responses"
+                " WHERE target = ? AND endpoint = ? AND identifier = ? AND params = ?",
+                (target, endpoint, identifier, params)
+            ).fetchone()
+        if row is None:
+            return MISSING
+        stored_at, value = row
+        if not self._is_fresh(stored_at):
+            self.delete(target, endpoint, identifier, params)
+            return MISSING
+        return json.loads(value)
+
+    def put_many(self, target: str, endpoint: str, entries: dict[tuple[str, str], object]) -> None:
+        """Store many responses at once, keyed by ``(identifier, serialized params)``."""
+        if not entries:
+            return
+        now = time.time()
+        rows = [(target, endpoint, identifier, params, now, json.dumps(value))
+                for (identifier, params), value in entries.items()]
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO responses (target, endpoint, identifier, params, stored_at, value)"
+                    " VALUES (?, ?, ?, ?, ?, ?)", rows)
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def delete(self, target: str, endpoint: str, identifier: str, params: str | None = None) -> None:
+        """Delete the stored responses for *identifier* (for every param variant if *params* is None)."""
+        with self._lock:
+            if params is None:
+                self._conn.execute("DELETE FROM responses WHERE target = ? AND endpoint = ? AND identifier = ?",
+                                   (target, endpoint, identifier))
+            else:
+                self._conn.execute(
+                    "DELETE FROM responses WHERE target = ? AND endpoint = ? AND identifier = ? AND params = ?",
+                    (target, endpoint, identifier, params))
+
+    def delete_many(self, target: str, endpoint: str, identifiers: Iterable[str]) -> None:
+        """Delete the stored responses for every identifier in *identifiers*, in a single transaction."""
+        rows = [(target, endpoint, identifier) for identifier in identifiers]
+        if not rows:
+            return
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.executemany(
+                    "DELETE FROM responses WHERE target = ? AND endpoint = ? AND identifier = ?", rows)
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def identifiers(self, target: str, endpoint: str) -> list[str]:
+        """Return every identifier with at least one stored response."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT DISTINCT identifier FROM responses WHERE target = ? AND endpoint = ?",
+                (target, endpoint)).fetchall()
+        return [row[0] for row in rows]
+
+    def purge_expired(self) -> None:
+        """Delete every response older than ``ttl_seconds``."""
+        if self.ttl_seconds is None:
+            return
+        with self._lock:
+            self._conn.execute("DELETE FROM responses WHERE stored_at < ?", (time.time() - self.ttl_seconds,))
+
+
+class PersistentNamespace:
+    """A ``PersistentCache`` bound to one target URL and endpoint."""
+
+    def __init__(self, store: PersistentCache, target: str, endpoint: str):
+        self.store = store
+        self.target = target
+        self.endpoint = endpoint
+
+    def __str__(self):
+        return f"{self.store} for {self.target}{self.endpoint}"
+
+    def get(self, identifier: str, params_key: frozenset):
+        return self.store.get(self.target, self.endpoint, identifier, serialize_params(params_key))
+
+    def put_many(self, entries: dict[tuple[str, frozenset], object]) -> None:
+        self.store.put_many(self.target, self.endpoint, {
+            (identifier, serialize_params(params_key)): value for (identifier, params_key), value in entries.items()
+        })
+
+    def delete(self, identifier: str, params_key: frozenset | None = None) -> None:
+        params = None if params_key is None else serialize_params(params_key)
+        self.store.delete(self.target, self.endpoint, identifier, params)
+
+    def delete_many(self, identifiers: Iterable[str]) -> None:
+        self.store.delete_many(self.target, self.endpoint, identifiers)
+
+    def identifiers(self) -> list[str]:
+        return self.store.identifiers(self.target, self.endpoint)
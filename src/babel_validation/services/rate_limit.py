@@ -0,0 +1,150 @@
+"""
+Request-rate and concurrency limits per target, shared by every process on this machine.
+
+Each pytest-xdist worker has its own clients and sessions, so ``-n 16`` sends
+16 times as many requests to a target as a single process would.
+``RateGovernor`` limits the requests to one base URL across all of those
+processes (and their threads) with two file-backed mechanisms, both kept in
+the system temp directory and keyed by a hash of the base URL:
+
+- A token bucket: requests are let through at ``requests_per_second`` on
+  average, with bursts of up to ``burst`` requests.  The bucket's state (the
+  number of tokens and when it was last refilled) is a small JSON file that is
+  only read and written while holding a ``FileLock``.
+- A cap on concurrent requests: each request holds one of
+  ``max_concurrent`` slot lock files while it is in flight.
+
+The pooled sessions in ``http.py`` wait for the governor of their base URL
+before every request, when ``RateLimitPerSecond`` or ``MaxConcurrentRequests``
+is set for the target in ``targets.ini``.  Retries made by the session's retry
+policy are part of the same request, and aren't counted separately.
+"""
+
+import contextlib
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from dataclasses import dataclass
+
+from filelock import FileLock, Timeout
+
+logger = logging.getLogger(__name__)
+
+governors_by_url = {}
+_governors_lock = threading.Lock()
+
+
+@dataclass(frozen=True)
+class RateLimitSettings:
+    """The request rate and number of concurrent requests allowed for a target (None for no limit)."""
+    requests_per_second: float | None = None
+    burst: int | None = None
+    max_concurrent: int | None = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.requests_per_second is not None or self.max_concurrent is not None
+
+
+class RateGovernor:
+    def __init__(self, base_url: str, settings: RateLimitSettings, state_dir: str | None = None,
+                 poll_interval_seconds: float = 0.05):
+        self.base_url = base_url
+        self.settings = settings
+        self.poll_interval_seconds = poll_interval_seconds
+        self.waited_seconds = 0.0
+
+        url_hash = hashlib.sha256(base_url.encode('utf-8')).hexdigest()[:16]
+        prefix = os.path.join(state_dir or tempfile.gettempdir(), f"babel_validation_ratelimit_{url_hash}")
+        self.bucket_file = prefix + '.json'
+        self.bucket_lock = FileLock(prefix + '.lock')
+        self.slot_files = [f"{prefix}.slot{slot}.lock" for slot in range(settings.max_concurrent or 0)]
+
+    def __str__(self):
+        return f"RateGovernor({self.base_url})"
+
+    @contextlib.contextmanager
+    def request(self, blocking: bool = True):
+        """
+        Wait until a request may be sent to this target, and hold a concurrency slot until the block exits.
+
+        :param blocking: If False, don't wait: the block gets False (and the request mustn't be sent) if no slot or
+            token is available right now.
+        """
+        time_started = time.monotonic()
+        with self._slot(blocking) as allowed:
+            allowed = allowed and self._take_token(blocking)
+            self.waited_seconds += time.monotonic() - time_started
+            yield allowed
+
+    @contextlib.contextmanager
+    def _slot(self, blocking: bool = True):
+        """Hold one of the slot locks, polling until one is free (or yielding False if not *blocking*)."""
+        if not self.slot_files:
+            yield True
+            return
+
+        while True:
+            for slot_file in self.slot_files:
+                # A new FileLock for every attempt, so that threads in this process can't share a slot.
+                slot = FileLock(slot_file)
+                try:
+                    slot.acquire(timeout=0)
+                except Timeout:
+                    continue
+                try:
+                    yield True
+                finally:
+                    slot.release()
+                return
+            if not blocking:
+                yield False
+                return
+            time.sleep(self.poll_interval_seconds)
+
+    def _take_token(self, blocking: bool = True) -> bool:
+        """Take a token from the bucket, waiting until one is available (or returning False if not *blocking*)."""
+        rate = self.settings.requests_per_second
+        if rate is None:
+            return True
+        burst = self.settings.burst or max(1, int(rate))
+
+        while True:
+            with self.bucket_lock:
+                now = time.time()
+                try:
+                    with open(self.bucket_file, encoding='utf-8') as f:
+                        state = json.load(f)
+                    tokens = min(burst, state['tokens'] + (now - state['updated']) * rate)
+                except (OSError, ValueError, KeyError):
+                    # No bucket yet (or a corrupt one): start with a full bucket.
+                    tokens = burst
+                if tokens >= 1:
+                    tokens -= 1
+                    wait = 0
+                else:
+                    wait = (1 - tokens) / rate
+                with open(self.bucket_file, 'w', encoding='utf-8') as f:
+                    json.dump({'tokens': tokens, 'updated': now}, f)
+            if not wait:
+                return True
+            if not blocking:
+                return False
+            time.sleep(wait)
+
+
+def get_governor(base_url: str, settings: RateLimitSettings) -> RateGovernor | None:
+    """Return the shared RateGovernor for *base_url*, or None if *settings* doesn't limit anything.
+
+    *settings* is only used when the governor is first created.
+    """
+    if not settings.enabled:
+        return None
+    with _governors_lock:
+        if base_url not in governors_by_url:
+            governors_by_url[base_url] = RateGovernor(base_url, settings)
+        return governors_by_url[base_url]
@@ -2,12 +2,19 @@
 # https://docs.google.com/spreadsheets/d/11zebx8Qs1Tc3ShQR9nh4HRW8QSoo8k65w_xIaftN0no/edit?usp=sharing
 #
 # This library contains classes and methods for accessing those test cases.
+import array
 import csv
+import dataclasses
+import functools
 import hashlib
 import io
+import json
+import os
+import sys
 import tempfile
 import time
 from collections import Counter
+from collections.abc import Callable, Iterable
 from pathlib import Path
 
 import pytest
@@ -16,6 +23,108 @@ from _pytest.mark import ParameterSet
 from filelock import FileLock
 
 from ...core.testrow import TestRow
+from ...core.testrow_index import TestRowIndex
+
+# Bump this whenever TestRow or the parsing in parse_csv() changes, so that parsed-row caches written by
+# older code are ignored.
+PARSED_ROWS_FORMAT = 4
+
+# The TestRow fields in constructor order, and those that hold tuples or (interned) frozensets.
+_FIELDS = tuple(field.name for field in dataclasses.fields(TestRow))
+_TUPLE_FIELDS = {'AdditionalLabels', 'AdditionalIDs'}
+_FROZENSET_FIELDS = {'Flags', 'Conflations', 'BiolinkClasses', 'Prefixes'}
+
+
+def _encode_parsed_rows(parsed_rows: list[TestRow | None]) -> bytes:
+    """
+    Encode parsed rows column by column: a JSON header lists the distinct values of every TestRow field, followed
+    by an array of 32-bit indexes into those values, one per field of every non-empty row.
+    """
+    values = {name: {} for name in _FIELDS}
+    indexes = array.array('I')
+    empty = []
+    for position, test_row in enumerate(parsed_rows):
+        if test_row is None:
+            empty.append(position)
+            continue
+        for name in _FIELDS:
+            field_values = values[name]
+            indexes.append(field_values.setdefault(getattr(test_row, name), len(field_values)))
+    header = {
+        'format': PARSED_ROWS_FORMAT,
+        'byteorder': sys.byteorder,
+        'count': len(parsed_rows),
+        'empty': empty,
+        'values': {name: [sorted(value) if name in _FROZENSET_FIELDS else value for value in field_values]
+                   for name, field_values in values.items()},
+    }
+    return json.dumps(header).encode("utf-8") + b"\n" + indexes.tobytes()
+
+
+def _decode_parsed_rows(data: bytes) -> list[TestRow | None] | None:
+    """ Decode parsed rows written by _encode_parsed_rows(), or return None if they are in a different format. """
+    header_end = data.index(b"\n")
+    header = json.loads(data[:header_end])
+    if header['format'] != PARSED_ROWS_FORMAT or header['byteorder'] != sys.byteorder:
+        return None
+    indexes = array.array('I')
+    indexes.frombytes(data[header_end + 1:])
+    field_count = len(_FIELDS)
+    if len(indexes) != (header['count'] - len(header['empty'])) * field_count:
+        raise ValueError(f"Expected {header['count'] - len(header['empty'])} rows of indexes, got "
+                         f"{len(indexes) / field_count}")
+
+    columns = []
+    for column, name in enumerate(_FIELDS):
+        field_values = header['values'][name]
+        if name in _FROZENSET_FIELDS:
+            field_values = [frozenset(map(sys.intern, value)) for value in field_values]
+        elif name in _TUPLE_FIELDS:
+            field_values = [tuple(value) for value in field_values]
+        elif name in ('Category', 'Source'):
+            field_values = [sys.intern(value) for value in field_values]
+        columns.append([field_values[index] for index in indexes[column::field_count]])
+    test_rows = iter(list(map(TestRow, *columns)))
+
+    empty = set(header['empty'])
+    return [None if position in empty else next(test_rows) for position in range(header['count'])]
+
+
+def parse_csv(csv_content: str) -> tuple[list[dict], list[TestRow | None]]:
+    """
+    Parse the CSV content of a Google Sheet.
+
+    :return: A tuple of the raw rows (as dicts) and, for each raw row, its TestRow (or None if the row is empty).
+    """
+    rows = []
+    test_rows = []
+    with io.StringIO(csv_content) as f:
+        reader = csv.DictReader(f)
+        for row in reader:
+            rows.append(row)
+            if any(row.values()):
+                test_rows.append(TestRow.from_data_row(row))
+            else:
+                test_rows.append(None)
+    return rows, test_rows
+
+
+def make_category_filter(categories_include: set[str], categories_exclude: set[str]) -> Callable[[str], bool]:
+    """
+    Return a function that returns True for the categories selected by an include list and an exclude list.
+
+    If any categories are included, only those (minus the excluded categories) are selected; otherwise every
+    category except the excluded ones is selected.
+    """
+    def category_test(cat):
+        if categories_include:
+            # Only include the included categories minus the excluded categories.
+            return cat in categories_include and cat not in categories_exclude
+        else:
+            # Only exclude the categories that are explicitly excluded.
+            return cat not in categories_exclude
+
+    return category_test
 
 
 class GoogleSheetTestCases:
@@ -24,7 +133,7 @@ class GoogleSheetTestCases:
     """
 
     def __str__(self):
-        return f"Google Sheet Test Cases ({len(self.rows)} test cases from {self.google_sheet_id})"
+        return f"Google Sheet Test Cases ({len(self.parsed_rows)} test cases from {self.google_sheet_id})"
 
     def __init__(self, google_sheet_id="11zebx8Qs1Tc3ShQR9nh4HRW8QSoo8k65w_xIaftN0no", cache_ttl_seconds: int = 3600):
         """ Create a Google Sheet test case.
@@ -33,6 +142,11 @@ class GoogleSheetTestCases:
         :param cache_ttl_seconds: How long a cached download stays valid. pytest deletes the cache at the
             start of every run (see tests/conftest.py), so this TTL mainly protects other consumers
             (e.g. csv-to-babeltests) from reading stale data forever.
+
+        The parsed rows are cached as well, in a compact file next to the CSV cache that is named after the hash
+        of the CSV content. Other processes reading the same download (such as pytest-xdist workers) load the
+        parsed rows from that file instead of parsing the CSV again; the raw rows in self.rows are only parsed
+        from the CSV if they are used.
         """
 
         self.google_sheet_id = google_sheet_id
@@ -51,34 +165,80 @@ class GoogleSheetTestCases:
                 self.csv_content = response.text
                 cache_file.write_text(self.csv_content, encoding="utf-8")
 
-        self.rows = []
-        with io.StringIO(self.csv_content) as f:
-            reader = csv.DictReader(f)
-            for row in reader:
-                self.rows.append(row)
+            content_hash = hashlib.sha256(self.csv_content.encode("utf-8")).hexdigest()[:16]
+            parsed_file = cache_file.with_name(f"{cache_file.stem}.{content_hash}.rows")
+            parsed_rows = self._read_parsed_rows(parsed_file)
+            if parsed_rows is None:
+                self.rows, parsed_rows = parse_csv(self.csv_content)
+                self._write_parsed_rows(parsed_file, parsed_rows)
+
+        # self.parsed_rows holds the TestRow for each raw row (or None if the row is empty).
+        self.parsed_rows = parsed_rows
+
+        # Indexes of the positions of the rows in self.rows by Category, PreferredID, prefix and so on.
+        self.index = TestRowIndex(self.parsed_rows)
+
+    @functools.cached_property
+    def rows(self) -> list[dict]:
+        """ The raw rows of the Google Sheet, as dicts. """
+        rows, _ = parse_csv(self.csv_content)
+        return rows
 
-    def test_rows(self, test_id_prefix: str, test_nodenorm: bool = False, test_nameres: bool = False) -> list[ParameterSet]:
+    @staticmethod
+    def _read_parsed_rows(parsed_file: Path) -> list[TestRow | None] | None:
+        """ Read the parsed rows cached in parsed_file, or return None if there aren't any usable ones. """
+        try:
+            return _decode_parsed_rows(parsed_file.read_bytes())
+        except (OSError, ValueError, KeyError, TypeError, IndexError):
+            return None
+
+    @staticmethod
+    def _write_parsed_rows(parsed_file: Path, parsed_rows: list[TestRow | None]) -> None:
+        """ Cache the parsed rows in parsed_file, and delete parsed rows cached for older downloads. """
+        stem = parsed_file.name.split('.')[0]
+        # Older versions cached the parsed rows as pickles or JSON; delete those too without loading them.
+        for pattern in (f"{stem}.*.rows", f"{stem}.*.json", f"{stem}.*.pickle"):
+            for old_file in parsed_file.parent.glob(pattern):
+                old_file.unlink(missing_ok=True)
+        fd, temp_name = tempfile.mkstemp(dir=parsed_file.parent, prefix=f"{stem}.", suffix=".rows.tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(_encode_parsed_rows(parsed_rows))
+            os.replace(temp_name, parsed_file)
+        except BaseException:
+            os.unlink(temp_name)
+            raise
+
+    def test_rows(self, test_id_prefix: str, test_nodenorm: bool = False, test_nameres: bool = False,
+                  category_filter: Callable[[str], bool] | None = None,
+                  row_indexes: Iterable[int] | None = None) -> list[ParameterSet]:
         """
         self.rows is the raw list of rows we got back from the Google Sheets. This method transforms that into
         a list of TestRows.
 
         :param test_id_prefix: The prefix for the row ID.
+        :param category_filter: If provided, only rows whose Category this function returns True for are
+            included. Rows in other categories are skipped without being looked at.
+        :param row_indexes: If provided, only the rows at these positions in self.rows are included (e.g. the
+            result of query()).
 
         :return: A list of TestRows for the rows in this file.
         """
-        def has_nonempty_value(d: dict):
-            return not all(not s for s in d.values())
+        if row_indexes is None:
+            row_indexes = range(len(self.parsed_rows))
+        if category_filter is not None:
+            selected_by_category = self.index.positions_where('category', category_filter)
+            row_indexes = sorted(set(row_indexes) & selected_by_category)
 
         trows = []
-        for count, row in enumerate(self.rows):
+        for count in row_indexes:
             # Note that count is off by two: presumably one for the header row and one because we count from zero
             # but Google Sheets counts from one.
             row_count = count + 2
             row_id = f"{test_id_prefix}:row={row_count}"
 
-            if has_nonempty_value(row):
-                tr = TestRow.from_data_row(row)
-
+            tr = self.parsed_rows[count]
+            if tr is not None:
                 if test_nodenorm:
                     if tr.ExpectPassInNodeNorm:
                         trows.append(pytest.param(tr, id=row_id))
@@ -107,6 +267,17 @@ class GoogleSheetTestCases:
 
         return trows
 
+    def query(self, **criteria: str | Iterable[str]) -> list[int]:
+        """
+        Return the positions in self.rows of the (non-empty) rows that match every criterion. See
+        TestRowIndex.query() for the fields that can be queried, e.g.:
+
+            gsheet.query(preferred_prefix='CHEBI', conflation='drug_chemical')
+
+        Pass the result to test_rows() as row_indexes to parametrize a sub-suite, or use it with self.parsed_rows.
+        """
+        return self.index.query(**criteria)
+
     def categories(self):
         """ Return a dict of all the categories of tests available with their counts. """
-        return Counter(map(lambda t: t.get('Category', ''), self.rows))
+        return Counter(self.index.values('category'))
@@ -0,0 +1,81 @@
+"""In-process stand-ins for the HTTP sessions used by the cached service clients.
+
+Offline (``-m unit``) tests pass a ``FakeSession`` to ``CachedNodeNorm`` or
+``CachedNameRes`` instead of a pooled ``requests.Session``, so the client logic
+can be tested without a NodeNorm or NameRes target.
+"""
+
+import json
+import threading
+
+import requests
+
+
+class FakeResponse:
+    def __init__(self, status_code: int, body):
+        self.status_code = status_code
+        self.body = body
+        self.ok = status_code < 400
+        self.text = json.dumps(body)
+        self.content = self.text.encode('utf-8')
+        self.request = None
+
+    def json(self):
+        return self.body
+
+    def raise_for_status(self):
+        if not self.ok:
+            raise requests.HTTPError(f"HTTP {self.status_code}: {self.text}", response=self)
+
+
+class FakeSession:
+    """A fake ``requests.Session`` that answers every request by calling *handler*.
+
+    *handler* is called as ``handler(method, url, json=..., params=...)`` and returns either a JSON-serializable
+    body (for a 200 response) or a ``FakeResponse``. Every request is recorded in ``calls``.
+    """
+
+    def __init__(self, handler):
+        self.handler = handler
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def request(self, method, url, json=None, params=None, **kwargs):
+        with self._lock:
+            self.calls.append((method, url, json, params))
+        result = self.handler(method, url, json=json, params=params)
+        response = result if isinstance(result, FakeResponse) else FakeResponse(200, result)
+        response.request = requests.Request(method, url, json=json, params=params).prepare()
+        return response
+
+    def get(self, url, params=None, **kwargs):
+        return self.request('GET', url, params=params, **kwargs)
+
+    def post(self, url, json=None, params=None, **kwargs):
+        return self.request('POST', url, json=json, params=params, **kwargs)
+
+    def close(self):
+        pass
+
+
+def fake_nodenorm(method, url, json=None, params=None):
+    """Normalize every CURIE to itself, except those with the FAKE: prefix, which NodeNorm can't normalize."""
+    if url.endswith('status'):
+        return {'status': 'running', 'babel_version': 'fake'}
+    curies = json['curies'] if json else params['curie']
+    return {
+        curie: None if curie.startswith('FAKE:') else {
+            'id': {'identifier': curie, 'label': curie},
+            'equivalent_identifiers': [{'identifier': curie}],
+            'type': ['biolink:NamedThing'],
+        } for curie in curies
+    }
+
+
+def fake_nameres(method, url, json=None, params=None):
+    """Return a single result whose label is the query, for both ``bulk-lookup`` and ``lookup``."""
+    if url.endswith('status'):
+        return {'status': 'ok', 'babel_version': 'fake'}
+    if url.endswith('bulk-lookup'):
+        return {query: [{'curie': f'FAKE:{query}', 'label': query}] for query in json['strings']}
+    return [{'curie': f"FAKE:{params['string']}", 'label': params['string']}]
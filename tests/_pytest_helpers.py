@@ -5,8 +5,27 @@ Google Sheet, GitHub issues) at collection time. pytest only applies ``-m``
 marker deselection *after* test generation, so a run like ``pytest -m unit``
 would still pay for those fetches before discarding the tests. Evaluating the
 marker expression ourselves lets us skip the fetch when the test won't run.
+
+``category_filter()`` applies the ``--category``/``--category-exclude``
+options, so that Google Sheet rows can be filtered before they are
+parametrized.  ``selected_test_rows()`` lets session-level warm-up fixtures find out which
+rows will actually run, once collection and deselection are complete, and
+``can_warm_up()`` whether an xdist worker can tell which of those rows it runs.
+
+``report_divergences()`` attaches a cross-target divergence report to a test's
+report, for the terminal summary in ``conftest.py``.
+
+``locality_group()`` names the ``xdist_group`` that ``--locality-groups`` puts a
+Google Sheet test in, so that rows that make similar requests run on the same
+pytest-xdist worker.
 """
 
+import os
+
+import pytest
+
+from src.babel_validation.services.multi_target import format_divergence_report, summarize_divergences
+
 
 def deselected_by_markexpr(metafunc) -> bool:
     """True if an active ``-m`` marker expression would deselect this test.
@@ -29,3 +48,79 @@ def deselected_by_markexpr(metafunc) -> bool:
     except Exception:
         # Unparseable expression — let pytest handle it; don't suppress tests.
         return False
+
+
+def category_filter(config):
+    """A function that returns True for the categories selected by ``--category`` and ``--category-exclude``."""
+    from src.babel_validation.sources.google_sheets.google_sheet_test_cases import make_category_filter
+    return make_category_filter(set(config.getoption('--category')), set(config.getoption('--category-exclude')))
+
+
+def selected_test_rows(session, function_name: str, group: str | None = None) -> list:
+    """The distinct ``test_row`` parameters of the collected (and not deselected) items of *function_name*.
+
+    Items are parametrized once per target, so rows shared by several targets are only returned once.
+
+    :param group: If given, only items in this ``xdist_group`` are included.
+    """
+    rows = {}
+    for item in session.items:
+        callspec = getattr(item, 'callspec', None)
+        if getattr(item, 'originalname', None) != function_name or callspec is None:
+            continue
+        if group is not None and xdist_group(item) != group:
+            continue
+        row = callspec.params.get('test_row')
+        if row is not None:
+            rows.setdefault(id(row), row)
+    return list(rows.values())
+
+
+def can_warm_up(config, group: str | None, shared_cache) -> bool:
+    """Whether a warm-up fixture should look up the rows from ``selected_test_rows()`` before the tests run.
+
+    Every xdist worker collects the whole suite, so unless its rows are in an xdist group (which ``--dist loadgroup``
+    runs on a single worker) a worker can't tell which rows it will run. Without a *shared_cache*, through which the
+    first worker to warm up answers the others, warming up would then send every selected row's requests from
+    every worker, so the tests are left to make their requests one at a time instead.
+    """
+    if not os.environ.get('PYTEST_XDIST_WORKER') or shared_cache is not None:
+        return True
+    return group is not None and config.getoption('dist', 'no') == 'loadgroup'
+
+
+def locality_group(target: str, function_name: str, test_row) -> str:
+    """
+    The name of the xdist_group for a Google Sheet test: its target and function, the prefix of the row's
+    PreferredID and the row's conflations. Rows in the same group mostly make requests with the same params for
+    identifiers from the same source, so they batch and cache well together.
+    """
+    from src.babel_validation.core.testrow_index import curie_prefix
+    prefix = curie_prefix(test_row.PreferredID)
+    conflations = '+'.join(sorted(c for c in test_row.Conflations if c)) or 'none'
+    return f"{target}:{function_name}:{prefix}:{conflations}"
+
+
+def xdist_group(item) -> str | None:
+    """The name of the ``xdist_group`` that *item* is in, or None."""
+    marker = item.get_closest_marker('xdist_group')
+    if marker is None:
+        return None
+    return marker.kwargs.get('name', marker.args[0] if marker.args else None)
+
+
+def report_divergences(request, service: str, divergences: list) -> None:
+    """Attach *divergences* to the report of the current test, which the terminal summary lists (see conftest.py).
+
+    Targets are expected to differ (e.g. dev runs a newer Babel release than prod), so this only fails the test
+    with ``--fail-on-divergence``.
+    """
+    report = format_divergence_report(divergences)
+    request.node.user_properties.append(('divergences', {
+        'service': service,
+        'count': len(divergences),
+        'summary': summarize_divergences(divergences),
+        'report': report,
+    }))
+    if divergences and request.config.getoption('--fail-on-divergence'):
+        pytest.fail(f"{len(divergences)} {service} responses differ between targets:\n{report}")
@@ -1,14 +1,28 @@
 #
 # conftest.py - pytest configuration settings
 #
+import dataclasses
 import glob
+import json
 import os
 import os.path
 import tempfile
+import time
 
 import pytest
 import configparser
 
+from src.babel_validation.services.health import health_by_url
+from src.babel_validation.services.http import (SessionSettings, close_sessions, create_session, get_session,
+                                                sessions_by_url)
+from src.babel_validation.services.metrics import format_report, merge_reports, metrics_report
+from src.babel_validation.services.multi_target import MultiTargetNameRes, MultiTargetNodeNorm
+from src.babel_validation.services.nameres import CachedNameRes, cached_nameres_by_url
+from src.babel_validation.services.nodenorm import CachedNodeNorm, cached_node_norms_by_url
+from src.babel_validation.services.persistent_cache import PersistentCache
+from src.babel_validation.services.rate_limit import get_governor
+from tests._pytest_helpers import category_filter, locality_group
+
 
 def get_targets_ini_path(config):
     """
@@ -50,6 +64,137 @@ def pytest_configure(config):
             unlink_if_exists(f)
             unlink_if_exists(f.removesuffix('.csv') + '.lock')
 
+    # With --shared-cache, the controller picks a run-scoped cache database, which it passes on to the xdist
+    # workers in pytest_configure_node().
+    config.shared_cache_path = None
+    if hasattr(config, 'workerinput'):
+        config.shared_cache_path = config.workerinput.get('shared_cache_path')
+    elif config.getoption('--shared-cache'):
+        config.shared_cache_path = os.path.join(
+            tempfile.gettempdir(), f"babel_validation_shared_{os.getpid()}_{int(time.time())}.sqlite3")
+
+    # Client metrics reported by the xdist workers as they finish (see pytest_testnodedown()).
+    config.worker_metrics_reports = []
+    config.metrics_report = None
+
+
+@pytest.hookimpl(optionalhook=True)
+def pytest_configure_node(node):
+    # Called on the controller for each xdist worker that it starts.
+    node.workerinput['shared_cache_path'] = node.config.shared_cache_path
+
+
+@pytest.hookimpl(optionalhook=True)
+def pytest_testnodedown(node, error):
+    # Called on the controller when an xdist worker has finished, with the metrics it set in pytest_sessionfinish().
+    report = getattr(node, 'workeroutput', {}).get('metrics_report')
+    if report:
+        node.config.worker_metrics_reports.append(report)
+
+
+# The Google Sheet test functions that --locality-groups groups.
+LOCALITY_GROUPED_FUNCTIONS = {'test_normalization', 'test_label'}
+
+# The test functions that compare several targets, which are deselected unless at least two targets are selected.
+CROSS_TARGET_FUNCTIONS = {'test_cross_target_divergence'}
+
+
+def pytest_collection_modifyitems(config, items):
+    if len(get_targets(config)) < 2:
+        deselected = [item for item in items if getattr(item, 'originalname', item.name) in CROSS_TARGET_FUNCTIONS]
+        if deselected:
+            config.hook.pytest_deselected(items=deselected)
+            items[:] = [item for item in items if item not in deselected]
+
+    if not config.getoption('--locality-groups'):
+        return
+    for item in items:
+        callspec = getattr(item, 'callspec', None)
+        if getattr(item, 'originalname', None) not in LOCALITY_GROUPED_FUNCTIONS or callspec is None:
+            continue
+        test_row = callspec.params.get('test_row')
+        target_info = callspec.params.get('target_info')
+        if test_row is None or target_info is None:
+            continue
+        item.add_marker(pytest.mark.xdist_group(name=locality_group(target_info.name, item.originalname, test_row)))
+
+
+# The cross-target divergence reports attached to test reports by report_divergences(), including those from xdist
+# workers.
+divergence_reports = []
+
+# How many lines of each divergence report to show in the terminal summary.
+DIVERGENCE_REPORT_LINES = 20
+
+
+def pytest_runtest_logreport(report):
+    if report.when != 'call':
+        return
+    for name, value in report.user_properties:
+        if name == 'divergences':
+            divergence_reports.append(value)
+
+
+def pytest_sessionfinish(session):
+    # Collect the metrics of every client and pooled session used in this process. xdist workers pass theirs on to
+    # the controller, which adds them together and writes them out with --metrics-json.
+    config = session.config
+    report = metrics_report(list(cached_node_norms_by_url.values()) + list(cached_nameres_by_url.values()),
+                            sessions_by_url)
+    if hasattr(config, 'workeroutput'):
+        config.workeroutput['metrics_report'] = report
+        return
+
+    config.metrics_report = merge_reports(config.worker_metrics_reports + [report])
+    metrics_json = config.getoption('--metrics-json')
+    if metrics_json:
+        with open(metrics_json, 'w', encoding='utf-8') as f:
+            json.dump(config.metrics_report, f, indent=2)
+
+
+def pytest_terminal_summary(terminalreporter, config):
+    unhealthy = [health for health in health_by_url.values() if health.is_open]
+    if unhealthy:
+        terminalreporter.section("unhealthy targets")
+        for health in unhealthy:
+            terminalreporter.write_line(health.reason)
+
+    if divergence_reports:
+        terminalreporter.section("cross-target divergences")
+        report_path = config.getoption('--divergence-report')
+        for divergences in divergence_reports:
+            terminalreporter.write_line(f"{divergences['service']}: {divergences['count']} responses differ")
+            for line in divergences['summary']:
+                terminalreporter.write_line(f"  {line}")
+            if not report_path:
+                lines = divergences['report'].splitlines()
+                for line in lines[:DIVERGENCE_REPORT_LINES]:
+                    terminalreporter.write_line(f"  {line}")
+                if len(lines) > DIVERGENCE_REPORT_LINES:
+                    terminalreporter.write_line(f"  ... and {len(lines) - DIVERGENCE_REPORT_LINES} more: use "
+                                                f"--divergence-report FILE to write the full report.")
+        if report_path:
+            with open(report_path, 'w', encoding='utf-8') as f:
+                for divergences in divergence_reports:
+                    f.write(f"# {divergences['service']}\n{divergences['report']}\n")
+            terminalreporter.write_line(f"Wrote the full divergence report to {report_path}")
+
+    if config.metrics_report:
+        lines = format_report(config.metrics_report)
+        if lines:
+            terminalreporter.section("client metrics")
+            for line in lines:
+                terminalreporter.write_line(line)
+
+
+def pytest_unconfigure(config):
+    close_sessions()
+    if config.shared_cache_path and not hasattr(config, 'workerinput'):
+        for suffix in ('', '-wal', '-shm'):
+            unlink_if_exists(config.shared_cache_path + suffix)
+        for lock_file in glob.glob(config.shared_cache_path + '.*.lock'):
+            unlink_if_exists(lock_file)
+
 
 def pytest_addoption(parser):
     # The target environment(s) to target.
@@ -72,6 +217,65 @@ def pytest_addoption(parser):
         action='append',
         help="The categories of tests to exclude."
     )
+    # Keep NodeNorm/NameRes responses on disk between runs.
+    parser.addoption(
+        '--persistent-cache',
+        action='store_true',
+        default=False,
+        help="Store NodeNorm and NameRes responses in a persistent on-disk cache, so that re-runs against the same "
+             "deployment (and Babel version) don't repeat requests."
+    )
+    parser.addoption(
+        '--shared-cache',
+        action='store_true',
+        default=False,
+        help="Share NodeNorm and NameRes responses between pytest-xdist workers through an on-disk cache that is "
+             "deleted at the end of the run (implied by --persistent-cache)."
+    )
+    parser.addoption(
+        '--persistent-cache-ttl',
+        type=float,
+        default=7 * 24 * 3600,
+        help="How long (in seconds) responses in the persistent cache stay valid."
+    )
+    # Keep Google Sheet rows that make similar requests on the same xdist worker.
+    parser.addoption(
+        '--locality-groups',
+        action='store_true',
+        default=False,
+        help="Put Google Sheet tests in xdist groups by target, PreferredID prefix and conflations, so that rows "
+             "that make similar requests run (and are warmed up) together on one worker. Use with "
+             "`-n <workers> --dist loadgroup`."
+    )
+    # Answer NodeNorm queries from cliques already fetched for an equivalent identifier.
+    parser.addoption(
+        '--propagate-equivalents',
+        action='store_true',
+        default=False,
+        help="Cache each NodeNorm clique for all of its equivalent identifiers, so that identifiers from an "
+             "already-fetched clique aren't queried again. Leave this off for strict validation runs."
+    )
+    # Cross-target divergences are reported in the terminal summary, rather than failing the tests.
+    parser.addoption(
+        '--fail-on-divergence',
+        action='store_true',
+        default=False,
+        help="Fail test_cross_target_divergence if the responses of the selected targets differ, instead of only "
+             "reporting the differences in the terminal summary."
+    )
+    parser.addoption(
+        '--divergence-report',
+        default=None,
+        help="Write the full report of every NodeNorm and NameRes response that differs between the selected "
+             "targets to this file."
+    )
+    # Write the client metrics shown in the terminal summary to a JSON file.
+    parser.addoption(
+        '--metrics-json',
+        default=None,
+        help="Write the cache, request and latency metrics of every NodeNorm and NameRes client used in this run "
+             "(added up across xdist workers) to this JSON file, e.g. to compare CI runs."
+    )
 
 
 def read_targets(config_path):
@@ -110,6 +314,13 @@ def pytest_report_header(config):
     target_info.append(f"included categories: {categories_include}")
     target_info.append(f"excluded categories: {categories_exclude}")
 
+    if config.getoption('--persistent-cache'):
+        target_info.append(f"persistent cache TTL: {config.getoption('--persistent-cache-ttl')}s")
+    elif config.shared_cache_path:
+        target_info.append(f"sharing responses between workers in {config.shared_cache_path}")
+    if config.getoption('--propagate-equivalents'):
+        target_info.append("propagating NodeNorm results to equivalent identifiers")
+
     return target_info
 
 
@@ -130,19 +341,100 @@ def categories_exclude(request):
 
 @pytest.fixture
 def test_category(request):
-    def category_test(cat):
-        categories_include = set(request.config.getoption('--category'))
-        categories_exclude = set(request.config.getoption('--category-exclude'))
-
-        if categories_include:
-            # Only include the included categories minus the excluded categories.
-            if cat in categories_include and cat not in categories_exclude:
-                return True
-            return False
-        else:
-            # Only exclude the categories that are explicitly excluded.
-            if cat in categories_exclude:
-                return False
-            return True
-
-    return category_test
+    return category_filter(request.config)
+
+
+@pytest.fixture(scope="session")
+def persistent_cache(request):
+    """
+    The persistent response cache if --persistent-cache was specified, the run-scoped cache shared between xdist
+    workers if --shared-cache was specified, or None.
+    """
+    if request.config.getoption('--persistent-cache'):
+        return PersistentCache(ttl_seconds=request.config.getoption('--persistent-cache-ttl'))
+    if request.config.shared_cache_path:
+        return PersistentCache(request.config.shared_cache_path, ttl_seconds=None)
+    return None
+
+def healthy_session(base_url, target_info):
+    """
+    Return the pooled session for base_url, or skip the test if the target is unhealthy (i.e. too many requests
+    to it have failed in a row, and it isn't yet time to probe it again).
+    """
+    session = get_session(base_url, SessionSettings.from_target_info(target_info))
+    if session.health.is_rejecting:
+        pytest.skip(session.health.reason)
+    return session
+
+@pytest.fixture
+def nodenorm_session(target_info):
+    """The pooled keep-alive session shared by every request to this target's NodeNorm."""
+    return healthy_session(target_info['NodeNormURL'], target_info)
+
+@pytest.fixture
+def nameres_session(target_info):
+    """The pooled keep-alive session shared by every request to this target's NameRes."""
+    return healthy_session(target_info['NameResURL'], target_info)
+
+def unretried_session(base_url, target_info):
+    """
+    Return a new pooled session for base_url that never retries or hedges a request and doesn't track the target's
+    health, but still waits for its rate limits. Retries and hedging would hide the failed or differing responses
+    that some tests exist to observe.
+    """
+    settings = dataclasses.replace(SessionSettings.from_target_info(target_info), max_retries=0,
+                                   hedge_percentile=None)
+    return create_session(settings, governor=get_governor(base_url, settings.rate_limit))
+
+@pytest.fixture
+def unretried_nodenorm_session(target_info):
+    """A pooled session for this target's NodeNorm that sends every request exactly once (see unretried_session())."""
+    session = unretried_session(target_info['NodeNormURL'], target_info)
+    yield session
+    session.close()
+
+@pytest.fixture
+def unretried_nameres_session(target_info):
+    """A pooled session for this target's NameRes that sends every request exactly once (see unretried_session())."""
+    session = unretried_session(target_info['NameResURL'], target_info)
+    yield session
+    session.close()
+
+@pytest.fixture
+def cached_nodenorm(request, target_info, persistent_cache, nodenorm_session):
+    return CachedNodeNorm.from_url(target_info['NodeNormURL'], persistent_cache,
+                                   propagate_equivalents=request.config.getoption('--propagate-equivalents'),
+                                   session_settings=SessionSettings.from_target_info(target_info))
+
+@pytest.fixture
+def cached_nameres(target_info, persistent_cache, nameres_session):
+    return CachedNameRes.from_url(target_info['NameResURL'], persistent_cache,
+                                  lookup_timeout_seconds=float(target_info.get('NameResTimeout', 10)),
+                                  session_settings=SessionSettings.from_target_info(target_info))
+
+@pytest.fixture(scope="session")
+def all_target_info(request):
+    """The settings of every selected target (e.g. with `--target all`), by target name."""
+    return {target: get_target(request.config, target) for target in get_targets(request.config)}
+
+@pytest.fixture(scope="session")
+def multi_target_nodenorm(request, all_target_info, persistent_cache):
+    """Sends identical NodeNorm requests to every selected target at once, through each target's CachedNodeNorm."""
+    clients = {}
+    for target, target_info in all_target_info.items():
+        clients[target] = CachedNodeNorm.from_url(
+            target_info['NodeNormURL'], persistent_cache,
+            propagate_equivalents=request.config.getoption('--propagate-equivalents'),
+            session_settings=SessionSettings.from_target_info(target_info))
+    return MultiTargetNodeNorm(clients)
+
+@pytest.fixture(scope="session")
+def multi_target_nameres(all_target_info, persistent_cache):
+    """Sends identical NameRes lookups to every selected target at once, through each target's CachedNameRes."""
+    clients = {}
+    for target, target_info in all_target_info.items():
+        clients[target] = CachedNameRes.from_url(
+            target_info['NameResURL'], persistent_cache,
+            lookup_timeout_seconds=float(target_info.get('NameResTimeout', 10)),
+            session_settings=SessionSettings.from_target_info(target_info))
+    return MultiTargetNameRes(clients)
@@ -0,0 +1,69 @@
+#
+# Offline tests for the pure evaluation functions used by the Google Sheet tests and babel-validate.
+#
+import pytest
+
+from src.babel_validation.core.evaluation import evaluate_lookup, evaluate_normalization
+from src.babel_validation.core.testrow import TestRow, TestStatus
+
+pytestmark = pytest.mark.unit
+
+
+def _row(preferred_id, preferred_label='', biolink_classes='', flags=''):
+    return TestRow.from_data_row({
+        'Query ID': 'DOID:9351',
+        'Preferred ID': preferred_id,
+        'Preferred Label': preferred_label,
+        'Biolink Classes': biolink_classes,
+        'Flags': flags,
+    })
+
+
+def _clique(identifier, label, types):
+    return {'id': {'identifier': identifier, 'label': label}, 'type': types}
+
+
+def test_evaluate_normalization():
+    row = _row('MONDO:0005015', 'diabetes mellitus', biolink_classes='biolink:Disease|!biolink:Gene')
+
+    assert evaluate_normalization(row, 'DOID:9351', _clique('MONDO:0005015', 'Diabetes Mellitus', ['biolink:Disease']),
+                                  'test').status == TestStatus.Passed
+    assert evaluate_normalization(row, 'DOID:9351', None, 'test').status == TestStatus.Failed
+
+    wrong_id = evaluate_normalization(row, 'DOID:9351', _clique('MONDO:1', 'diabetes mellitus', ['biolink:Disease']),
+                                      'test')
+    assert wrong_id.status == TestStatus.Failed
+    assert 'not expected identifier MONDO:0005015' in wrong_id.message
+
+    excluded = evaluate_normalization(row, 'DOID:9351',
+                                      _clique('MONDO:0005015', 'diabetes mellitus', ['biolink:Disease', 'biolink:Gene']),
+                                      'test')
+    assert excluded.status == TestStatus.Failed
+    assert 'excluded biolink type biolink:Gene' in excluded.message
+
+
+def test_evaluate_normalization_negative():
+    row = _row('MONDO:0005015', flags='negative')
+    assert evaluate_normalization(row, 'DOID:9351', None, 'test').status == TestStatus.Passed
+
+
+def test_evaluate_lookup():
+    row = _row('MONDO:0005015', 'diabetes mellitus')
+    results = [{'curie': f'MONDO:{i}', 'label': 'other', 'types': []} for i in range(10)]
+    expected = {'curie': 'MONDO:0005015', 'label': 'Diabetes Mellitus', 'types': ['biolink:Disease']}
+
+    assert evaluate_lookup(row, '', [expected] + results, 20, 5, 'test').status == TestStatus.Passed
+    assert evaluate_lookup(row, '', [], 20, 5, 'test').status == TestStatus.Failed
+    # Close to the top is an expected failure, further down is a failure.
+    assert evaluate_lookup(row, '', results[:3] + [expected], 20, 5, 'test').status == TestStatus.Skipped
+    assert evaluate_lookup(row, '', results + [expected], 20, 5, 'test').status == TestStatus.Failed
+    # Excluded classes are checked against the types of the top result.
+    assert evaluate_lookup(row, '!biolink:Disease', [expected], 20, 5, 'test').status == TestStatus.Failed
+
+
+def test_evaluate_lookup_negative():
+    row = _row('MONDO:0005015', flags='negative')
+    expected = {'curie': 'MONDO:0005015', 'label': 'diabetes mellitus', 'types': []}
+
+    assert evaluate_lookup(row, '', [], 20, 5, 'test').status == TestStatus.Passed
+    assert evaluate_lookup(row, '', [expected], 20, 5, 'test').status == TestStatus.Failed
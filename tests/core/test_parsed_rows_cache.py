@@ -0,0 +1,66 @@
+#
+# Offline tests for the cache of parsed Google Sheet rows.
+#
+import csv
+import io
+import time
+from pathlib import Path
+
+import pytest
+
+from src.babel_validation.sources.google_sheets.google_sheet_test_cases import GoogleSheetTestCases, parse_csv
+
+pytestmark = pytest.mark.unit
+
+CSV_FILE = Path(__file__).parent.parent / 'data' / 'Babel_NodeNorm_NameRes_validation-Tests-2024feb19.csv'
+
+
+def _large_sheet(copies: int) -> str:
+    """The sample sheet repeated *copies* times, with distinct labels and identifiers in every copy."""
+    rows = list(csv.DictReader(io.StringIO(CSV_FILE.read_text(encoding='utf-8'))))
+    with io.StringIO() as f:
+        writer = csv.DictWriter(f, fieldnames=list(rows[0]))
+        writer.writeheader()
+        for copy in range(copies):
+            for row in rows:
+                writer.writerow({column: f"{value}{copy}" if value and column in (
+                    'Query Label', 'Preferred Label', 'Query ID', 'Preferred ID', 'Additional IDs', 'Source URL',
+                    'Notes') else value for column, value in row.items()})
+        return f.getvalue()
+
+
+def _best_of(repeats, function):
+    timings = []
+    for _ in range(repeats):
+        time_started = time.perf_counter()
+        result = function()
+        timings.append(time.perf_counter() - time_started)
+    return min(timings), result
+
+
+def test_parsed_rows_round_trip(tmp_path):
+    _, parsed_rows = parse_csv(CSV_FILE.read_text(encoding='utf-8'))
+    parsed_file = tmp_path / 'babel_validation_gsheet_test.0123.rows'
+    (tmp_path / 'babel_validation_gsheet_test.4567.pickle').write_bytes(b'not loaded')
+    (tmp_path / 'babel_validation_gsheet_test.89ab.json').write_bytes(b'not loaded')
+
+    GoogleSheetTestCases._write_parsed_rows(parsed_file, parsed_rows)
+    assert [path.name for path in tmp_path.iterdir()] == [parsed_file.name]
+    assert GoogleSheetTestCases._read_parsed_rows(parsed_file) == parsed_rows
+
+    parsed_file.write_bytes(parsed_file.read_bytes()[:-1])
+    assert GoogleSheetTestCases._read_parsed_rows(parsed_file) is None
+
+
+def test_loading_parsed_rows_is_faster_than_parsing(tmp_path):
+    csv_content = _large_sheet(10)
+    parse_seconds, (_, parsed_rows) = _best_of(3, lambda: parse_csv(csv_content))
+    parsed_file = tmp_path / 'babel_validation_gsheet_test.0123.rows'
+    GoogleSheetTestCases._write_parsed_rows(parsed_file, parsed_rows)
+    load_seconds, loaded_rows = _best_of(3, lambda: GoogleSheetTestCases._read_parsed_rows(parsed_file))
+
+    assert loaded_rows == parsed_rows
+    assert parsed_file.stat().st_size < len(csv_content.encode('utf-8'))
+    # Usually about four times faster.
+    assert load_seconds < parse_seconds / 2, f"Loaded {len(parsed_rows)} rows in {load_seconds:.3f}s, but " \
+                                             f"parsed them in {parse_seconds:.3f}s"
@@ -0,0 +1,65 @@
+#
+# Offline tests for the Google Sheet query planners.
+#
+import pytest
+
+from src.babel_validation.core.query_plan import NameResQueryPlan, NodeNormQueryPlan, PlannedRequest
+from src.babel_validation.core.testrow import TestRow
+from src.babel_validation.services.nameres import CachedNameRes
+from src.babel_validation.services.nodenorm import CachedNodeNorm
+from tests._fake_services import FakeSession, fake_nameres, fake_nodenorm
+
+pytestmark = pytest.mark.unit
+
+
+def _row(query_id, preferred_id, additional_ids='', conflations='', query_label='', biolink_classes=''):
+    return TestRow.from_data_row({
+        'Query ID': query_id,
+        'Preferred ID': preferred_id,
+        'Additional IDs': additional_ids,
+        'Conflations': conflations,
+        'Query Label': query_label,
+        'Biolink Classes': biolink_classes,
+    })
+
+
+def test_nodenorm_plan_deduplicates_requests():
+    rows = [
+        _row('DOID:9351', 'MONDO:0005015', additional_ids='UMLS:C0011849'),
+        _row('MONDO:0005015', 'MONDO:0005015'),
+        _row('MONDO:0005015', 'MONDO:0005015', conflations='drug_chemical'),
+        _row('MONDO:0005015', 'MONDO:0005015', conflations='unknown'),
+    ]
+    plan = NodeNormQueryPlan.from_rows(rows)
+
+    assert plan.rows_planned == 3
+    assert plan.total_requests == 7
+    assert plan.unique_requests == 4
+    assert plan.dedup_ratio == 7 / 4
+    mondo = PlannedRequest('MONDO:0005015', frozenset({('conflate', 'false')}))
+    assert [(d.row, d.assertion) for d in plan.dependents[mondo]] == [
+        (rows[0], 'PreferredID'), (rows[1], 'QueryID'), (rows[1], 'PreferredID')]
+
+    session = FakeSession(fake_nodenorm)
+    results = plan.execute(CachedNodeNorm("https://nodenorm.example.org/", session=session))
+    assert results[mondo]['id']['identifier'] == 'MONDO:0005015'
+    assert len(session.calls) == 2
+
+
+def test_nameres_plan_deduplicates_requests():
+    rows = [
+        _row('', 'MONDO:0005015', query_label='diabetes', biolink_classes='biolink:Disease'),
+        _row('', 'MONDO:0005015', query_label='diabetes'),
+        _row('', '', query_label='diabetes'),
+    ]
+    plan = NameResQueryPlan.from_rows(rows, limit=10)
+
+    # Row 0 is looked up with and without its Biolink class; row 1 only without one; row 2 has no PreferredID.
+    assert plan.rows_planned == 2
+    assert plan.total_requests == 3
+    assert plan.unique_requests == 2
+
+    session = FakeSession(fake_nameres)
+    results = plan.execute(CachedNameRes("https://name-lookup.example.org/", session=session))
+    assert len(results) == 2
+    assert len(session.calls) == 2
@@ -0,0 +1,44 @@
+#
+# Offline tests for TestRowIndex.
+#
+import pytest
+
+from src.babel_validation.core.testrow import TestRow
+from src.babel_validation.core.testrow_index import TestRowIndex
+
+pytestmark = pytest.mark.unit
+
+
+def _row(category, query_id, preferred_id, conflations='', biolink_classes='', flags=''):
+    return TestRow.from_data_row({
+        'Category': category,
+        'Query ID': query_id,
+        'Preferred ID': preferred_id,
+        'Conflations': conflations,
+        'Biolink Classes': biolink_classes,
+        'Flags': flags,
+    })
+
+
+ROWS = [
+    _row('Drugs', 'RXCUI:1', 'CHEBI:1', conflations='drug_chemical', biolink_classes='biolink:Drug'),
+    None,
+    _row('Drugs', 'CHEBI:2', 'CHEBI:2', biolink_classes='biolink:ChemicalEntity'),
+    _row('Diseases', 'DOID:1', 'MONDO:1', flags='negative'),
+]
+
+
+def test_query():
+    index = TestRowIndex(ROWS)
+
+    assert index.query(preferred_prefix='CHEBI', conflation='drug_chemical') == [0]
+    assert index.query(preferred_prefix='CHEBI') == [0, 2]
+    assert index.query(prefix=['RXCUI', 'DOID']) == [0, 3]
+    assert index.query(category='Drugs', flag='negative') == []
+    assert index.query() == [0, 2, 3]
+    assert index.values('category') == {'Drugs': 2, 'Diseases': 1}
+
+
+def test_unknown_field():
+    with pytest.raises(ValueError):
+        TestRowIndex(ROWS).query(colour='blue')
@@ -1,6 +1,5 @@
 import logging
 
-import requests
 import pytest
 
 from src.babel_validation.sources.google_sheets.blocklist import load_blocklist_from_gsheet
@@ -28,7 +27,7 @@ def pytest_generate_tests(metafunc):
     metafunc.parametrize("blocklist_entry", _get_blocklist_entries())
 
 
-def test_check_blocklist_entry(target_info, blocklist_entry, categories_include):
+def test_check_blocklist_entry(target_info, blocklist_entry, categories_include, nameres_session):
     """
     Test whether a NameRes instance has blocked every item from a blocklist.
 
@@ -59,7 +58,7 @@ def test_check_blocklist_entry(target_info, blocklist_entry, categories_include)
 
     # Someday we would like to do this with the query as well, but that would require some work.
     # So we only test the CURIE for now.
-    response = requests.get(nameres_synonyms_url, params={
+    response = nameres_session.get(nameres_synonyms_url, params={
         'preferred_curies': blocklist_entry.CURIE,
     })
     assert response.ok, (
@@ -5,11 +5,10 @@
 import urllib.parse
 
 import pytest
-import requests
 from openapi_spec_validator import validate_url
 from openapi_spec_validator.validation.exceptions import OpenAPIValidationError
 
-def test_openapi_json(target_info):
+def test_openapi_json(target_info, nameres_session):
     """
     Test the OpenAPI specification.
     """
@@ -17,7 +16,7 @@ def test_openapi_json(target_info):
     nameres_url = target_info['NameResURL']
 
     url = urllib.parse.urljoin(nameres_url, 'openapi.json')
-    response = requests.get(url)
+    response = nameres_session.get(url)
     assert response.ok, f"Could not GET {url}: {response}"
 
     openapi_json = response.json()
@@ -29,7 +28,7 @@ def test_openapi_json(target_info):
         pytest.fail(f"Could not validate OpenAPI at {url}: {e}")
 
 
-def test_reverse_lookup(target_info):
+def test_reverse_lookup(target_info, nameres_session):
     """
     Test the /reverse_lookup endpoint.
 
@@ -43,7 +42,7 @@ def test_reverse_lookup(target_info):
     curies_should_not_work = ['ENSEMBL:xarg', 'ENSEMBL:ENSDARG00000111928']
 
     # Test POST /reverse_lookup
-    response = requests.post(reverse_lookup_url, json={
+    response = nameres_session.post(reverse_lookup_url, json={
         'curies': curies_should_not_work + curies_should_work
     })
     assert response.ok
@@ -60,7 +59,7 @@ def test_reverse_lookup(target_info):
         assert response_json[not_working_curie] == {}
 
     # Test GET /reverse_lookup
-    response = requests.get(reverse_lookup_url, params={
+    response = nameres_session.get(reverse_lookup_url, params={
         'curies': curies_should_not_work + curies_should_work
     })
     assert response.ok
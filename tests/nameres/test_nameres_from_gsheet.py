@@ -1,11 +1,18 @@
+import contextlib
+import logging
 import urllib.parse
-import requests
+
 import pytest
+import requests
+from src.babel_validation.core.evaluation import evaluate_lookup
+from src.babel_validation.core.query_plan import NameResQueryPlan
+from src.babel_validation.core.testrow import TestStatus
+from src.babel_validation.services.multi_target import diff_results, nameres_comparable
 from src.babel_validation.sources.google_sheets.google_sheet_test_cases import GoogleSheetTestCases
-from tests._pytest_helpers import deselected_by_markexpr
+from tests._pytest_helpers import (can_warm_up, category_filter, deselected_by_markexpr, report_divergences,
+                                   selected_test_rows, xdist_group)
 
-# Configuration options
-NAMERES_TIMEOUT = 10 # If we don't get a response in 10 seconds, that's a fail.
+logger = logging.getLogger(__name__)
 
 # The Google Sheet is downloaded lazily in pytest_generate_tests so that runs
 # which deselect these tests (e.g. `pytest -m unit`) never hit the network.
@@ -28,130 +35,110 @@ def pytest_generate_tests(metafunc):
     metafunc.parametrize(
         "test_row",
         _get_gsheet().test_rows(
-            'test_nameres_from_gsheet.test_label', test_nodenorm=False, test_nameres=True
+            'test_nameres_from_gsheet.test_label', test_nodenorm=False, test_nameres=True,
+            category_filter=category_filter(metafunc.config),
         ),
     )
 
 
-def test_label(target_info, test_row, test_category):
+# (NameRes URL, xdist group) pairs whose lookup cache has already been warmed up with every selected row (in that
+# group) in this session.
+_warmed_nameres_groups = set()
+
+
+@pytest.fixture
+def warmed_nameres(request, target_info, cached_nameres, persistent_cache):
+    """
+    The CachedNameRes for this target, warmed up with every lookup the selected rows need.
+
+    The first test to use this fixture for a target plans every distinct (label, biolink_type, autocomplete,
+    only_prefixes, exclude_prefixes, limit) lookup needed by the selected rows, and looks each one up once,
+    concurrently. The tests then assert against the cached responses.
+
+    An xdist worker that can't tell which rows it will run (see can_warm_up()) doesn't warm up, and its tests make
+    their own requests instead.
+    """
+    nameres_url = target_info['NameResURL']
+    # With --locality-groups, each group of rows is warmed up separately, by the worker that runs it.
+    group = xdist_group(request.node)
+    if (nameres_url, group) in _warmed_nameres_groups:
+        return cached_nameres
+    _warmed_nameres_groups.add((nameres_url, group))
+    if not can_warm_up(request.config, group, persistent_cache):
+        # This worker can't tell which rows it will run, so it would look up every row that any worker runs.
+        logger.info("Not warming up %s, as this xdist worker runs an unknown share of the rows", cached_nameres)
+        return cached_nameres
+
+    # With a shared or persistent cache, only one xdist worker warms up each target (and group) at a time: the
+    # others then find its responses in the cache. Different groups are warmed up independently.
+    warm_up_name = f"warm-up {nameres_url}" if group is None else f"warm-up {nameres_url} group {group}"
+    warm_up_lock = persistent_cache.lock(warm_up_name) if persistent_cache else contextlib.nullcontext()
+    with warm_up_lock:
+        plan = NameResQueryPlan.from_rows(selected_test_rows(request.session, 'test_label', group),
+                                          target_info['NameResLimit'])
+        logger.info("Warming up %s with %s", cached_nameres, plan)
+        results = plan.execute(cached_nameres, max_workers=int(target_info.get('HTTPPoolSize', 10)))
+        failed = [planned for planned, result in results.items() if isinstance(result, Exception)]
+        if failed:
+            # The tests for these rows will retry the failed lookups one at a time.
+            logger.warning("Could not warm up %s for %d of %d lookups", cached_nameres, len(failed), len(results))
+
+    return cached_nameres
+
+
+def test_cross_target_divergence(request, all_target_info, multi_target_nameres):
+    """
+    Look up the labels of every selected row on every selected target at once (e.g. with `--target all`), and
+    report the lookups whose results differ from those on the first target in the terminal summary. This only
+    fails with `--fail-on-divergence`.
+
+    Since this warms up the cache of every target concurrently, the per-target tests that follow are answered from
+    their caches.
+    """
+    baseline_info = next(iter(all_target_info.values()))
+    gsheet = _get_gsheet()
+    positions = gsheet.index.positions_where('category', category_filter(request.config))
+    plan = NameResQueryPlan.from_rows((gsheet.parsed_rows[position] for position in sorted(positions)),
+                                      baseline_info['NameResLimit'])
+    logger.info("Comparing %s with %s", multi_target_nameres, plan)
+
+    results_by_target = multi_target_nameres.execute_plan(plan, max_workers=int(baseline_info.get('HTTPPoolSize', 10)))
+    divergences = diff_results(results_by_target, comparable=nameres_comparable)
+    report_divergences(request, 'NameRes', divergences)
+
+
+def test_label(target_info, test_row, warmed_nameres):
     nameres_url = target_info['NameResURL']
     limit = target_info['NameResLimit']
     nameres_xfail_if_in_top = int(target_info['NameResXFailIfInTop'])
 
-    category = test_row.Category
-    if not test_category(category):
-        pytest.skip(f"Skipping category {category} because of the category filter.")
-
-    source = test_row.Source
-    source_url = test_row.SourceURL
-    source_info = f"{source} ({source_url})"
-
-    biolink_classes = test_row.BiolinkClasses
     # Make sure we test this without Biolink classes as well
-    if '' not in biolink_classes:
-        biolink_classes.update('')
-
-    expected_id = test_row.PreferredID
-    query_labels = {test_row.QueryLabel}
-    query_labels.add(test_row.PreferredLabel)
-    query_labels.update(test_row.AdditionalLabels)
+    biolink_classes = test_row.nameres_biolink_classes()
 
     # Test these labels against NameRes
     count_tested_labels = 0
-    for query_label in query_labels:
-        label = query_label.strip()
-        if not label:
-            continue
-
+    for label in test_row.nameres_query_labels():
         for biolink_class in biolink_classes:
-            biolink_class_exclude = ''
-            if biolink_class.startswith('!'):
-                biolink_class_exclude = biolink_class[1:]
-                biolink_class = ''
-
-            # Only turn on autocomplete if the autocomplete flag is on.
-            autocomplete_flag = 'false'
-            if 'autocomplete' in test_row.Flags:
-                autocomplete_flag = 'true'
-
             nameres_url_lookup = urllib.parse.urljoin(nameres_url, 'lookup')
-            request = {
-                "string": label,
-                "autocomplete": autocomplete_flag,
-                "biolink_type": [biolink_class],
-                "limit": limit,
-            }
-            if test_row.Prefixes:
-                only_prefixes = []
-                exclude_prefixes = []
-                for prefix in test_row.Prefixes:
-                    if prefix.startswith('^'):
-                        exclude_prefixes.append(prefix[1:])
-                    else:
-                        only_prefixes.append(prefix)
-                request['only_prefixes'] = "|".join(only_prefixes)
-                request['exclude_prefixes'] = "|".join(exclude_prefixes)
-
-            test_summary = f"querying {nameres_url_lookup} with label '{label}' and biolink_type {biolink_class}"
+            request = test_row.nameres_lookup_params(biolink_class, limit)
+
+            test_summary = f"querying {nameres_url_lookup} with label '{label}' and biolink_type " \
+                           f"{request['biolink_type']}"
             if not test_row.PreferredID:
                 pytest.xfail(f"Test {test_summary} cannot be tested without a preferred ID, skipping.")
 
-            response = requests.get(nameres_url_lookup, params=request, timeout=NAMERES_TIMEOUT)
+            try:
+                results = warmed_nameres.lookup(label, **request)
+            except requests.RequestException as e:
+                pytest.fail(f"Could not send request {request} to {nameres_url_lookup}: {e}")
             count_tested_labels += 1
 
-            assert response.ok, f"Could not send request {request} to GET {nameres_url_lookup}: {response}"
-            results = response.json()
-
-            # All curies
-            all_curies = list(map(lambda r: r['curie'], results))
-
-            # Check for negative results
-            if 'negative' in test_row.Flags:
-                if not results:
-                    assert not results, f"Negative test {test_summary} successful: no results found."
-                    continue
-
-                if expected_id in all_curies:
-                    expected_index = all_curies.index(expected_id)
-                    assert expected_id not in all_curies, \
-                        f"Negative test {test_summary} found expected CURIE {expected_id} in top {limit} results: {results[expected_index]}"
-                else:
-                    assert expected_id not in all_curies, f"Negative test {test_summary} did not find expected ID {expected_id} in top {limit} results."
-
-                continue
-
-            # There are three possible responses:
-            if not results:
-                # 1. We got back no results.
-                pytest.fail(f"No results for {test_summary} from {source_info}: {request}")
-            elif expected_id == '':
-                pytest.fail(f"No expected CURIE for {test_summary} from {source_info}: best result is {results[0]}")
-            elif results[0]['curie'] == expected_id:
-                top_result = results[0]
-                assert top_result['curie'] == expected_id,\
-                    f"{test_summary} returned expected ID {expected_id} as top result"
-
-                # Test the preferred label if there is one.
-                if test_row.PreferredLabel:
-                    assert top_result['label'].lower() == test_row.PreferredLabel.lower(), f"{test_summary} returned preferred " + \
-                        f"label {top_result['label']} instead of {test_row.PreferredLabel}."
-
-                # Additionally, test the biolink_class_exclude field if there is one.
-                if biolink_class_exclude:
-                    assert biolink_class_exclude not in top_result['types'],\
-                        f"Biolink types for {top_result['curie']} are {top_result['types']}, which includes {biolink_class_exclude} which should be excluded."
-
-            elif expected_id in all_curies:
-                expected_index = all_curies.index(expected_id)
-
-                fail_message = f"{test_summary} returns {results[0]['curie']} ('{results[0]['label']}') as the " \
-                    f"top result, but {expected_id} is at {expected_index} index."
-                if expected_index <= nameres_xfail_if_in_top:
-                    pytest.xfail(fail_message)
-                else:
-                    pytest.fail(fail_message)
-            else:
-                pytest.fail(f"{test_summary} but expected result {expected_id} not found: {results}")
+            test_result = evaluate_lookup(test_row, biolink_class, results, limit, nameres_xfail_if_in_top,
+                                          test_summary)
+            if test_result.status == TestStatus.Failed:
+                pytest.fail(test_result.message)
+            elif test_result.status == TestStatus.Skipped:
+                pytest.xfail(test_result.message)
 
     if count_tested_labels == 0:
         pytest.fail(f"No labels were tested for test row: {test_row}")
@@ -6,7 +6,6 @@
 #   - https://github.com/NCATSTranslator/NameResolution/issues/220
 #
 import pytest
-import requests
 import deepdiff
 
 
@@ -16,7 +15,7 @@ non_deterministic_queries = [
 ]
 
 @pytest.mark.parametrize("non_deterministic_query", non_deterministic_queries)
-def test_non_deterministic_results(target_info, non_deterministic_query, repeat_count=100):
+def test_non_deterministic_results(target_info, non_deterministic_query, unretried_nameres_session, repeat_count=100):
     """
     Tests non-deterministic query results by executing a query multiple times and comparing
     responses for consistency. The test assumes that the first response is the "correct" one
@@ -50,7 +49,7 @@ def test_non_deterministic_results(target_info, non_deterministic_query, repeat_
     diffs = []
 
     for index in range(repeat_count):
-        result = requests.post(nameres_lookup_url, params=nameres_query)
+        result = unretried_nameres_session.post(nameres_lookup_url, params=nameres_query)
         result.raise_for_status()
         response = result.json()
 
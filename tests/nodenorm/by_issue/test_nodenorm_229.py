@@ -1,10 +1,9 @@
 # This is a test for https://github.com/TranslatorSRI/NodeNormalization/issues/229
 
-import requests
 import urllib
 
 
-def test_nodenorm_229(target_info):
+def test_nodenorm_229(target_info, nodenorm_session):
     nodenorm_url = target_info["NodeNormURL"]
 
     input_json = {
@@ -499,7 +498,7 @@ def test_nodenorm_229(target_info):
     }
 
     url = urllib.parse.urljoin(nodenorm_url, "query")
-    response = requests.post(url, json=input_json)
+    response = nodenorm_session.post(url, json=input_json)
     assert response.ok, f"Could not POST test content to {url}: {response.json()}"
     actual_output = response.json()
 
@@ -5,16 +5,15 @@
 import urllib.parse
 
 import pytest
-import requests
 from openapi_spec_validator import validate_url
 from openapi_spec_validator.validation.exceptions import OpenAPIValidationError
 
 
-def test_openapi_json(target_info):
+def test_openapi_json(target_info, nodenorm_session):
     nodenorm_url = target_info['NodeNormURL']
 
     url = urllib.parse.urljoin(nodenorm_url, 'openapi.json')
-    response = requests.get(url)
+    response = nodenorm_session.get(url)
     assert response.ok, f"Could not GET {url}: {response}"
 
     openapi_json = response.json()
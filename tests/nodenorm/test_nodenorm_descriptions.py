@@ -4,7 +4,6 @@
 # of all unique descriptions for a clique.
 #
 import pytest
-import requests
 
 IDENTIFIERS_WITH_DESCRIPTIONS = [
     'MESH:D014867',
@@ -17,12 +16,12 @@ IDENTIFIERS_WITHOUT_DESCRIPTIONS = [
 ]
 
 @pytest.mark.parametrize('curie', IDENTIFIERS_WITH_DESCRIPTIONS)
-def test_descriptions(target_info, curie):
+def test_descriptions(target_info, curie, nodenorm_session):
     """ Look up a few identifiers known to have descriptions. """
     nodenorm_url = target_info['NodeNormURL']
 
     # Make sure we get descriptions if we set the description flag for this CURIE.
-    response = requests.post(nodenorm_url + 'get_normalized_nodes', json={
+    response = nodenorm_session.post(nodenorm_url + 'get_normalized_nodes', json={
         'curies': [curie],
         'description': True,
     })
@@ -39,7 +38,7 @@ def test_descriptions(target_info, curie):
     assert len(curie_result['descriptions']) > 0
 
     # Make sure we don't get this response if the description flag is false.
-    response = requests.post(nodenorm_url + 'get_normalized_nodes', json={
+    response = nodenorm_session.post(nodenorm_url + 'get_normalized_nodes', json={
         'curies': [curie],
         'description': False,
     })
@@ -54,11 +53,11 @@ def test_descriptions(target_info, curie):
 
 @pytest.mark.parametrize('curie', IDENTIFIERS_WITHOUT_DESCRIPTIONS)
 @pytest.mark.parametrize('description_flag', ['false', 'true'])
-def test_no_descriptions(target_info, curie, description_flag):
+def test_no_descriptions(target_info, curie, description_flag, nodenorm_session):
     """ Look up a few identifiers that don't have descriptions. """
     nodenorm_url = target_info['NodeNormURL']
 
-    response = requests.get(nodenorm_url + 'get_normalized_nodes', params={'curie': curie, 'description': description_flag})
+    response = nodenorm_session.get(nodenorm_url + 'get_normalized_nodes', params={'curie': curie, 'description': description_flag})
     response.raise_for_status()
     result = response.json()
 
@@ -1,8 +1,17 @@
-import urllib.parse
-import requests
+import contextlib
+import logging
+
 import pytest
+from src.babel_validation.core.evaluation import evaluate_normalization
+from src.babel_validation.core.query_plan import NodeNormQueryPlan
+from src.babel_validation.core.testrow import TestStatus
+from src.babel_validation.services.batching import PartialBatchError
+from src.babel_validation.services.multi_target import diff_results, nodenorm_comparable
 from src.babel_validation.sources.google_sheets.google_sheet_test_cases import GoogleSheetTestCases
-from tests._pytest_helpers import deselected_by_markexpr
+from tests._pytest_helpers import (can_warm_up, category_filter, deselected_by_markexpr, report_divergences,
+                                   selected_test_rows, xdist_group)
+
+logger = logging.getLogger(__name__)
 
 # The Google Sheet is downloaded lazily in pytest_generate_tests so that runs
 # which deselect these tests (e.g. `pytest -m unit`) never hit the network.
@@ -25,89 +34,92 @@ def pytest_generate_tests(metafunc):
     metafunc.parametrize(
         "test_row",
         _get_gsheet().test_rows(
-            'test_nodenorm_from_gsheet.test_row', test_nodenorm=True, test_nameres=False
+            'test_nodenorm_from_gsheet.test_row', test_nodenorm=True, test_nameres=False,
+            category_filter=category_filter(metafunc.config),
         ),
     )
 
 
-def test_normalization(target_info, test_row, test_category):
+# (NodeNorm URL, xdist group) pairs whose cache has already been warmed up with every selected row (in that
+# group) in this session.
+_warmed_nodenorm_groups = set()
+
+
+@pytest.fixture
+def warmed_nodenorm(request, target_info, cached_nodenorm, persistent_cache):
+    """
+    The CachedNodeNorm for this target, warmed up with the query IDs of every selected row.
+
+    The first test to use this fixture for a target plans every distinct (query ID, conflation params) request
+    needed by the selected rows, and normalizes them in one bulk normalize_curies() call per combination of
+    conflations. The tests then assert against the cached responses.
+
+    An xdist worker that can't tell which rows it will run (see can_warm_up()) doesn't warm up, and its tests make
+    their own requests instead.
+    """
+    nodenorm_url = target_info['NodeNormURL']
+    # With --locality-groups, each group of rows is warmed up separately, by the worker that runs it.
+    group = xdist_group(request.node)
+    if (nodenorm_url, group) in _warmed_nodenorm_groups:
+        return cached_nodenorm
+    _warmed_nodenorm_groups.add((nodenorm_url, group))
+    if not can_warm_up(request.config, group, persistent_cache):
+        # This worker can't tell which rows it will run, so it would look up every row that any worker runs.
+        logger.info("Not warming up %s, as this xdist worker runs an unknown share of the rows", cached_nodenorm)
+        return cached_nodenorm
+
+    # With a shared or persistent cache, only one xdist worker warms up each target (and group) at a time: the
+    # others then find its responses in the cache. Different groups are warmed up independently.
+    warm_up_name = f"warm-up {nodenorm_url}" if group is None else f"warm-up {nodenorm_url} group {group}"
+    warm_up_lock = persistent_cache.lock(warm_up_name) if persistent_cache else contextlib.nullcontext()
+    with warm_up_lock:
+        plan = NodeNormQueryPlan.from_rows(selected_test_rows(request.session, 'test_normalization', group))
+        logger.info("Warming up %s with %s", cached_nodenorm, plan)
+        results = plan.execute(cached_nodenorm)
+        failed = [planned for planned, result in results.items() if isinstance(result, Exception)]
+        if failed:
+            # The tests for these rows will retry the failed CURIEs one at a time.
+            logger.warning("Could not warm up %s for %d of %d CURIEs", cached_nodenorm, len(failed), len(results))
+
+    return cached_nodenorm
+
+
+def test_cross_target_divergence(request, all_target_info, multi_target_nodenorm):
+    """
+    Normalize the identifiers of every selected row on every selected target at once (e.g. with `--target all`),
+    and report the identifiers whose normalized cliques differ from those on the first target in the terminal
+    summary. This only fails with `--fail-on-divergence`.
+
+    Since this warms up the cache of every target concurrently, the per-target tests that follow are answered from
+    their caches.
+    """
+    gsheet = _get_gsheet()
+    positions = gsheet.index.positions_where('category', category_filter(request.config))
+    plan = NodeNormQueryPlan.from_rows(gsheet.parsed_rows[position] for position in sorted(positions))
+    logger.info("Comparing %s with %s", multi_target_nodenorm, plan)
+
+    divergences = diff_results(multi_target_nodenorm.execute_plan(plan), comparable=nodenorm_comparable,
+                               ignore_order=True)
+    report_divergences(request, 'NodeNorm', divergences)
+
+
+def test_normalization(target_info, test_row, warmed_nodenorm):
     nodenorm_url = target_info['NodeNormURL']
 
-    category = test_row.Category
-    if not test_category(category):
-        pytest.skip(f"Skipping category {category} because of the category filter.")
-
-    source = test_row.Source
-    source_url = test_row.SourceURL
-    source_info = f"{source} ({source_url})"
-
-    preferred_label = test_row.PreferredLabel
-
-    expected_id = test_row.PreferredID
-    query_ids = {test_row.QueryID}
-    query_ids.add(test_row.PreferredID)
-    query_ids.update(test_row.AdditionalIDs)
-
-    # Test these labels against NameRes
-    for query_id in query_ids:
-        if not query_id:
-            continue
-
-        nodenorm_url_lookup = urllib.parse.urljoin(nodenorm_url, 'get_normalized_nodes')
-        request = {
-            "curie": [query_id],
-            "conflate": 'false'
-        }
-        if test_row.Conflations:
-            leftover_conflations = set(test_row.Conflations)
-            if '' in leftover_conflations:
-                leftover_conflations.remove('')
-            if 'gene_protein' in test_row.Conflations:
-                request['conflate'] = 'true'
-                leftover_conflations.remove('gene_protein')
-            if 'drug_chemical' in test_row.Conflations:
-                request['drug_chemical_conflate'] = 'true'
-                leftover_conflations.remove('drug_chemical')
-            assert leftover_conflations == set(), f"Unknown conflations in for {test_row}: {leftover_conflations}"
-
-        test_summary = f"Queried {query_id} ({preferred_label}) on {nodenorm_url_lookup} with test_row {test_row}"
-        response = requests.get(nodenorm_url_lookup, request)
-
-        assert response.ok, f"Could not send request {request} to GET {nodenorm_url_lookup}: {response}"
-        results = response.json()
-
-        assert query_id in results, f"{test_summary} but no result returned for {query_id} in results: {results}"
-        result = results[query_id]
-
-        if not result:
-            if 'negative' in test_row.Flags:
-                assert not result, f"{test_summary} not found in NodeNorm as expected."
-            else:
-                assert result, f"{test_summary} but NodeNorm could not normalize {query_id} and returned null"
-            # Can't do later tests without results, so skip them.
-            continue
-
-        assert 'id' in result, f"{test_summary} but no 'id' in result: {result}"
-
-        # Test preferred identifier
-        assert result['id']['identifier'] == expected_id,\
-            (f"{test_summary} but normalized to {result['id']['identifier']} ({result['id']['label']}), not expected "
-             f"identifier {expected_id}.")
-
-        # Test preferred label
-        if preferred_label:
-            assert result['id']['label'].lower() == preferred_label.lower(),\
-                f"{test_summary} but preferred label is {result['id']['label']}, not expected label {preferred_label}."
-
-        # Test Biolink types
-        biolink_types = result['type']
-        for biolink_type in test_row.BiolinkClasses:
-            if not biolink_type:
-                continue
-            elif biolink_type.startswith('!'):
-                biolink_type = biolink_type[1:]
-                assert biolink_type not in set(biolink_types), (f"{test_summary} excluded biolink type {biolink_type} "
-                                                                f"found in types: {biolink_types}")
-            else:
-                assert biolink_type in set(biolink_types), (f"{test_summary} biolink type {biolink_type} not found in "
-                                                            f"types: {biolink_types}")
+    try:
+        params = test_row.nodenorm_params()
+    except ValueError as e:
+        pytest.fail(str(e))
+
+    # Test these identifiers against NodeNorm
+    for query_id in sorted(test_row.nodenorm_query_ids()):
+        test_summary = f"Queried {query_id} ({test_row.PreferredLabel}) on {nodenorm_url} with params {params} and " \
+                       f"test_row {test_row}"
+        try:
+            result = warmed_nodenorm.normalize_curie(query_id, **params)
+        except PartialBatchError as e:
+            pytest.fail(f"{test_summary} but the request failed: {e}")
+
+        test_result = evaluate_normalization(test_row, query_id, result, test_summary)
+        if test_result.status == TestStatus.Failed:
+            pytest.fail(test_result.message)
@@ -8,7 +8,6 @@
 import json
 
 import pytest
-import requests
 import deepdiff
 
 
@@ -21,7 +20,7 @@ non_deterministic_queries = [
 ]
 
 @pytest.mark.parametrize("non_deterministic_query", non_deterministic_queries)
-def test_non_deterministic_results(target_info, non_deterministic_query, repeat_count=100):
+def test_non_deterministic_results(target_info, non_deterministic_query, unretried_nodenorm_session, repeat_count=100):
     """
     Test a list of non-deterministic queries by ensuring that repeated requests
     to the normalization endpoint return consistent results. The first response
@@ -56,7 +55,7 @@ def test_non_deterministic_results(target_info, non_deterministic_query, repeat_
     diffs = []
 
     for index in range(repeat_count):
-        result = requests.post(nodenorm_normalize_url, json=nodenorm_query)
+        result = unretried_nodenorm_session.post(nodenorm_normalize_url, json=nodenorm_query)
         result.raise_for_status()
         response = result.json()
 
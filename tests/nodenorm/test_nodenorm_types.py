@@ -6,13 +6,12 @@
 #
 
 import pytest
-import requests
 
 @pytest.fixture
 def nodenorm_url(target_info):
     return target_info['NodeNormURL']
 
-def test_unconflated_biolink_types(nodenorm_url):
+def test_unconflated_biolink_types(nodenorm_url, nodenorm_session):
     """
     Check a few Biolink types without conflation turned on.
     """
@@ -81,7 +80,7 @@ def test_unconflated_biolink_types(nodenorm_url):
         ]
     }
 
-    response = requests.post(nodenorm_url + "get_normalized_nodes", json={
+    response = nodenorm_session.post(nodenorm_url + "get_normalized_nodes", json={
         "curies": list(curies_and_expected_results.keys()),
         "conflate": False,
         "drug_chemical_conflate": False,
@@ -103,7 +102,7 @@ def test_unconflated_biolink_types(nodenorm_url):
             assert equivalent_identifiers['type'] == first_biolink_type
 
 
-def test_geneprotein_conflated_biolink_types(nodenorm_url):
+def test_geneprotein_conflated_biolink_types(nodenorm_url, nodenorm_session):
     """
     Check a few Biolink types with GeneProtein conflation turned on.
     """
@@ -144,7 +143,7 @@ def test_geneprotein_conflated_biolink_types(nodenorm_url):
         ]
     }
 
-    response = requests.post(nodenorm_url + "get_normalized_nodes", json={
+    response = nodenorm_session.post(nodenorm_url + "get_normalized_nodes", json={
         "curies": list(curies_and_expected_results.keys()),
         "conflate": True,
         "drug_chemical_conflate": False,
@@ -165,7 +164,7 @@ def test_geneprotein_conflated_biolink_types(nodenorm_url):
             assert equivalent_identifiers['type'] in {'biolink:Gene', 'biolink:Protein'}
 
 
-def test_drugchemical_conflated_biolink_types(nodenorm_url):
+def test_drugchemical_conflated_biolink_types(nodenorm_url, nodenorm_session):
     """
     Check a few Biolink types with DrugChemical conflation turned on.
     """
@@ -200,7 +199,7 @@ def test_drugchemical_conflated_biolink_types(nodenorm_url):
         ]
     }
 
-    response = requests.post(nodenorm_url + "get_normalized_nodes", json={
+    response = nodenorm_session.post(nodenorm_url + "get_normalized_nodes", json={
         "curies": list(curies_and_expected_results.keys()),
         "conflate": False,
         "drug_chemical_conflate": True,
@@ -227,7 +226,7 @@ def test_drugchemical_conflated_biolink_types(nodenorm_url):
 
 
 
-def test_fully_conflated_biolink_types(nodenorm_url):
+def test_fully_conflated_biolink_types(nodenorm_url, nodenorm_session):
     """
     Check a few Biolink types with conflation fully turned on.
     """
@@ -313,7 +312,7 @@ def test_fully_conflated_biolink_types(nodenorm_url):
         ]
     }
 
-    response = requests.post(nodenorm_url + "get_normalized_nodes", json={
+    response = nodenorm_session.post(nodenorm_url + "get_normalized_nodes", json={
         "curies": list(curies_and_expected_results.keys()),
         "conflate": True,
         "drug_chemical_conflate": True,
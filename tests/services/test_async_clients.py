@@ -0,0 +1,139 @@
+#
+# Offline tests for the asyncio-native clients, using a local aiohttp server that
+# impersonates NodeNorm and NameRes.
+#
+import asyncio
+
+import pytest
+
+from src.babel_validation.services.batching import PartialBatchError
+from src.babel_validation.services.cache import ResponseCache
+from src.babel_validation.services.nodenorm import CachedNodeNorm
+from tests._fake_services import FakeSession, fake_nameres, fake_nodenorm
+
+aiohttp = pytest.importorskip("aiohttp")
+from aiohttp import web
+
+from src.babel_validation.services.nameres_async import AsyncCachedNameRes
+from src.babel_validation.services.nodenorm_async import AsyncCachedNodeNorm
+
+pytestmark = pytest.mark.unit
+
+
+async def _start_fake_server(calls: list) -> tuple[web.AppRunner, str]:
+    async def get_normalized_nodes(request):
+        body = await request.json()
+        calls.append(('get_normalized_nodes', body['curies']))
+        return web.json_response(fake_nodenorm('POST', str(request.url), json=body))
+
+    async def bulk_lookup(request):
+        body = await request.json()
+        calls.append(('bulk-lookup', body['strings']))
+        if 'bad' in body['strings']:
+            return web.json_response({'detail': 'Internal Server Error'}, status=500)
+        return web.json_response(fake_nameres('POST', str(request.url), json=body))
+
+    async def lookup(request):
+        calls.append(('lookup', request.query['string']))
+        return web.json_response(fake_nameres('POST', str(request.url), params=dict(request.query)))
+
+    app = web.Application()
+    app.router.add_post('/get_normalized_nodes', get_normalized_nodes)
+    app.router.add_post('/bulk-lookup', bulk_lookup)
+    app.router.add_post('/lookup', lookup)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://127.0.0.1:{port}/"
+
+
+def test_async_nodenorm_chunks_and_caches():
+    async def run():
+        calls = []
+        runner, url = await _start_fake_server(calls)
+        try:
+            cache = ResponseCache()
+            async with AsyncCachedNodeNorm(url, cache=cache, max_batch_size=10, max_concurrency=4) as nodenorm:
+                curies = [f'MONDO:{i:07d}' for i in range(25)] + ['FAKE:1']
+                results = await nodenorm.normalize_curies(curies, conflate='true')
+                assert set(results) == set(curies)
+                assert results['FAKE:1'] is None
+                assert len(calls) == 3
+
+                assert (await nodenorm.normalize_curie('MONDO:0000001', conflate='true'))['id']['identifier'] == \
+                    'MONDO:0000001'
+                assert len(calls) == 3
+                assert ('MONDO:0000001', frozenset({('conflate', 'true')})) in cache
+
+                await nodenorm.invalidate_curie('MONDO:0000001')
+                await nodenorm.normalize_curie('MONDO:0000001', conflate='true')
+                assert len(calls) == 4
+        finally:
+            await runner.cleanup()
+
+    asyncio.run(run())
+
+
+def test_async_nameres_isolates_failing_queries():
+    async def run():
+        calls = []
+        runner, url = await _start_fake_server(calls)
+        try:
+            async with AsyncCachedNameRes(url, max_batch_size=4) as nameres:
+                queries = [f'query {i}' for i in range(10)] + ['bad']
+                with pytest.raises(PartialBatchError) as excinfo:
+                    await nameres.bulk_lookup(queries)
+                assert excinfo.value.failed_inputs == {'bad'}
+                assert set(excinfo.value.results) == set(queries) - {'bad'}
+                assert ('bad', frozenset()) in nameres.failed_queries
+
+                assert await nameres.lookup('diabetes', autocomplete=False) == \
+                    [{'curie': 'FAKE:diabetes', 'label': 'diabetes'}]
+                await nameres.lookup('diabetes', autocomplete=False)
+                assert [call for call in calls if call[0] == 'lookup'] == [('lookup', 'diabetes')]
+        finally:
+            await runner.cleanup()
+
+    asyncio.run(run())
+
+
+def test_async_clients_wait_for_queries_claimed_by_others():
+    async def run():
+        calls = []
+        runner, url = await _start_fake_server(calls)
+        try:
+            # A synchronous client sharing the cache is fetching this CURIE.
+            cache = ResponseCache()
+            key = ('MONDO:0000001', frozenset({('conflate', 'true')}))
+            cache.claim([key])
+            async with AsyncCachedNodeNorm(url, cache=cache) as nodenorm:
+                waiting = asyncio.create_task(nodenorm.normalize_curies(['MONDO:0000001'], conflate='true'))
+                await asyncio.sleep(0.1)
+                assert not waiting.done()
+                cache.put_many({key: {'id': {'identifier': 'MONDO:0000001'}}})
+                assert await waiting == {'MONDO:0000001': {'id': {'identifier': 'MONDO:0000001'}}}
+
+            lookup_cache = ResponseCache()
+            lookup_cache.claim([('diabetes', frozenset())])
+            async with AsyncCachedNameRes(url, lookup_cache=lookup_cache) as nameres:
+                waiting = asyncio.create_task(nameres.lookup('diabetes'))
+                await asyncio.sleep(0.1)
+                lookup_cache.release([('diabetes', frozenset())], ValueError("Lookup failed"))
+                with pytest.raises(ValueError):
+                    await waiting
+            assert calls == []
+        finally:
+            await runner.cleanup()
+
+    asyncio.run(run())
+
+
+def test_async_nodenorm_shares_inferred_keys_with_sync_client():
+    sync_nodenorm = CachedNodeNorm("https://nodenorm.example.org/", session=FakeSession(fake_nodenorm),
+                                   propagate_equivalents=True)
+    nodenorm = AsyncCachedNodeNorm.from_sync(sync_nodenorm)
+    assert nodenorm.cache is sync_nodenorm.cache
+    assert nodenorm.inferred_keys is sync_nodenorm.inferred_keys
+    assert nodenorm.propagate_equivalents
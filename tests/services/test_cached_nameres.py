@@ -0,0 +1,103 @@
+#
+# Offline tests for CachedNameRes, using a fake NameRes session.
+#
+import pytest
+
+from src.babel_validation.services.batching import PartialBatchError
+from src.babel_validation.services.nameres import CachedNameRes
+from tests._fake_services import FakeResponse, FakeSession, fake_nameres
+
+pytestmark = pytest.mark.unit
+
+NAMERES_URL = "https://name-lookup.example.org/"
+
+
+def test_lookup_and_bulk_lookup_are_cached_separately():
+    session = FakeSession(fake_nameres)
+    nameres = CachedNameRes(NAMERES_URL, session=session)
+
+    assert nameres.bulk_lookup(['diabetes'], limit=10) == {'diabetes': [{'curie': 'FAKE:diabetes', 'label': 'diabetes'}]}
+    assert nameres.lookup('diabetes', limit=10) == [{'curie': 'FAKE:diabetes', 'label': 'diabetes'}]
+    assert len(session.calls) == 2
+
+    nameres.bulk_lookup(['diabetes'], limit=10)
+    nameres.lookup('diabetes', limit=10)
+    assert len(session.calls) == 2
+
+    nameres.invalidate_query('diabetes')
+    nameres.lookup('diabetes', limit=10)
+    assert len(session.calls) == 3
+
+
+def test_failing_query_is_isolated():
+    def nameres_failing_on_bad(method, url, json=None, params=None):
+        if 'bad' in json['strings']:
+            return FakeResponse(500, {'detail': 'Internal Server Error'})
+        return fake_nameres(method, url, json=json, params=params)
+
+    session = FakeSession(nameres_failing_on_bad)
+    nameres = CachedNameRes(NAMERES_URL, session=session, max_batch_size=8)
+
+    queries = [f'query {i}' for i in range(20)] + ['bad']
+    with pytest.raises(PartialBatchError) as excinfo:
+        nameres.bulk_lookup(queries)
+
+    assert excinfo.value.failed_inputs == {'bad'}
+    assert set(excinfo.value.results) == set(queries) - {'bad'}
+    assert set(nameres.failed_queries) == {('bad', frozenset())}
+    assert ('bad', frozenset()) not in nameres.cache
+
+    # Only the bad query is retried.
+    session.handler = fake_nameres
+    session.calls.clear()
+    assert set(nameres.bulk_lookup(queries)) == set(queries)
+    assert [call[2]['strings'] for call in session.calls] == [['bad']]
+    assert not nameres.failed_queries
+
+
+def test_malformed_response_fails_the_chunk():
+    def nameres_listing_bad(method, url, json=None, params=None):
+        if 'bad' in json['strings']:
+            return [{'detail': 'Unexpected error'}]
+        return fake_nameres(method, url, json=json, params=params)
+
+    nameres = CachedNameRes(NAMERES_URL, session=FakeSession(nameres_listing_bad), max_batch_size=4)
+    with pytest.raises(PartialBatchError) as excinfo:
+        nameres.bulk_lookup(['one', 'two', 'bad'])
+    assert excinfo.value.failed_inputs == {'bad'}
+    assert isinstance(excinfo.value.failures[('bad',)], ValueError)
+
+
+def test_lookup_many_deduplicates_lookups():
+    def flaky_nameres(method, url, json=None, params=None):
+        if params and params.get('string') == 'broken':
+            return FakeResponse(500, {'detail': 'Internal Server Error'})
+        return fake_nameres(method, url, json=json, params=params)
+
+    session = FakeSession(flaky_nameres)
+    nameres = CachedNameRes(NAMERES_URL, session=session)
+
+    lookups = [('diabetes', {'limit': 10}), ('asthma', {'limit': 10}), ('diabetes', {'limit': 10}),
+               ('diabetes', {'limit': 20}), ('broken', {'limit': 10})]
+    results = nameres.lookup_many(lookups, max_workers=3)
+    assert len(results) == 4
+    assert len(session.calls) == 4
+    assert results[('asthma', frozenset({('limit', 10)}))] == [{'curie': 'FAKE:asthma', 'label': 'asthma'}]
+    assert isinstance(results[('broken', frozenset({('limit', 10)}))], Exception)
+
+    assert nameres.lookup('diabetes', limit=20) == [{'curie': 'FAKE:diabetes', 'label': 'diabetes'}]
+    assert len(session.calls) == 4
+
+
+def test_lookup_timeout():
+    timeouts = []
+
+    class TimedSession(FakeSession):
+        def request(self, method, url, json=None, params=None, **kwargs):
+            timeouts.append(kwargs['timeout'])
+            return super().request(method, url, json=json, params=params)
+
+    nameres = CachedNameRes(NAMERES_URL, session=TimedSession(fake_nameres), lookup_timeout_seconds=10)
+    nameres.lookup('diabetes')
+    nameres.bulk_lookup(['asthma'])
+    assert timeouts == [10, 30]
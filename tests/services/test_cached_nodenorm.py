@@ -0,0 +1,186 @@
+#
+# Offline tests for CachedNodeNorm, using a fake NodeNorm session.
+#
+import threading
+import time
+
+import pytest
+
+from src.babel_validation.services.batching import PartialBatchError
+from src.babel_validation.services.nodenorm import CachedNodeNorm
+from tests._fake_services import FakeResponse, FakeSession, fake_nodenorm
+
+pytestmark = pytest.mark.unit
+
+NODENORM_URL = "https://nodenorm.example.org/"
+
+
+def test_normalize_curies_uses_cache():
+    session = FakeSession(fake_nodenorm)
+    nodenorm = CachedNodeNorm(NODENORM_URL, session=session)
+
+    results = nodenorm.normalize_curies(['MONDO:0005015', 'FAKE:1'], conflate='true')
+    assert results['MONDO:0005015']['id']['identifier'] == 'MONDO:0005015'
+    assert results['FAKE:1'] is None
+    assert len(session.calls) == 1
+
+    assert nodenorm.normalize_curie('FAKE:1', conflate='true') is None
+    assert nodenorm.normalize_curie('MONDO:0005015', conflate='true')['id']['identifier'] == 'MONDO:0005015'
+    assert len(session.calls) == 1
+
+    # Different params are a different cache entry.
+    nodenorm.normalize_curie('MONDO:0005015')
+    assert len(session.calls) == 2
+
+
+def test_normalize_curies_in_chunks():
+    session = FakeSession(fake_nodenorm)
+    nodenorm = CachedNodeNorm(NODENORM_URL, session=session, max_batch_size=10, max_workers=3)
+
+    curies = [f'MONDO:{i:07d}' for i in range(95)]
+    results = nodenorm.normalize_curies(curies)
+    assert set(results) == set(curies)
+    assert len(session.calls) == 10
+    assert max(len(call[2]['curies']) for call in session.calls) == 10
+
+
+def test_failed_chunk_keeps_successful_chunks():
+    def flaky_nodenorm(method, url, json=None, params=None):
+        if 'MONDO:0000013' in json['curies']:
+            return FakeResponse(502, {'detail': 'Bad Gateway'})
+        return fake_nodenorm(method, url, json=json, params=params)
+
+    session = FakeSession(flaky_nodenorm)
+    nodenorm = CachedNodeNorm(NODENORM_URL, session=session, max_batch_size=10)
+
+    curies = [f'MONDO:{i:07d}' for i in range(30)]
+    with pytest.raises(PartialBatchError) as excinfo:
+        nodenorm.normalize_curies(curies)
+
+    assert excinfo.value.failed_inputs == set(curies[10:20])
+    assert set(excinfo.value.results) == set(curies[:10] + curies[20:])
+
+    # The successful chunks were cached, so retrying only refetches the failed chunk.
+    session.handler = fake_nodenorm
+    session.calls.clear()
+    assert set(nodenorm.normalize_curies(curies)) == set(curies)
+    assert [call[2]['curies'] for call in session.calls] == [curies[10:20]]
+
+
+def test_concurrent_misses_share_one_request():
+    started = threading.Event()
+    finish = threading.Event()
+
+    def slow_nodenorm(method, url, json=None, params=None):
+        started.set()
+        finish.wait(timeout=10)
+        return fake_nodenorm(method, url, json=json, params=params)
+
+    session = FakeSession(slow_nodenorm)
+    nodenorm = CachedNodeNorm(NODENORM_URL, session=session)
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(nodenorm.normalize_curie('MONDO:0005015')))
+               for _ in range(4)]
+    threads[0].start()
+    assert started.wait(timeout=10)
+    for thread in threads[1:]:
+        thread.start()
+    time.sleep(0.1)
+    finish.set()
+    for thread in threads:
+        thread.join(timeout=10)
+
+    assert len(session.calls) == 1
+    assert len(results) == 4
+    assert all(result['id']['identifier'] == 'MONDO:0005015' for result in results)
+
+
+def test_unexpected_error_releases_claims():
+    started = threading.Event()
+    finish = threading.Event()
+
+    def broken_nodenorm(method, url, json=None, params=None):
+        started.set()
+        finish.wait(timeout=10)
+        raise RuntimeError("unexpected")
+
+    nodenorm = CachedNodeNorm(NODENORM_URL, session=FakeSession(broken_nodenorm))
+    errors = []
+
+    def normalize():
+        try:
+            nodenorm.normalize_curie('MONDO:0005015')
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=normalize, daemon=True) for _ in range(2)]
+    threads[0].start()
+    assert started.wait(timeout=10)
+    threads[1].start()
+    time.sleep(0.1)
+    finish.set()
+    for thread in threads:
+        thread.join(timeout=10)
+
+    # The thread that was waiting on the failed request gets an error instead of waiting forever.
+    assert not any(thread.is_alive() for thread in threads)
+    assert len(errors) == 2
+
+
+def test_malformed_response_fails_the_chunk():
+    nodenorm = CachedNodeNorm(NODENORM_URL, session=FakeSession(lambda method, url, json=None, params=None: []))
+    with pytest.raises(PartialBatchError):
+        nodenorm.normalize_curies(['MONDO:0005015'])
+
+
+def test_clique_is_stored_once():
+    clique = ['MONDO:0005015', 'DOID:9351', 'UMLS:C0011849']
+
+    nodenorm = CachedNodeNorm(NODENORM_URL, session=FakeSession(_clique_nodenorm(clique)), max_batch_size=1)
+    results = nodenorm.normalize_curies(clique)
+
+    cached = [nodenorm.normalize_curie(curie) for curie in clique]
+    assert all(result is cached[0] for result in cached)
+    assert cached[0] == results['DOID:9351']
+    assert len(nodenorm.cache.shared.values) == 1
+
+    nodenorm.invalidate_curies(clique)
+    assert not nodenorm.cache.shared.values
+
+
+def _clique_nodenorm(clique: list[str]):
+    def handler(method, url, json=None, params=None):
+        return {curie: {
+            'id': {'identifier': clique[0], 'label': 'diabetes mellitus'},
+            'equivalent_identifiers': [{'identifier': c} for c in clique],
+            'type': ['biolink:Disease', 'biolink:NamedThing'],
+        } if curie in clique else None for curie in json['curies']}
+    return handler
+
+
+def test_propagate_equivalents():
+    clique = ['MONDO:0005015', 'DOID:9351', 'UMLS:C0011849']
+    session = FakeSession(_clique_nodenorm(clique))
+    nodenorm = CachedNodeNorm(NODENORM_URL, session=session, propagate_equivalents=True)
+
+    assert nodenorm.normalize_curie('DOID:9351', conflate='false')['id']['identifier'] == 'MONDO:0005015'
+    assert nodenorm.normalize_curie('UMLS:C0011849', conflate='false')['id']['identifier'] == 'MONDO:0005015'
+    assert len(session.calls) == 1
+    assert nodenorm.is_inferred('UMLS:C0011849', conflate='false')
+    assert not nodenorm.is_inferred('DOID:9351', conflate='false')
+
+    # Inferred entries are only shared by the same params.
+    nodenorm.normalize_curie('UMLS:C0011849')
+    assert len(session.calls) == 2
+
+
+def test_propagation_is_off_by_default():
+    clique = ['MONDO:0005015', 'DOID:9351']
+    session = FakeSession(_clique_nodenorm(clique))
+    nodenorm = CachedNodeNorm(NODENORM_URL, session=session)
+
+    nodenorm.normalize_curie('DOID:9351')
+    nodenorm.normalize_curie('MONDO:0005015')
+    assert len(session.calls) == 2
+    assert not nodenorm.inferred_keys
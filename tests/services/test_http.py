@@ -0,0 +1,216 @@
+#
+# Offline tests for the pooled HTTP session layer.
+#
+import configparser
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+from src.babel_validation.services.health import CircuitOpenError, HealthSettings, TargetHealth
+from src.babel_validation.services.http import (RequestStats, SessionSettings, close_sessions, create_session,
+                                                get_session)
+from src.babel_validation.services.nodenorm import CachedNodeNorm, cached_node_norms_by_url
+from src.babel_validation.services.rate_limit import RateLimitSettings
+
+pytestmark = pytest.mark.unit
+
+
+def test_settings_from_targets_ini():
+    cp = configparser.ConfigParser()
+    cp.read_string("[DEFAULT]\nHTTPPoolSize = 4\n\n[prod]\nHTTPMaxRetries = 1\n\n[dev]\n")
+
+    assert SessionSettings.from_target_info(cp['prod']) == SessionSettings(pool_size=4, max_retries=1)
+    assert SessionSettings.from_target_info(cp['dev']) == SessionSettings(pool_size=4)
+
+    cp.read_string("[exp]\nHTTPTimeout = 5\nCircuitFailureThreshold = 2\n")
+    assert SessionSettings.from_target_info(cp['exp']) == \
+        SessionSettings(pool_size=4, timeout_seconds=5, health=HealthSettings(failure_threshold=2))
+
+    cp.read_string("[localhost]\nRateLimitPerSecond = 2.5\nMaxConcurrentRequests = 4\n")
+    assert SessionSettings.from_target_info(cp['localhost']).rate_limit == \
+        RateLimitSettings(requests_per_second=2.5, max_concurrent=4)
+
+    cp.read_string("[ci]\nHTTPRetryStatuses = 429, 503\nHTTPHedgePercentile = 95\n")
+    settings = SessionSettings.from_target_info(cp['ci'])
+    assert settings.retry_statuses == (429, 503) and settings.hedge_percentile == 95
+
+
+def test_sessions_are_shared_per_url():
+    try:
+        session = get_session("https://nodenorm.example.org/", SessionSettings(pool_size=2, max_retries=5))
+        assert get_session("https://nodenorm.example.org/") is session
+        assert get_session("https://name-lookup.example.org/") is not session
+
+        adapter = session.get_adapter("https://nodenorm.example.org/get_normalized_nodes")
+        assert adapter.max_retries.total == 5
+        assert 'POST' in adapter.max_retries.allowed_methods
+    finally:
+        close_sessions()
+
+
+def test_conflicting_session_settings_are_reported(caplog):
+    try:
+        session = CachedNodeNorm.from_url("https://nodenorm.example.org/",
+                                          session_settings=SessionSettings(max_retries=5)).session
+        assert session is get_session("https://nodenorm.example.org/", SessionSettings(max_retries=5))
+        assert not caplog.records
+
+        assert get_session("https://nodenorm.example.org/", SessionSettings(max_retries=1)) is session
+        assert "Ignoring the settings" in caplog.text
+        assert session.get_adapter("https://nodenorm.example.org/").max_retries.total == 5
+    finally:
+        cached_node_norms_by_url.clear()
+        close_sessions()
+
+
+def test_circuit_opens_and_probes():
+    health = TargetHealth("https://nodenorm.example.org/", HealthSettings(failure_threshold=2,
+                                                                          probe_interval_seconds=3600))
+    health.record_failure("timeout")
+    health.before_request()
+    health.record_failure("timeout")
+    assert health.is_open and health.is_rejecting
+    with pytest.raises(CircuitOpenError, match="2 consecutive requests failed"):
+        health.before_request()
+
+    # Once the probe interval has passed, a single probe is let through; a failed probe reopens the circuit.
+    health.settings = HealthSettings(failure_threshold=2, probe_interval_seconds=0)
+    health.before_request()
+    with pytest.raises(CircuitOpenError):
+        health.before_request()
+    health.record_failure("timeout")
+    assert health.is_open
+
+    # A successful probe closes it.
+    health.before_request()
+    health.record_success()
+    assert not health.is_open
+    health.before_request()
+
+
+def test_failed_probe_reopens_the_circuit(scripted_server):
+    base_url, script = scripted_server
+    health = TargetHealth(base_url, HealthSettings(failure_threshold=1, probe_interval_seconds=0))
+    session = create_session(SessionSettings(max_retries=0), health)
+
+    # A response that breaks off part-way is a failure, whether or not the request is a probe.
+    script.extend([(None, 0), (None, 0)])
+    for _ in range(2):
+        with pytest.raises(requests.exceptions.ChunkedEncodingError):
+            session.get(base_url + "status")
+        assert health.is_open and not health.probing
+
+    # An error that doesn't come from the target doesn't count either way, but lets the next probe through.
+    def broken_hook(response, *args, **kwargs):
+        raise RuntimeError("broken hook")
+
+    with pytest.raises(RuntimeError):
+        session.get(base_url + "status", hooks={'response': broken_hook})
+    assert health.is_open and not health.probing
+
+    assert session.get(base_url + "status").ok
+    assert not health.is_open
+    session.close()
+
+
+def test_session_reports_connection_failures():
+    health = TargetHealth("http://127.0.0.1:1/", HealthSettings(failure_threshold=2))
+    session = create_session(SessionSettings(max_retries=0, timeout_seconds=5), health)
+    for _ in range(2):
+        with pytest.raises(requests.ConnectionError):
+            session.get("http://127.0.0.1:1/status")
+    assert health.is_open
+
+    # The circuit is open, so the next request fails without being sent.
+    with pytest.raises(CircuitOpenError):
+        session.get("http://127.0.0.1:1/status")
+    session.close()
+
+
+@pytest.fixture
+def scripted_server():
+    """A local HTTP server that answers the Nth request with the Nth (status, delay) in its script (and then 200).
+
+    A status of None sends a 200 response whose body breaks off part-way.
+    """
+    script = []
+    lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            with lock:
+                status, delay = script.pop(0) if script else (200, 0)
+            time.sleep(delay)
+            self.send_response(status or 200)
+            self.send_header('Content-Length', '0' if status else '100')
+            self.end_headers()
+            if status is None:
+                self.wfile.write(b'{"partial":')
+                self.close_connection = True
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f"http://127.0.0.1:{server.server_port}/", script
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_percentile():
+    stats = RequestStats()
+    for latency in range(1, 101):
+        stats.record_request(latency / 100)
+    assert stats.percentile(95) == 0.96
+    assert stats.percentile(95, min_samples=101) is None
+
+
+def test_retries_are_counted(scripted_server):
+    base_url, script = scripted_server
+    script.extend([(503, 0), (503, 0)])
+    session = create_session(SessionSettings(backoff_factor=0.01, backoff_jitter=0.01))
+
+    assert session.get(base_url + "status").status_code == 200
+    assert (session.stats.requests, session.stats.retries) == (1, 2)
+    session.close()
+
+
+def test_slow_request_is_hedged(scripted_server):
+    base_url, script = scripted_server
+    session = create_session(SessionSettings(hedge_percentile=95, hedge_min_samples=5))
+    for _ in range(5):
+        session.get(base_url + "status")
+    assert session.stats.hedged == 0
+
+    # The next request is stuck for 2s, so the hedge sent after the observed p95 answers first.
+    script.append((200, 2))
+    time_started = time.monotonic()
+    assert session.get(base_url + "status").status_code == 200
+    assert time.monotonic() - time_started < 1
+    assert (session.stats.hedged, session.stats.hedges_won) == (1, 1)
+    session.close()
+
+
+def test_queued_requests_are_not_hedged(scripted_server):
+    base_url, script = scripted_server
+    session = create_session(SessionSettings(pool_size=2, hedge_percentile=95, hedge_min_samples=5))
+    script.extend([(200, 0.1)] * 5)
+    for _ in range(5):
+        session.get(base_url + "status")
+
+    # Twelve requests from six threads queue for the two workers, but only time spent sending counts towards the
+    # hedge delay, and no worker is free to send a hedge while the others are busy.
+    script.extend([(200, 0.1)] * 12)
+    with ThreadPoolExecutor(max_workers=6) as executor:
+        list(executor.map(lambda _: session.get(base_url + "status"), range(12)))
+    assert session.stats.requests == 17
+    assert session.stats.hedged == 0
+    session.close()
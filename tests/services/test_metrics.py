@@ -0,0 +1,72 @@
+#
+# Offline tests for the cache and request metrics of the cached clients.
+#
+import json
+
+import pytest
+
+from src.babel_validation.services.metrics import Histogram, format_report, merge_reports, metrics_report
+from src.babel_validation.services.nameres import CachedNameRes
+from src.babel_validation.services.nodenorm import CachedNodeNorm
+from tests._fake_services import FakeResponse, FakeSession, fake_nameres
+
+pytestmark = pytest.mark.unit
+
+
+def _clique_nodenorm(method, url, json=None, params=None):
+    clique = ['MONDO:0005015', 'DOID:9351']
+    return {curie: {
+        'id': {'identifier': clique[0], 'label': 'diabetes mellitus'},
+        'equivalent_identifiers': [{'identifier': c} for c in clique],
+        'type': ['biolink:Disease'],
+    } if curie in clique else None for curie in json['curies']}
+
+
+def test_histogram_percentiles_and_merge():
+    histogram = Histogram((1, 10, 100))
+    for value in [1] * 90 + [50] * 9 + [500]:
+        histogram.record(value)
+    assert (histogram.percentile(50), histogram.percentile(95), histogram.percentile(100)) == (1, 100, 500)
+
+    merged = Histogram((1, 10, 100))
+    merged.merge(histogram.as_dict())
+    merged.merge(histogram.as_dict())
+    assert (merged.count, merged.total, merged.max) == (200, 2 * histogram.total, 500)
+    with pytest.raises(ValueError):
+        Histogram((1, 2)).merge(histogram.as_dict())
+
+
+def test_nodenorm_metrics():
+    nodenorm = CachedNodeNorm("https://nodenorm.example.org/", session=FakeSession(_clique_nodenorm),
+                              max_batch_size=2, propagate_equivalents=True)
+    nodenorm.normalize_curies(['MONDO:0005015', 'FAKE:1', 'FAKE:2'])
+    nodenorm.normalize_curie('DOID:9351')
+    nodenorm.normalize_curies(['MONDO:0005015', 'FAKE:3'])
+
+    metrics = nodenorm.metrics.as_dict()['get_normalized_nodes']
+    assert (metrics['hits'], metrics['inferred_hits'], metrics['misses']) == (2, 1, 4)
+    assert (metrics['requests'], metrics['failed_requests']) == (3, 0)
+    assert metrics['batch_size']['counts'][:2] == [2, 1]
+    assert metrics['bytes_sent'] > 0 and metrics['bytes_received'] > 0
+
+
+def test_nameres_metrics_and_report():
+    def flaky_nameres(method, url, json=None, params=None):
+        if params and params['string'] == 'broken':
+            return FakeResponse(500, {'detail': 'error'})
+        return fake_nameres(method, url, json=json, params=params)
+
+    nameres = CachedNameRes("https://name-lookup.example.org/", session=FakeSession(flaky_nameres))
+    nameres.lookup_many([('one', {}), ('broken', {})])
+    nameres.lookup('one')
+    nameres.bulk_lookup(['two'])
+
+    report = metrics_report([nameres])
+    lookup = report['clients'][str(nameres)]['lookup']
+    assert (lookup['hits'], lookup['misses'], lookup['requests'], lookup['failed_requests']) == (1, 2, 2, 1)
+
+    # Reports survive a round trip through JSON, and add up.
+    merged = merge_reports([json.loads(json.dumps(report))] * 2)
+    assert merged['clients'][str(nameres)]['bulk-lookup']['requests'] == 2
+    assert format_report(merged)[0].startswith(
+        "CachedNameRes(https://name-lookup.example.org/) lookup: 2 hits, 4 misses, 4 requests (2 failed), ")
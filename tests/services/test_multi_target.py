@@ -0,0 +1,104 @@
+#
+# Offline tests for sending the same requests to several targets and diffing their responses.
+#
+import pytest
+
+from src.babel_validation.core.query_plan import NodeNormQueryPlan
+from src.babel_validation.core.testrow import TestRow
+from src.babel_validation.services.multi_target import (MultiTargetNameRes, MultiTargetNodeNorm, diff_results,
+                                                        format_divergence_report, nameres_comparable,
+                                                        nodenorm_comparable, summarize_divergences)
+from src.babel_validation.services.nameres import CachedNameRes
+from src.babel_validation.services.nodenorm import CachedNodeNorm
+from tests._fake_services import FakeResponse, FakeSession, fake_nameres, fake_nodenorm
+
+pytestmark = pytest.mark.unit
+
+
+def _relabelled_nodenorm(method, url, json=None, params=None):
+    """Like fake_nodenorm, but with a different label for MONDO:0005015."""
+    result = fake_nodenorm(method, url, json=json, params=params)
+    if 'MONDO:0005015' in result:
+        result['MONDO:0005015']['id']['label'] = 'diabetes mellitus'
+    return result
+
+
+def _unavailable(method, url, json=None, params=None):
+    return FakeResponse(503, {'detail': 'unavailable'})
+
+
+def test_nodenorm_divergence_report():
+    sessions = {'dev': FakeSession(fake_nodenorm), 'prod': FakeSession(_relabelled_nodenorm)}
+    multi = MultiTargetNodeNorm({target: CachedNodeNorm(f'https://{target}.example.org/', session=session)
+                                 for target, session in sessions.items()})
+
+    results = multi.normalize_curies(['MONDO:0005015', 'CHEBI:15365', 'FAKE:1'], conflate='true')
+    assert set(results) == {'dev', 'prod'}
+    assert all(len(session.calls) == 1 for session in sessions.values())
+
+    divergences = diff_results(results, comparable=nodenorm_comparable, ignore_order=True)
+    assert [(d.key, d.baseline, d.target) for d in divergences] == [('MONDO:0005015', 'dev', 'prod')]
+    assert format_divergence_report(divergences) == \
+        "MONDO:0005015: prod differs from dev: Value of root['label'] changed from \"MONDO:0005015\" to " \
+        "\"diabetes mellitus\"."
+
+
+def test_failed_target_is_reported():
+    multi = MultiTargetNodeNorm({
+        'dev': CachedNodeNorm('https://dev.example.org/', session=FakeSession(fake_nodenorm)),
+        'down': CachedNodeNorm('https://down.example.org/', session=FakeSession(_unavailable)),
+    })
+    results = multi.normalize_curies(['MONDO:0005015'])
+    assert isinstance(results['down']['MONDO:0005015'], Exception)
+
+    divergences = diff_results(results, comparable=nodenorm_comparable)
+    assert len(divergences) == 1
+    assert divergences[0].description.startswith('request to down failed')
+
+
+def test_execute_plan_warms_every_target():
+    sessions = {'dev': FakeSession(fake_nodenorm), 'prod': FakeSession(fake_nodenorm)}
+    clients = {target: CachedNodeNorm(f'https://{target}.example.org/', session=session)
+               for target, session in sessions.items()}
+    row = TestRow.from_data_row({'Query ID': 'DOID:9351', 'Preferred ID': 'MONDO:0005015'})
+
+    results = MultiTargetNodeNorm(clients).execute_plan(NodeNormQueryPlan.from_rows([row]))
+    assert diff_results(results, comparable=nodenorm_comparable) == []
+
+    # Both targets now answer the row's identifiers from their caches.
+    for target, client in clients.items():
+        client.normalize_curie('DOID:9351', conflate='false')
+        assert len(sessions[target].calls) == 1
+
+
+def test_nameres_divergence_keeps_order():
+    def reversed_nameres(method, url, json=None, params=None):
+        return [{'curie': 'FAKE:2', 'label': 'two'}, {'curie': 'FAKE:1', 'label': 'one'}]
+
+    def ordered_nameres(method, url, json=None, params=None):
+        return list(reversed(reversed_nameres(method, url, json=json, params=params)))
+
+    multi = MultiTargetNameRes({
+        'dev': CachedNameRes('https://dev.example.org/', session=FakeSession(ordered_nameres)),
+        'prod': CachedNameRes('https://prod.example.org/', session=FakeSession(reversed_nameres)),
+        'test': CachedNameRes('https://test.example.org/', session=FakeSession(fake_nameres)),
+    })
+    results = multi.lookup_many([('one', {'limit': 2})])
+
+    divergences = diff_results(results, comparable=nameres_comparable)
+    assert {d.target for d in divergences} == {'prod', 'test'}
+    assert format_divergence_report(divergences).startswith("'one' {'limit': 2}: ")
+
+
+def test_divergence_summary_counts_failed_requests():
+    multi = MultiTargetNodeNorm({
+        'dev': CachedNodeNorm('https://dev.example.org/', session=FakeSession(fake_nodenorm)),
+        'prod': CachedNodeNorm('https://prod.example.org/', session=FakeSession(_relabelled_nodenorm)),
+        'down': CachedNodeNorm('https://down.example.org/', session=FakeSession(_unavailable)),
+    })
+    divergences = diff_results(multi.normalize_curies(['MONDO:0005015', 'CHEBI:15365']),
+                               comparable=nodenorm_comparable)
+    assert summarize_divergences(divergences) == [
+        'down differs from dev for 2 responses (2 of them because a request failed)',
+        'prod differs from dev for 1 response',
+    ]
@@ -0,0 +1,95 @@
+#
+# Offline tests for the persistent response cache used by CachedNodeNorm and CachedNameRes.
+#
+import pytest
+
+from src.babel_validation.services.cache import ResponseCache
+from src.babel_validation.services.nodenorm import CachedNodeNorm
+from src.babel_validation.services.persistent_cache import MISSING, PersistentCache, status_version
+from tests._fake_services import FakeSession, fake_nodenorm
+
+pytestmark = pytest.mark.unit
+
+TARGET = "https://nodenorm.example.org/"
+PARAMS_KEY = frozenset({'conflate': 'true'}.items())
+
+
+def test_responses_survive_a_new_cache(tmp_path):
+    store = PersistentCache(tmp_path / "cache.sqlite3")
+    store.check_version(TARGET, "v1")
+    cache = ResponseCache(store.namespace(TARGET, "get_normalized_nodes"))
+    cache.put_many({("MONDO:0005015", PARAMS_KEY): {'id': {'identifier': 'MONDO:0005015'}}, ("FAKE:1", PARAMS_KEY): None})
+    store.close()
+
+    reopened = PersistentCache(tmp_path / "cache.sqlite3")
+    assert reopened.check_version(TARGET, "v1")
+    cache = ResponseCache(reopened.namespace(TARGET, "get_normalized_nodes"))
+    assert cache[("MONDO:0005015", PARAMS_KEY)] == {'id': {'identifier': 'MONDO:0005015'}}
+    assert ("FAKE:1", PARAMS_KEY) in cache
+    assert cache[("FAKE:1", PARAMS_KEY)] is None
+    assert ("MONDO:0005015", frozenset()) not in cache
+
+    # Other endpoints on the same target don't see these responses.
+    assert ("MONDO:0005015", PARAMS_KEY) not in ResponseCache(reopened.namespace(TARGET, "lookup"))
+
+
+def test_new_version_discards_responses(tmp_path):
+    store = PersistentCache(tmp_path / "cache.sqlite3")
+    store.check_version(TARGET, "v1")
+    store.namespace(TARGET, "get_normalized_nodes").put_many({("MONDO:0005015", PARAMS_KEY): {}})
+
+    assert not store.check_version(TARGET, "v2")
+    assert ("MONDO:0005015", PARAMS_KEY) not in ResponseCache(store.namespace(TARGET, "get_normalized_nodes"))
+
+
+def test_ttl_expires_responses(tmp_path):
+    store = PersistentCache(tmp_path / "cache.sqlite3", ttl_seconds=0)
+    store.check_version(TARGET, "v1")
+    store.namespace(TARGET, "get_normalized_nodes").put_many({("MONDO:0005015", PARAMS_KEY): {}})
+
+    assert ("MONDO:0005015", PARAMS_KEY) not in ResponseCache(store.namespace(TARGET, "get_normalized_nodes"))
+
+
+def test_expired_response_keeps_fresh_param_variants(tmp_path, monkeypatch):
+    store = PersistentCache(tmp_path / "cache.sqlite3", ttl_seconds=60)
+    monkeypatch.setattr("src.babel_validation.services.persistent_cache.time.time", lambda: 1000.0)
+    store.put_many(TARGET, "get_normalized_nodes", {("MONDO:0005015", "old"): {}})
+    monkeypatch.setattr("src.babel_validation.services.persistent_cache.time.time", lambda: 1050.0)
+    store.put_many(TARGET, "get_normalized_nodes", {("MONDO:0005015", "new"): {'id': {}}})
+
+    monkeypatch.setattr("src.babel_validation.services.persistent_cache.time.time", lambda: 1070.0)
+    assert store.get(TARGET, "get_normalized_nodes", "MONDO:0005015", "old") is MISSING
+    assert store.get(TARGET, "get_normalized_nodes", "MONDO:0005015", "new") == {'id': {}}
+
+
+def test_invalidate_removes_every_param_variant(tmp_path):
+    store = PersistentCache(tmp_path / "cache.sqlite3")
+    store.check_version(TARGET, "v1")
+    cache = ResponseCache(store.namespace(TARGET, "get_normalized_nodes"))
+    cache.put_many({("MONDO:0005015", PARAMS_KEY): {}, ("MONDO:0005015", frozenset()): {}})
+
+    cache.invalidate("MONDO:0005015")
+    fresh = ResponseCache(store.namespace(TARGET, "get_normalized_nodes"))
+    assert ("MONDO:0005015", PARAMS_KEY) not in fresh
+    assert ("MONDO:0005015", frozenset()) not in fresh
+
+
+def test_status_version_ignores_volatile_fields():
+    assert status_version({'status': 'ok', 'numDocs': 10}) is None
+    assert status_version({'babel_version': '2025sep1', 'numDocs': 10}) == \
+        status_version({'babel_version': '2025sep1', 'numDocs': 20})
+
+
+def test_clients_in_different_workers_share_responses(tmp_path):
+    # Each xdist worker opens its own connection to the run's shared cache, and has its own CachedNodeNorm.
+    path = tmp_path / 'shared.sqlite3'
+    first_session, second_session = FakeSession(fake_nodenorm), FakeSession(fake_nodenorm)
+    first = CachedNodeNorm(TARGET, PersistentCache(path, ttl_seconds=None), session=first_session)
+    second = CachedNodeNorm(TARGET, PersistentCache(path, ttl_seconds=None), session=second_session)
+
+    with first.cache.backing.store.lock(f"warm-up {TARGET}"):
+        first.normalize_curies(['MONDO:0005015', 'FAKE:1'])
+    assert second.normalize_curie('MONDO:0005015')['id']['identifier'] == 'MONDO:0005015'
+    assert second.normalize_curie('FAKE:1') is None
+    # The second worker only asked for the status of the target.
+    assert [call[1] for call in second_session.calls] == [TARGET + 'status']
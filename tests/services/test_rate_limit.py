@@ -0,0 +1,73 @@
+#
+# Offline tests for the file-backed request-rate and concurrency limits.
+#
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from src.babel_validation.services.rate_limit import RateGovernor, RateLimitSettings
+
+pytestmark = pytest.mark.unit
+
+BASE_URL = "https://nodenorm.example.org/"
+
+
+def test_token_bucket_limits_rate(tmp_path):
+    governor = RateGovernor(BASE_URL, RateLimitSettings(requests_per_second=20, burst=2), state_dir=str(tmp_path))
+
+    time_started = time.monotonic()
+    for _ in range(6):
+        with governor.request():
+            pass
+    # The first two requests use up the burst, and the other four wait 1/20s each.
+    assert time.monotonic() - time_started >= 0.19
+
+
+def test_bucket_is_shared_through_the_state_dir(tmp_path):
+    settings = RateLimitSettings(requests_per_second=10, burst=1)
+    first = RateGovernor(BASE_URL, settings, state_dir=str(tmp_path))
+    second = RateGovernor(BASE_URL, settings, state_dir=str(tmp_path))
+
+    time_started = time.monotonic()
+    with first.request():
+        pass
+    with second.request():
+        pass
+    assert time.monotonic() - time_started >= 0.09
+
+
+def test_concurrency_cap(tmp_path):
+    governor = RateGovernor(BASE_URL, RateLimitSettings(max_concurrent=2), state_dir=str(tmp_path),
+                            poll_interval_seconds=0.01)
+    in_flight = 0
+    max_in_flight = 0
+    lock = threading.Lock()
+
+    def send(_):
+        nonlocal in_flight, max_in_flight
+        with governor.request():
+            with lock:
+                in_flight += 1
+                max_in_flight = max(max_in_flight, in_flight)
+            time.sleep(0.05)
+            with lock:
+                in_flight -= 1
+
+    with ThreadPoolExecutor(max_workers=6) as executor:
+        list(executor.map(send, range(6)))
+    assert max_in_flight == 2
+
+
+def test_non_blocking_request_is_refused(tmp_path):
+    governor = RateGovernor(BASE_URL, RateLimitSettings(requests_per_second=1, burst=1, max_concurrent=1),
+                            state_dir=str(tmp_path))
+    with governor.request() as allowed:
+        assert allowed
+        with governor.request(blocking=False) as allowed_while_busy:
+            assert not allowed_while_busy
+
+    # The slot is free again, but the only token has been used.
+    with governor.request(blocking=False) as allowed:
+        assert not allowed
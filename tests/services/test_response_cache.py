@@ -0,0 +1,96 @@
+#
+# Offline tests for the in-memory ResponseCache: eviction policies and invalidation.
+#
+import pytest
+
+from src.babel_validation.services.cache import CacheBudget, EvictionPolicy, ResponseCache, approximate_size
+from src.babel_validation.services.persistent_cache import PersistentCache
+
+pytestmark = pytest.mark.unit
+
+NO_PARAMS = frozenset()
+
+
+def _result(curie: str, padding: int = 0) -> dict:
+    return {'id': {'identifier': curie, 'label': 'x' * padding}}
+
+
+def test_unbounded_by_default():
+    cache = ResponseCache()
+    cache.put_many({(f'MONDO:{i}', NO_PARAMS): _result(f'MONDO:{i}') for i in range(1000)})
+    assert len(cache) == 1000
+    assert cache.evictions == 0
+
+
+def test_lru_by_entry_count():
+    cache = ResponseCache(policy=EvictionPolicy(positive=CacheBudget(max_entries=2)))
+    cache[('A:1', NO_PARAMS)] = _result('A:1')
+    cache[('A:2', NO_PARAMS)] = _result('A:2')
+    # Touch A:1 so that A:2 is the least recently used.
+    assert cache[('A:1', NO_PARAMS)]
+    cache[('A:3', NO_PARAMS)] = _result('A:3')
+
+    assert set(cache) == {('A:1', NO_PARAMS), ('A:3', NO_PARAMS)}
+    assert cache.evictions == 1
+
+
+def test_null_results_have_their_own_budget():
+    cache = ResponseCache(policy=EvictionPolicy(positive=CacheBudget(max_entries=10),
+                                                null=CacheBudget(max_entries=1)))
+    cache.put_many({('FAKE:1', NO_PARAMS): None, ('FAKE:2', NO_PARAMS): None, ('A:1', NO_PARAMS): _result('A:1')})
+
+    assert set(cache) == {('FAKE:2', NO_PARAMS), ('A:1', NO_PARAMS)}
+    assert cache[('FAKE:2', NO_PARAMS)] is None
+
+
+def test_byte_budget():
+    size = approximate_size(_result('A:1', padding=1000))
+    cache = ResponseCache(policy=EvictionPolicy(positive=CacheBudget(max_bytes=int(size * 2.5))))
+    cache.put_many({(f'A:{i}', NO_PARAMS): _result(f'A:{i}', padding=1000) for i in range(1, 6)})
+
+    assert set(cache) == {('A:4', NO_PARAMS), ('A:5', NO_PARAMS)}
+    assert cache.positive.total_bytes <= size * 2.5
+
+
+def test_ttl():
+    cache = ResponseCache(policy=EvictionPolicy(positive=CacheBudget(ttl_seconds=0)))
+    cache[('A:1', NO_PARAMS)] = _result('A:1')
+    assert ('A:1', NO_PARAMS) not in cache
+
+
+def test_updating_a_key_moves_it_between_segments():
+    cache = ResponseCache()
+    cache[('A:1', NO_PARAMS)] = None
+    cache[('A:1', NO_PARAMS)] = _result('A:1')
+    assert len(cache) == 1
+    assert cache[('A:1', NO_PARAMS)] == _result('A:1')
+
+
+def test_invalidate_uses_identifier_index():
+    cache = ResponseCache()
+    conflated = frozenset({('conflate', 'true')})
+    cache.put_many({('A:1', NO_PARAMS): _result('A:1'), ('A:1', conflated): None, ('A:2', NO_PARAMS): _result('A:2')})
+    assert cache.positive.params_by_identifier['A:1'] == {NO_PARAMS}
+    assert cache.null.params_by_identifier['A:1'] == {conflated}
+
+    cache.invalidate('A:1')
+    assert set(cache) == {('A:2', NO_PARAMS)}
+    assert 'A:1' not in cache.positive.params_by_identifier
+    assert 'A:1' not in cache.null.params_by_identifier
+
+
+def test_invalidate_many_and_where(tmp_path):
+    store = PersistentCache(tmp_path / 'responses.sqlite3')
+    cache = ResponseCache(backing=store.namespace('https://example.org/', 'get_normalized_nodes'),
+                          policy=EvictionPolicy(positive=CacheBudget(max_entries=2)))
+    cache.put_many({(curie, NO_PARAMS): _result(curie) for curie in ['CHEBI:1', 'CHEBI:2', 'MONDO:1', 'MONDO:2']})
+
+    # CHEBI:1 and CHEBI:2 have been evicted from memory, but are still found in the persistent store.
+    assert cache.invalidate_where(lambda curie: curie.startswith('CHEBI:')) == {'CHEBI:1', 'CHEBI:2'}
+    assert ('CHEBI:1', NO_PARAMS) not in cache
+    assert ('MONDO:1', NO_PARAMS) in cache
+
+    cache.invalidate_many(['MONDO:1', 'MONDO:2'])
+    assert len(cache) == 0
+    assert ('MONDO:2', NO_PARAMS) not in cache
+    store.close()